@@ -1,4 +1,28 @@
+"""
+上下文缺口分析：找出被已匹配条目夹住的未匹配条目（任意长度的连续段），推算旧语音中对应的缺口，
+列出缺口中尚未使用的旧台词作为候选项，并按修复难易程度排序，为手动修复提供线索。
+
+重制版语音ID和已匹配旧语音的全局场景顺序（voice_id[3:10]）都转为排序后的 NumPy 数组，
+所有未匹配段、两侧锚点、旧缺口大小和可用旧台词数量在一次向量化计算中得出。
+
+缺口类型（按修复难易程度排序）：
+    aligned      缺口中未使用的旧台词数量与未匹配段长度相同，多半可以逐句对应。
+    split_merge  缺口中有未使用的旧台词，但数量不同，可能是拆分或合并过的台词。
+    inserted     两侧锚点在旧语音中相邻，缺口中没有可用的旧台词，多半是重制版新增的台词。
+    open         未匹配段位于开头或结尾，只有一侧锚点。
+    crossed      两侧锚点在旧语音中的顺序颠倒，需要先检查锚点本身。
+
+用法：
+    uv run analyze_context.py                    # 分析当前目录的匹配结果
+    uv run analyze_context.py batch/fc_cn batch/fc_jp
+"""
+import argparse
 import json
+import os
+
+import numpy as np
+
+from voice_records import parse_scene
 
 # --- 配置 ---
 MERGED_FILE = 'merged_voice_data.json'
@@ -6,100 +30,180 @@ UNMATCHED_FILE = 'unmatched_voice_data.json'
 OLD_VOICE_FILE = 'voice_data.json'
 OUTPUT_FILE = 'context_analysis_report.json'
 
-def parse_voice_id(voice_id):
-    """从语音ID（如 '0940010128V'）中提取数字部分。"""
-    try:
-        # 移除末尾的 'V' 并转换为整数
-        return int(voice_id[3:-1])
-    except (ValueError, TypeError):
-        return None
-
-def find_old_entry_by_numeric_id(numeric_id, old_voice_map):
-    """通过数字ID查找原始语音条目。"""
-    # 重新构建可能的ID格式，例如补零
-    # 注意：这里的格式可能需要根据实际情况调整
-    possible_id = f"{numeric_id:010d}V"
-    return old_voice_map.get(possible_id)
-
-def main():
-    """主函数，执行上下文分析。"""
+GAP_KINDS = ['aligned', 'split_merge', 'inserted', 'open', 'crossed']
+
+
+def find_gap_runs(new_ids, matched_orders, old_orders):
+    """
+    找出所有未匹配的连续段及其对应的旧缺口。
+
+    Args:
+        new_ids (np.ndarray): 排序后的重制版语音ID（已匹配和未匹配的条目）。
+        matched_orders (np.ndarray): 与 new_ids 对应的旧语音全局场景顺序，未匹配为 -1。
+        old_orders (np.ndarray): 排序后、去重的全部旧语音全局场景顺序。
+
+    Returns:
+        dict: 每个未匹配段一项的数组：start/end（new_ids 中的下标，end 不含）、length、
+            left/right（两侧锚点的旧场景顺序，没有锚点时为 -1）、lo/hi（缺口在 old_orders 中的下标范围）、
+            old_gap（缺口中的旧台词数量）、free（其中未被使用的数量）、kind（GAP_KINDS 中的下标）、
+            以及 used（old_orders 中已被使用的掩码）。
+    """
+    unmatched = matched_orders < 0
+    edges = np.diff(np.concatenate(([0], unmatched.astype(np.int8), [0])))
+    start = np.flatnonzero(edges == 1)
+    end = np.flatnonzero(edges == -1)
+    length = end - start
+
+    has_left = start > 0
+    has_right = end < len(new_ids)
+    left = np.where(has_left, matched_orders[np.maximum(start - 1, 0)], -1)
+    right = np.where(has_right, matched_orders[np.minimum(end, len(new_ids) - 1)], -1)
+
+    used = np.isin(old_orders, matched_orders[~unmatched])
+    free_before = np.concatenate(([0], np.cumsum(~used)))
+    ordered = has_left & has_right & (right >= left)
+    lo = np.where(has_left, np.searchsorted(old_orders, left, side='right'), 0)
+    hi = np.where(has_right, np.searchsorted(old_orders, right, side='left'), len(old_orders))
+    hi = np.maximum(hi, lo)
+    old_gap = np.where(ordered, hi - lo, 0)
+    free = np.where(ordered, free_before[hi] - free_before[lo], 0)
+
+    kind = np.select(
+        [~(has_left & has_right), ~ordered, free == length, free > 0],
+        [GAP_KINDS.index('open'), GAP_KINDS.index('crossed'), GAP_KINDS.index('aligned'), GAP_KINDS.index('split_merge')],
+        GAP_KINDS.index('inserted'),
+    )
+    return {
+        'start': start, 'end': end, 'length': length, 'left': left, 'right': right,
+        'lo': lo, 'hi': hi, 'old_gap': old_gap, 'free': free, 'kind': kind, 'used': used,
+    }
+
+
+def rank_gap_runs(runs):
+    """按修复难易程度排序：缺口类型、可用旧台词数量与段长度之差、段长度。返回排序后的下标。"""
+    return np.lexsort((runs['start'], runs['length'], np.abs(runs['free'] - runs['length']), runs['kind']))
+
+
+def analyze(merged_data, unmatched_data, old_data, max_candidates=20):
+    """
+    生成缺口分析报告。
+
+    Args:
+        merged_data (list): merged_voice_data.json 的内容。
+        unmatched_data (list): unmatched_voice_data.json 的内容。
+        old_data (list): voice_data.json 的内容。
+        max_candidates (int): 每个缺口最多列出的候选旧台词数量。
+
+    Returns:
+        list: 按修复难易程度排序的报告条目。
+    """
+    records = {entry['new_voice_id']: entry for entry in unmatched_data}
+    records.update((entry['new_voice_id'], entry) for entry in merged_data)
+    new_ids = np.array(sorted(records), dtype=np.int64)
+    matched_orders = np.array([
+        parse_scene(records[new_voice_id].get('old_voice_id'))[2] for new_voice_id in new_ids.tolist()
+    ], dtype=np.int64)
+
+    old_by_order = {}
+    for entry in old_data:
+        old_by_order.setdefault(parse_scene(entry['voice_id'])[2], entry)
+    old_by_order.pop(-1, None)
+    old_orders = np.array(sorted(old_by_order), dtype=np.int64)
+
+    runs = find_gap_runs(new_ids, matched_orders, old_orders)
+    used = runs['used']
+
+    def anchor(index):
+        if index < 0 or index >= len(new_ids):
+            return None
+        entry = records[int(new_ids[index])]
+        return {
+            'new_voice_id': entry['new_voice_id'],
+            'new_text': entry.get('new_text'),
+            'old_voice_id': entry.get('old_voice_id'),
+            'old_text': entry.get('old_text'),
+        }
+
+    report = []
+    for rank, i in enumerate(rank_gap_runs(runs).tolist(), 1):
+        start, end = int(runs['start'][i]), int(runs['end'][i])
+        lo, hi = int(runs['lo'][i]), int(runs['hi'][i])
+        kind = GAP_KINDS[runs['kind'][i]]
+        unmatched = [records[int(new_voice_id)] for new_voice_id in new_ids[start:end].tolist()]
+        candidates = []
+        if kind not in ('open', 'crossed'):
+            free_positions = lo + np.flatnonzero(~used[lo:hi])[:max_candidates]
+            candidates = [old_by_order[int(order)] for order in old_orders[free_positions].tolist()]
+
+        item = {
+            'rank': rank,
+            'kind': kind,
+            'unmatched_new_voice_ids': [entry['new_voice_id'] for entry in unmatched],
+            'run_length': end - start,
+            'old_gap': int(runs['old_gap'][i]),
+            'free_old_lines': int(runs['free'][i]),
+            'previous': anchor(start - 1),
+            'next': anchor(end),
+            'unmatched': [{'new_voice_id': entry['new_voice_id'], 'text': entry.get('text')} for entry in unmatched],
+            'candidates': [{'old_voice_id': entry['voice_id'], 'text': entry.get('text')} for entry in candidates],
+        }
+        if kind == 'aligned':
+            # 逐句对应时给出与前后锚点一起的对照
+            item['comparison'] = [
+                {'context': 'previous', 'new_text': item['previous']['new_text'], 'old_text': item['previous']['old_text']},
+                *(
+                    {'context': 'current_unmatched', 'new_text': entry.get('text'), 'old_text': candidate.get('text')}
+                    for entry, candidate in zip(unmatched, candidates)
+                ),
+                {'context': 'next', 'new_text': item['next']['new_text'], 'old_text': item['next']['old_text']},
+            ]
+        report.append(item)
+    return report
+
+
+def analyze_directory(directory, old_voice_file=None, max_candidates=20):
+    """分析一个匹配输出目录，报告写入该目录。旧语音数据默认使用目录中的 voice_data.json，没有时使用当前目录的。"""
+    if old_voice_file is None:
+        old_voice_file = os.path.join(directory, OLD_VOICE_FILE)
+        if not os.path.exists(old_voice_file):
+            old_voice_file = OLD_VOICE_FILE
     try:
-        with open(MERGED_FILE, 'r', encoding='utf-8') as f:
+        with open(os.path.join(directory, MERGED_FILE), 'r', encoding='utf-8') as f:
             merged_data = json.load(f)
-        with open(UNMATCHED_FILE, 'r', encoding='utf-8') as f:
+        with open(os.path.join(directory, UNMATCHED_FILE), 'r', encoding='utf-8') as f:
             unmatched_data = json.load(f)
-        with open(OLD_VOICE_FILE, 'r', encoding='utf-8') as f:
+        with open(old_voice_file, 'r', encoding='utf-8') as f:
             old_data = json.load(f)
     except FileNotFoundError as e:
         print(f"错误：找不到文件 {e.filename}")
-        return
-
-    # --- 数据准备 ---
-    # 创建高效的查找映射
-    merged_map = {entry['new_voice_id']: entry for entry in merged_data}
-    unmatched_map = {entry['new_voice_id']: entry for entry in unmatched_data}
-    old_voice_map = {entry['voice_id']: entry for entry in old_data}
-
-    analysis_report = []
-    processed_unmatched_ids = set()
-
-    print(f"开始分析 {len(unmatched_data)} 条未匹配数据...")
-
-    # 遍历所有未匹配的条目
-    for unmatched_entry in sorted(unmatched_data, key=lambda x: x['new_voice_id']):
-        unmatched_id = unmatched_entry['new_voice_id']
-
-        if unmatched_id in processed_unmatched_ids:
-            continue
-
-        # 寻找上下文（前一条和后一条）
-        prev_id = unmatched_id - 1
-        next_id = unmatched_id + 1
-
-        # 检查前后条目是否都在已匹配的数据中
-        if prev_id in merged_map and next_id in merged_map:
-            prev_match = merged_map[prev_id]
-            next_match = merged_map[next_id]
-
-            prev_old_id_num = parse_voice_id(prev_match.get('old_voice_id'))
-            next_old_id_num = parse_voice_id(next_match.get('old_voice_id'))
-
-            # 确认旧ID是连续的，中间只差一个
-            if prev_old_id_num and next_old_id_num and (next_old_id_num - prev_old_id_num) == 2:
-                inferred_old_id_num = prev_old_id_num + 1
-                inferred_old_entry = find_old_entry_by_numeric_id(inferred_old_id_num, old_voice_map)
-
-                if inferred_old_entry:
-                    context = {
-                        'unmatched_new_voice_id': unmatched_id,
-                        'comparison': [
-                            {
-                                'context': 'previous',
-                                'new_text': prev_match.get('new_text'),
-                                'old_text': prev_match.get('old_text'),
-                            },
-                            {
-                                'context': 'current_unmatched',
-                                'new_text': unmatched_entry.get('text'),
-                                'old_text': inferred_old_entry.get('text'),
-                            },
-                            {
-                                'context': 'next',
-                                'new_text': next_match.get('new_text'),
-                                'old_text': next_match.get('old_text'),
-                            }
-                        ]
-                    }
-                    analysis_report.append(context)
-                    processed_unmatched_ids.add(unmatched_id)
-
-    # 保存报告
-    with open(OUTPUT_FILE, 'w', encoding='utf-8') as f:
-        json.dump(analysis_report, f, ensure_ascii=False, indent=4)
-
-    print("\n--- 分析完成 ---")
-    print(f"发现并报告了 {len(analysis_report)} 个有问题的上下文。")
-    print(f"报告已保存到: {OUTPUT_FILE}")
+        return None
+
+    report = analyze(merged_data, unmatched_data, old_data, max_candidates)
+    output_path = os.path.join(directory, OUTPUT_FILE)
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=4)
+
+    counts = {kind: 0 for kind in GAP_KINDS}
+    for item in report:
+        counts[item['kind']] += 1
+    print(f"\n--- {directory}: {len(unmatched_data)} 条未匹配数据，{len(report)} 个缺口 ---")
+    print("，".join(f"{kind}: {count}" for kind, count in counts.items()))
+    print(f"其中多句缺口: {sum(1 for item in report if item['run_length'] > 1)}")
+    print(f"报告已保存到: {output_path}")
+    return report
+
+
+def main():
+    """主函数，执行上下文缺口分析。"""
+    parser = argparse.ArgumentParser(description="分析未匹配语音所在的上下文缺口，按修复难易程度排序。")
+    parser.add_argument('dirs', nargs='*', default=['.'], help='匹配输出目录，可以有多个（如 batch_match.py 的 batch/<name>，默认: 当前目录）')
+    parser.add_argument('--old-voice-data', default=None, help=f'旧语音数据 (默认: 各目录中的 {OLD_VOICE_FILE}，没有时使用当前目录的)')
+    parser.add_argument('--max-candidates', type=int, default=20, help='每个缺口最多列出的候选旧台词数量 (默认: 20)')
+    args = parser.parse_args()
+
+    for directory in args.dirs:
+        analyze_directory(directory, args.old_voice_data, args.max_candidates)
+
 
 if __name__ == '__main__':
     main()
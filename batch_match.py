@@ -0,0 +1,206 @@
+"""
+多游戏、多语言的批量匹配。
+
+任务列表是一个 JSON 数组，每个任务对应一组（游戏, 语言）：
+
+    [
+        {"name": "fc_cn", "script_dir": "SoraVoiceScripts/cn.fc/out.msg", "t_voice": "games/fc/t_voice.json"},
+        {"name": "fc_jp", "script_dir": "SoraVoiceScripts/jp.fc/out.msg", "t_voice": "games/fc/t_voice.json",
+         "args": ["--match-battle", "--incremental"]}
+    ]
+
+字段：
+    name        任务名，同时作为结果数据库中的游戏标识。
+    t_voice     重制版 t_voice.json（默认与 match_voices.py 相同）。
+    script_dir  旧版脚本目录。设置时先提取到输出目录下的 voice_data.json / script_data.json，
+                脚本目录没有比提取结果更新的文件时跳过提取。
+    voice_data, script_data
+                已提取的旧版数据，不设置 script_dir 时使用（默认与 match_voices.py 相同）。
+    output_dir  结果输出目录（默认: batch/<name>），match_voices.py 的全部输出文件都写入这里。
+    args        传给 match_voices.py 的其余参数。
+
+所有任务在同一进程中运行：模型只加载一次，向量缓存由所有任务共用（不同任务中相同的台词只编码一次），
+任务按 --jobs 在线程中并发调度。模型编码在任务之间串行执行，数据加载、分块匹配、局部窗口搜索和复核等
+其余阶段并发执行。
+
+用法：
+    uv run batch_match.py jobs.json --jobs 3
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from embedding_cache import EMBEDDING_CACHE_FILE, EmbeddingCache
+from extract_voice_data import OUTPUT_FILE, OUTPUT_SCRIPT_FILE, extract
+from match_logging import setup_logging
+from model_artifact import MODEL_ARTIFACT_DIR, ModelArtifactError, load_model, model_key
+from match_voices import MatchPaths, build_arg_parser, create_empty_wav_file, run_matching
+
+logger = logging.getLogger()
+
+
+class SharedModel:
+    """多个任务线程共用的模型。encode 串行执行，因为 tokenizer 不支持多个线程同时使用。"""
+
+    def __init__(self, model):
+        self._model = model
+        self._lock = threading.Lock()
+
+    def encode(self, *args, **kwargs):
+        with self._lock:
+            return self._model.encode(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._model, name)
+
+
+class JobNameFilter(logging.Filter):
+    """任务线程输出的日志加上任务名前缀，避免并发任务的日志混在一起无法区分。"""
+
+    def filter(self, record):
+        if record.threadName.startswith('job:'):
+            record.msg = f"[{record.threadName[4:]}] {record.msg}"
+        return True
+
+
+def load_jobs(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        jobs = json.load(f)
+    names = set()
+    for job in jobs:
+        if 'name' not in job:
+            raise ValueError(f"任务缺少 name 字段: {job}")
+        if job['name'] in names:
+            raise ValueError(f"任务名重复: {job['name']}")
+        names.add(job['name'])
+    return jobs
+
+
+def needs_extraction(script_dir, outputs):
+    """提取结果不存在，或脚本目录中有比提取结果更新的文件时需要重新提取。"""
+    if not all(os.path.exists(path) for path in outputs):
+        return True
+    extracted_at = min(os.path.getmtime(path) for path in outputs)
+    return any(
+        os.path.getmtime(os.path.join(script_dir, name)) > extracted_at
+        for name in os.listdir(script_dir)
+    )
+
+
+def prepare_job(job):
+    """解析任务的参数和路径。"""
+    output_dir = job.get('output_dir', os.path.join('batch', job['name']))
+    paths = MatchPaths(output_dir=output_dir)
+    if 't_voice' in job:
+        paths.new_voice_file = job['t_voice']
+    if 'script_dir' in job:
+        paths.old_voice_file = os.path.join(output_dir, OUTPUT_FILE)
+        paths.old_script_file = os.path.join(output_dir, OUTPUT_SCRIPT_FILE)
+    else:
+        paths.old_voice_file = job.get('voice_data', paths.old_voice_file)
+        paths.old_script_file = job.get('script_data', paths.old_script_file)
+
+    args = build_arg_parser().parse_args(job.get('args', []))
+    if args.game is None:
+        args.game = job['name']
+    return paths, args
+
+
+def run_job(job, paths, args, shared_model, shared_embedding_cache):
+    """运行一个任务，返回 (统计, 用时)。统计为 None 表示失败。"""
+    threading.current_thread().name = f"job:{job['name']}"
+    started = time.time()
+    try:
+        os.makedirs(paths.output_dir, exist_ok=True)
+        if 'script_dir' in job:
+            outputs = [paths.old_voice_file, paths.old_script_file]
+            if needs_extraction(job['script_dir'], outputs):
+                logger.info(f"正在从 {job['script_dir']} 提取旧版数据...")
+                if not extract(job['script_dir'], *outputs):
+                    return None, time.time() - started
+            else:
+                logger.info("旧版数据已是最新，跳过提取。")
+        stats = run_matching(args, paths, shared_model=shared_model, shared_embedding_cache=shared_embedding_cache)
+    except Exception:
+        logger.exception("任务失败")
+        stats = None
+    finally:
+        threading.current_thread().name = 'worker'
+    return stats, time.time() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description='按任务列表批量匹配多个游戏/语言，共用模型和向量缓存。')
+    parser.add_argument('job_file', help='任务列表 JSON 文件')
+    parser.add_argument('--jobs', type=int, default=2, help='同时运行的任务数 (默认: 2)')
+    parser.add_argument('--only', nargs='+', metavar='NAME', help='只运行这些任务')
+    parser.add_argument('-v', '--verbose', action='store_true', help='在控制台输出逐条目的日志')
+    parser.add_argument('--model-dir', default=MODEL_ARTIFACT_DIR, help=f'所有任务共用的本地模型目录 (默认: {MODEL_ARTIFACT_DIR})')
+    parser.add_argument('--embedding-cache', default=EMBEDDING_CACHE_FILE, help=f'所有任务共用的向量缓存文件 (默认: {EMBEDDING_CACHE_FILE})')
+    args = parser.parse_args()
+    setup_logging(verbose=args.verbose, filters=[JobNameFilter()])
+
+    try:
+        jobs = load_jobs(args.job_file)
+    except (FileNotFoundError, json.JSONDecodeError, ValueError) as e:
+        logger.error(f"错误：无法读取任务列表 {args.job_file}: {e}")
+        sys.exit(1)
+    if args.only:
+        jobs = [job for job in jobs if job['name'] in args.only]
+    prepared = [(job, *prepare_job(job)) for job in jobs]
+    # 所有任务共用这里加载的模型，向量缓存和匹配选项的指纹也按同一个模型目录计算
+    for _, _, job_args in prepared:
+        job_args.model_dir = args.model_dir
+
+    empty_wav_args = [job_args for _, _, job_args in prepared if job_args.map_failed_to_empty]
+    if empty_wav_args:
+        create_empty_wav_file(Path('voice/wav/EMPTY.wav'), empty_wav_args[0].empty_wav_rate)
+
+    shared_model = None
+    if any(not job_args.no_similarity_search for _, _, job_args in prepared):
+        logger.info(f"正在从 {args.model_dir} 加载文本向量化模型...")
+        try:
+            shared_model = SharedModel(load_model(args.model_dir))
+        except ModelArtifactError as e:
+            logger.error(f"错误：{e}")
+            sys.exit(1)
+        logger.info("模型加载完成。")
+    shared_embedding_cache = EmbeddingCache(args.embedding_cache, model_key(args.model_dir))
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        futures = {
+            job['name']: executor.submit(run_job, job, paths, job_args, shared_model, shared_embedding_cache)
+            for job, paths, job_args in prepared
+        }
+        for name, future in futures.items():
+            results[name] = future.result()
+    shared_embedding_cache.save()
+
+    logger.info("\n--- 批量匹配完成 ---")
+    failed = 0
+    for job, paths, _ in prepared:
+        stats, seconds = results[job['name']]
+        if stats is None:
+            failed += 1
+            logger.info(f"{job['name']}: 失败 ({seconds:.1f} 秒)")
+        elif not stats:
+            logger.info(f"{job['name']}: 完成 ({seconds:.1f} 秒)")
+        else:
+            logger.info(
+                f"{job['name']}: 成功 {stats['matched']}/{stats['processed']} "
+                f"(向量搜索 {stats['vector_search']}，局部窗口 {stats['locality']}，拆分/合并 {stats['split_merge']})，"
+                f"{seconds:.1f} 秒，输出目录 {paths.output_dir}"
+            )
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,10 @@
-from sentence_transformers import SentenceTransformer, util
+from sentence_transformers import util
+
+from model_artifact import MODEL_ARTIFACT_DIR, load_model
 
 # Load the model used in the main script
-print("Loading model (paraphrase-multilingual-MiniLM-L12-v2)...")
-model = SentenceTransformer('paraphrase-multilingual-MiniLM-L12-v2')
+print(f"Loading model ({MODEL_ARTIFACT_DIR})...")
+model = load_model(MODEL_ARTIFACT_DIR)
 print("Model loaded.")
 
 # Sentences to compare
@@ -0,0 +1,118 @@
+"""
+匹配运行的阶段检查点。
+
+每个完成的阶段（精确/上下文匹配、局部窗口搜索、向量搜索的每个分块）把结果写入检查点目录中的一个
+JSON 文件，写入通过临时文件加 os.replace 完成，中途中断不会留下不完整的文件。检查点目录中的 manifest
+记录输入文件、匹配选项和待匹配条目的指纹；以 --resume 运行时只有指纹一致才会沿用已完成的阶段，
+否则清空目录重新开始。运行成功结束后检查点目录会被删除。
+"""
+import hashlib
+import json
+import os
+import shutil
+
+from voice_records import CandidateRecord
+
+# 检查点目录
+CHECKPOINT_DIR = '.match_checkpoint'
+MANIFEST_FILE = 'manifest.json'
+
+
+def file_digest(path):
+    """文件内容的摘要，文件不存在时为 None。"""
+    h = hashlib.blake2b(digest_size=16)
+    try:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+    except FileNotFoundError:
+        return None
+    return h.hexdigest()
+
+
+def run_fingerprint(*parts):
+    """输入文件摘要、匹配选项、待匹配条目等组成的运行指纹。"""
+    h = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        h.update(str(part).encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+def write_json_atomic(path, data):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+class RunCheckpoint:
+    """
+    一次匹配运行的检查点目录。
+
+    Args:
+        directory (str): 检查点目录。
+        fingerprint (str): 输入与选项的指纹。
+        resume (bool): 为 True 且目录中的指纹一致时沿用已完成的阶段，否则清空目录。
+    """
+
+    def __init__(self, directory, fingerprint, resume):
+        self.directory = directory
+        self.fingerprint = fingerprint
+        manifest = None
+        try:
+            with open(os.path.join(directory, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+        self.resumed = bool(resume and manifest and manifest.get('fingerprint') == fingerprint)
+        self.mismatched = bool(resume and manifest and not self.resumed)
+        if not self.resumed:
+            shutil.rmtree(directory, ignore_errors=True)
+            os.makedirs(directory, exist_ok=True)
+            write_json_atomic(os.path.join(directory, MANIFEST_FILE), {'fingerprint': fingerprint})
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _stage_path(self, stage):
+        return os.path.join(self.directory, f'{stage}.json')
+
+    def load(self, stage):
+        """读取已完成阶段的结果，未完成时返回 None。"""
+        if not self.resumed:
+            return None
+        try:
+            with open(self._stage_path(stage), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def save(self, stage, data):
+        write_json_atomic(self._stage_path(stage), data)
+
+    def finish(self):
+        """运行成功结束，删除检查点目录。"""
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def dump_match(new_entry, old_entry, match_type):
+    return [new_entry.id, old_entry.voice_id, old_entry.script_id, match_type]
+
+
+def load_match(row, entry_by_id, old_entry_by_key):
+    """dump_match 的逆操作，返回 (新条目, 旧条目, match_type)。"""
+    new_voice_id, old_voice_id, old_script_id, match_type = row
+    return entry_by_id[new_voice_id], old_entry_by_key[(old_voice_id, old_script_id)], match_type
+
+
+def dump_candidate(candidate):
+    return [
+        candidate.new_voice_id, candidate.stage, candidate.old_entry.voice_id, candidate.old_entry.script_id,
+        candidate.score, candidate.text_similarity, candidate.verifier, candidate.accepted
+    ]
+
+
+def load_candidate(row, old_entry_by_key):
+    new_voice_id, stage, old_voice_id, old_script_id, score, text_similarity, verifier, accepted = row
+    return CandidateRecord(new_voice_id, stage, old_entry_by_key[(old_voice_id, old_script_id)], score, text_similarity, verifier, accepted)
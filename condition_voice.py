@@ -0,0 +1,442 @@
+"""
+转换后的 Evo 语音的音频整理：重采样、响度标准化、去除首尾静音。
+
+ATRACTool 转换出的 WAV（voice/wav）采样率、声道和音量各不相同，直接打包会让 voice.pac 中的语音
+音量不一致且体积偏大。本脚本把每个文件整理为统一的采样率和声道数，写入 voice/conditioned/wav：
+
+1. 第一遍按固定大小的 NumPy 分块读取文件，转换声道并重采样（多相窗函数 sinc 插值，分块之间保留滤波器的历史），
+   同时记录每 10 毫秒一帧的能量和峰值。
+2. 根据帧能量计算门限积分响度（400 毫秒块、75% 重叠，绝对门限 -70 dB、相对门限 -10 dB，与 ITU-R BS.1770
+   的门限方式相同，但不做 K 加权），得到把响度调整到目标值的增益，并限制增益使峰值不超过上限。
+3. 根据增益后的帧能量找到首尾的静音，保留少量余量后裁掉。
+4. 第二遍应用增益和裁剪，按分块写出 16 位 PCM。较短的文件直接复用第一遍的重采样结果，较长的文件重新读取，
+   内存占用与文件长度无关。
+
+文件由进程池并行处理。输出文件比源文件新、且整理参数与上一次相同时跳过；输出先写入临时文件再替换，
+中断不会留下不完整的文件。
+
+用法：
+    uv run condition_voice.py
+    uv run condition_voice.py --input voice/wav --output voice/conditioned/wav --sample-rate 24000 --workers 8
+"""
+import argparse
+import json
+import math
+import os
+import time
+import wave
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+
+import numpy as np
+from tqdm import tqdm
+
+from checkpoints import run_fingerprint, write_json_atomic
+
+# 输入目录：转换后的 Evo 语音
+INPUT_DIR = os.path.join('voice', 'wav')
+# 输出目录：整理后的语音，package_assets.ps1 -VoiceDir voice\conditioned 打包这里的文件
+OUTPUT_DIR = os.path.join('voice', 'conditioned', 'wav')
+# 输出目录中记录整理参数的状态文件，参数变化时全部重新整理
+CONDITION_STATE_FILE = '.condition_state.json'
+# 默认的目标格式，match_voices.py 生成的 EMPTY.wav 使用相同的格式
+TARGET_SAMPLE_RATE = 22050
+TARGET_CHANNELS = 1
+
+# 每次读取的帧数
+CHUNK_FRAMES = 1 << 16
+# 重采样结果不超过这么多个采样时保留在内存中，第二遍不再重新读取
+MAX_BUFFERED_SAMPLES = 1 << 22
+# 能量帧长度（毫秒）；响度块为 40 帧（400 毫秒），步长 10 帧
+ENERGY_FRAME_MS = 10
+LOUDNESS_BLOCK_FRAMES = 40
+LOUDNESS_STEP_FRAMES = 10
+ABSOLUTE_GATE_DB = -70.0
+RELATIVE_GATE_DB = -10.0
+
+
+@dataclass
+class ConditionSettings:
+    """整理参数。任何一项变化都会让已有的输出失效。"""
+    sample_rate: int = TARGET_SAMPLE_RATE
+    channels: int = TARGET_CHANNELS
+    target_loudness: float = -20.0
+    peak_ceiling: float = -1.0
+    silence_threshold: float = -50.0
+    trim_padding_ms: int = 50
+    min_duration_ms: int = 100
+    resample_zeros: int = 16
+
+
+def to_db(mean_square):
+    return 10.0 * math.log10(mean_square) if mean_square > 0 else -math.inf
+
+
+# --- 读写 ---
+
+def decode_frames(data, sampwidth, channels):
+    """PCM 字节 -> (帧数, 声道数) 的 float32 数组，取值范围 [-1, 1)。"""
+    if sampwidth == 1:
+        samples = (np.frombuffer(data, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif sampwidth == 2:
+        samples = np.frombuffer(data, dtype='<i2').astype(np.float32) / 32768.0
+    elif sampwidth == 3:
+        raw = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        values = raw[:, 0] | (raw[:, 1] << 8) | (raw[:, 2] << 16)
+        values = np.where(values >= 1 << 23, values - (1 << 24), values)
+        samples = values.astype(np.float32) / float(1 << 23)
+    elif sampwidth == 4:
+        samples = np.frombuffer(data, dtype='<i4').astype(np.float32) / float(1 << 31)
+    else:
+        raise ValueError(f"不支持的采样位宽: {sampwidth} 字节")
+    return samples.reshape(-1, channels)
+
+
+def encode_frames(samples):
+    """(帧数, 声道数) 的 float32 数组 -> 16 位 PCM 字节。"""
+    return (np.clip(samples, -1.0, 32767 / 32768) * 32768.0).round().astype('<i2').tobytes()
+
+
+def convert_channels(samples, channels):
+    """声道转换：转为单声道时取平均，从单声道增加声道时复制。"""
+    if samples.shape[1] == channels:
+        return samples
+    if channels == 1:
+        return samples.mean(axis=1, keepdims=True)
+    if samples.shape[1] == 1:
+        return np.repeat(samples, channels, axis=1)
+    raise ValueError(f"无法把 {samples.shape[1]} 声道转换为 {channels} 声道")
+
+
+def read_chunks(path, channels, chunk_frames=CHUNK_FRAMES):
+    """按分块读取 WAV 文件，返回 (采样率, 帧数, 分块生成器)，分块已转换为目标声道数。"""
+    wav_file = wave.open(path, 'rb')
+    rate = wav_file.getframerate()
+
+    def chunks():
+        with wav_file:
+            while True:
+                data = wav_file.readframes(chunk_frames)
+                if not data:
+                    break
+                yield convert_channels(decode_frames(data, wav_file.getsampwidth(), wav_file.getnchannels()), channels)
+
+    return rate, wav_file.getnframes(), chunks()
+
+
+# --- 重采样 ---
+
+class Resampler:
+    """
+    流式多相重采样器。
+
+    采样率之比化为最简分数 up/down，每个输出采样位于输入时间 n * down / up，用对应相位的窗函数 sinc 滤波器
+    （Hann 窗，每侧 zeros 个过零点，降采样时按比例放宽）对邻近的输入采样加权求和。
+    分块之间保留滤波器需要的历史采样，因此分块处理与一次性处理的结果相同。
+    """
+
+    def __init__(self, src_rate, dst_rate, channels, zeros=16):
+        divisor = math.gcd(src_rate, dst_rate)
+        self.up = dst_rate // divisor
+        self.down = src_rate // divisor
+        self.passthrough = self.up == self.down
+        cutoff = min(1.0, dst_rate / src_rate)
+        self.half = int(math.ceil(zeros / cutoff))
+        # 每个输出采样使用输入下标 base + offsets 处的采样
+        self.offsets = np.arange(-self.half + 1, self.half + 1)
+        phases = np.arange(self.up)[:, None] / self.up
+        distance = phases - self.offsets[None, :]
+        window = 0.5 + 0.5 * np.cos(np.pi * np.clip(distance / self.half, -1.0, 1.0))
+        bank = cutoff * np.sinc(cutoff * distance) * window
+        self.bank = (bank / bank.sum(axis=1, keepdims=True)).astype(np.float32)
+        # 缓冲区开头对应的输入下标；开头补 half 个零，使第一个输出采样有完整的历史
+        self.buffer = np.zeros((self.half, channels), dtype=np.float32)
+        self.buffer_start = -self.half
+        self.consumed = 0
+        self.next_output = 0
+
+    def _emit(self, end):
+        if end <= self.next_output:
+            return np.zeros((0, self.buffer.shape[1]), dtype=np.float32)
+        outputs = np.arange(self.next_output, end, dtype=np.int64)
+        positions = outputs * self.down
+        bases = positions // self.up
+        phases = positions % self.up
+        indices = bases[:, None] + self.offsets[None, :] - self.buffer_start
+        result = np.einsum('nkc,nk->nc', self.buffer[indices], self.bank[phases])
+        self.next_output = end
+        # 丢弃之后的输出不再需要的采样
+        drop = self.next_output * self.down // self.up - self.half + 1 - self.buffer_start
+        if drop > 0:
+            self.buffer = self.buffer[drop:]
+            self.buffer_start += drop
+        return result
+
+    def process(self, samples):
+        if self.passthrough:
+            return samples
+        self.buffer = np.concatenate([self.buffer, samples])
+        self.consumed += len(samples)
+        # 输出采样 n 需要输入下标不超过 base(n) + half 的采样
+        last_usable = self.buffer_start + len(self.buffer) - 1 - self.half
+        if last_usable < 0:
+            return self._emit(self.next_output)
+        return self._emit(((last_usable + 1) * self.up + self.down - 1) // self.down)
+
+    def flush(self):
+        """输入结束：末尾补零，输出剩余的采样。"""
+        if self.passthrough:
+            return np.zeros((0, self.buffer.shape[1]), dtype=np.float32)
+        self.buffer = np.concatenate([self.buffer, np.zeros((self.half, self.buffer.shape[1]), dtype=np.float32)])
+        return self._emit((self.consumed * self.up + self.down - 1) // self.down)
+
+
+def resampled_chunks(path, settings):
+    """按分块读取并重采样，返回 (预计的输出帧数, 分块生成器)。"""
+    rate, source_frames, chunks = read_chunks(path, settings.channels)
+    resampler = Resampler(rate, settings.sample_rate, settings.channels, settings.resample_zeros)
+
+    def generate():
+        for chunk in chunks:
+            output = resampler.process(chunk)
+            if len(output):
+                yield output
+        tail = resampler.flush()
+        if len(tail):
+            yield tail
+
+    return source_frames * settings.sample_rate // rate, generate()
+
+
+# --- 分析 ---
+
+class EnergyMeter:
+    """流式统计每个能量帧的均方值（各声道平均）和峰值。"""
+
+    def __init__(self, frame_length):
+        self.frame_length = frame_length
+        self.pending = np.zeros(0, dtype=np.float32)
+        self.energies = []
+        self.peak = 0.0
+        self.length = 0
+
+    def add(self, samples):
+        self.length += len(samples)
+        if len(samples):
+            self.peak = max(self.peak, float(np.abs(samples).max()))
+        squares = np.concatenate([self.pending, (samples * samples).mean(axis=1)])
+        whole = len(squares) // self.frame_length * self.frame_length
+        if whole:
+            self.energies.append(squares[:whole].reshape(-1, self.frame_length).mean(axis=1))
+        self.pending = squares[whole:]
+
+    def finish(self):
+        if len(self.pending):
+            self.energies.append(np.array([self.pending.mean()], dtype=np.float32))
+        return np.concatenate(self.energies) if self.energies else np.zeros(0, dtype=np.float32)
+
+
+def gated_loudness(energies):
+    """门限积分响度 (dB)。没有超过绝对门限的块时为 None。"""
+    if len(energies) == 0:
+        return None
+    if len(energies) < LOUDNESS_BLOCK_FRAMES:
+        blocks = np.array([energies.mean()])
+    else:
+        sums = np.concatenate([[0.0], np.cumsum(energies, dtype=np.float64)])
+        starts = np.arange(0, len(energies) - LOUDNESS_BLOCK_FRAMES + 1, LOUDNESS_STEP_FRAMES)
+        blocks = (sums[starts + LOUDNESS_BLOCK_FRAMES] - sums[starts]) / LOUDNESS_BLOCK_FRAMES
+    gated = blocks[blocks > 10 ** (ABSOLUTE_GATE_DB / 10)]
+    if len(gated) == 0:
+        return None
+    relative_gate = gated.mean() * 10 ** (RELATIVE_GATE_DB / 10)
+    gated = gated[gated > relative_gate]
+    return to_db(float(gated.mean()))
+
+
+def plan_conditioning(energies, peak, frame_length, length, settings):
+    """
+    根据第一遍的统计计算增益和保留的帧范围。length 为重采样后的总帧数。
+
+    Returns:
+        tuple: (线性增益, 起始帧, 结束帧, 测得的响度)。结束帧可能超出 length（补足最短时长时）。
+    """
+    loudness = gated_loudness(energies)
+    gain_db = 0.0 if loudness is None else settings.target_loudness - loudness
+    if peak > 0:
+        gain_db = min(gain_db, settings.peak_ceiling - 20.0 * math.log10(peak))
+
+    padding = settings.trim_padding_ms * settings.sample_rate // 1000
+    min_length = settings.min_duration_ms * settings.sample_rate // 1000
+    # 增益后能量仍低于静音门限的帧视为静音
+    voiced = np.flatnonzero(energies * 10 ** (gain_db / 10) > 10 ** (settings.silence_threshold / 10))
+    if len(voiced):
+        start = max(0, voiced[0] * frame_length - padding)
+        end = min(length, (voiced[-1] + 1) * frame_length + padding)
+    else:
+        start, end = 0, 0
+    if end - start < min_length:
+        # 过短（或全部静音，如 EMPTY.wav）时从中间向两侧补足最短时长
+        middle = (start + end) // 2
+        start = max(0, middle - min_length // 2)
+        end = start + min_length
+    return 10 ** (gain_db / 20), start, end, loudness
+
+
+# --- 单个文件 ---
+
+def condition_file(source, target, settings):
+    """整理一个文件。返回 (源文件大小, 输出文件大小, 测得的响度)。"""
+    settings = ConditionSettings(**settings)
+    frame_length = max(1, settings.sample_rate * ENERGY_FRAME_MS // 1000)
+    meter = EnergyMeter(frame_length)
+    expected_frames, chunks = resampled_chunks(source, settings)
+    buffered = [] if expected_frames * settings.channels <= MAX_BUFFERED_SAMPLES else None
+    for chunk in chunks:
+        meter.add(chunk)
+        if buffered is not None:
+            buffered.append(chunk)
+    length = meter.length
+    gain, start, end, loudness = plan_conditioning(meter.finish(), meter.peak, frame_length, length, settings)
+
+    if buffered is None:
+        _, buffered = resampled_chunks(source, settings)
+    tmp_path = target + '.tmp'
+    try:
+        with wave.open(tmp_path, 'wb') as wav_file:
+            wav_file.setnchannels(settings.channels)
+            wav_file.setsampwidth(2)
+            wav_file.setframerate(settings.sample_rate)
+            position = 0
+            for chunk in buffered:
+                chunk_start, chunk_end = position, position + len(chunk)
+                position = chunk_end
+                lo, hi = max(start, chunk_start), min(end, chunk_end)
+                if lo < hi:
+                    wav_file.writeframes(encode_frames(chunk[lo - chunk_start:hi - chunk_start] * gain))
+            # 补足最短时长时可能超出文件末尾
+            if end > length:
+                wav_file.writeframes(b'\0' * 2 * settings.channels * (end - max(start, length)))
+        os.replace(tmp_path, target)
+    except BaseException:
+        # 重采样或写入失败（包括中断）时删除未写完的临时文件，不留在输出目录中
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return os.path.getsize(source), os.path.getsize(target), loudness
+
+
+def _condition_task(task):
+    source, target, settings = task
+    try:
+        return source, condition_file(source, target, settings), None
+    except (OSError, EOFError, ValueError, wave.Error) as e:
+        # 删除按旧参数或旧源文件整理的输出，下次运行时重试
+        if os.path.exists(target):
+            os.remove(target)
+        return source, None, f"{type(e).__name__}: {e}"
+
+
+# --- 批量 ---
+
+def load_state_fingerprint(output_dir):
+    """上一次整理时的参数指纹，没有记录时为 None。"""
+    try:
+        with open(os.path.join(output_dir, CONDITION_STATE_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f).get('fingerprint')
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def plan_files(input_dir, output_dir, current):
+    """
+    返回 (需要整理的 (源文件, 输出文件) 列表, 跳过的数量)。
+
+    current 为 True（整理参数与上一次相同）时，跳过比源文件新的输出。
+    """
+    tasks = []
+    skipped = 0
+    for root, _, files in os.walk(input_dir):
+        for name in sorted(files):
+            if not name.lower().endswith('.wav'):
+                continue
+            source = os.path.join(root, name)
+            target = os.path.join(output_dir, os.path.relpath(source, input_dir))
+            if current and os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(source):
+                skipped += 1
+                continue
+            tasks.append((source, target))
+    return tasks, skipped
+
+
+def condition_directory(input_dir, output_dir, settings, workers=None, force=False):
+    """
+    整理目录中的所有 WAV 文件。
+
+    Returns:
+        dict: 统计信息：conditioned、skipped、failed（失败的文件列表）、bytes_before、bytes_after。
+    """
+    fingerprint = run_fingerprint(*sorted(asdict(settings).items()))
+    previous = load_state_fingerprint(output_dir)
+    tasks, skipped = plan_files(input_dir, output_dir, not force and previous == fingerprint)
+    stats = {'conditioned': 0, 'skipped': skipped, 'failed': [], 'bytes_before': 0, 'bytes_after': 0}
+    if not tasks:
+        return stats
+
+    os.makedirs(output_dir, exist_ok=True)
+    if previous != fingerprint:
+        # 参数变化时旧的记录立即失效，避免中断后把按旧参数整理的文件当作最新
+        write_json_atomic(os.path.join(output_dir, CONDITION_STATE_FILE), {'fingerprint': None})
+    for target_dir in {os.path.dirname(target) for _, target in tasks}:
+        os.makedirs(target_dir, exist_ok=True)
+    jobs = [(source, target, asdict(settings)) for source, target in tasks]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(_condition_task, jobs, chunksize=max(1, len(jobs) // (8 * (workers or os.cpu_count() or 1))))
+        for source, sizes, error in tqdm(results, total=len(jobs), desc="Conditioning voice files"):
+            if error is not None:
+                stats['failed'].append((source, error))
+                continue
+            stats['conditioned'] += 1
+            stats['bytes_before'] += sizes[0]
+            stats['bytes_after'] += sizes[1]
+    write_json_atomic(os.path.join(output_dir, CONDITION_STATE_FILE), {'fingerprint': fingerprint, 'settings': asdict(settings)})
+    return stats
+
+
+def main():
+    defaults = ConditionSettings()
+    parser = argparse.ArgumentParser(description='把转换后的语音整理为统一的采样率、声道和响度，并去除首尾静音。')
+    parser.add_argument('--input', default=INPUT_DIR, help=f'源 WAV 目录 (默认: {INPUT_DIR})')
+    parser.add_argument('--output', default=OUTPUT_DIR, help=f'输出目录，保持源目录的结构 (默认: {OUTPUT_DIR})')
+    parser.add_argument('--sample-rate', type=int, default=defaults.sample_rate, help=f'目标采样率 (默认: {defaults.sample_rate})')
+    parser.add_argument('--channels', type=int, default=defaults.channels, help=f'目标声道数 (默认: {defaults.channels})')
+    parser.add_argument('--target-loudness', type=float, default=defaults.target_loudness, help=f'目标门限响度 (dB，默认: {defaults.target_loudness})')
+    parser.add_argument('--peak-ceiling', type=float, default=defaults.peak_ceiling, help=f'增益后的峰值上限 (dBFS，默认: {defaults.peak_ceiling})')
+    parser.add_argument('--silence-threshold', type=float, default=defaults.silence_threshold, help=f'首尾静音的判断门限 (dBFS，默认: {defaults.silence_threshold})')
+    parser.add_argument('--trim-padding-ms', type=int, default=defaults.trim_padding_ms, help=f'裁剪静音时在首尾保留的时长 (毫秒，默认: {defaults.trim_padding_ms})')
+    parser.add_argument('--min-duration-ms', type=int, default=defaults.min_duration_ms, help=f'输出的最短时长 (毫秒，默认: {defaults.min_duration_ms})')
+    parser.add_argument('--workers', type=int, help='并行的进程数 (默认: CPU 核数)')
+    parser.add_argument('--force', action='store_true', help='忽略已是最新的输出，全部重新整理')
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.input):
+        print(f"错误：找不到源目录 {args.input}")
+        return
+    settings = ConditionSettings(
+        args.sample_rate, args.channels, args.target_loudness, args.peak_ceiling,
+        args.silence_threshold, args.trim_padding_ms, args.min_duration_ms,
+    )
+    started = time.time()
+    stats = condition_directory(args.input, args.output, settings, args.workers, args.force)
+
+    print("\n--- 整理完成 ---")
+    print(f"整理: {stats['conditioned']}，跳过（已是最新）: {stats['skipped']}，失败: {len(stats['failed'])}")
+    if stats['conditioned']:
+        print(f"大小: {stats['bytes_before'] / 2**20:.1f} MiB -> {stats['bytes_after'] / 2**20:.1f} MiB")
+    for source, error in stats['failed'][:20]:
+        print(f"  - {source}: {error}")
+    print(f"用时 {time.time() - started:.1f} 秒，输出目录: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,356 @@
+"""
+旧语料的预建索引。
+
+extract_voice_data.py 写出 voice_data.json / script_data.json 之后，在同一目录下生成 old_corpus_index/。
+match_voices.py 每次运行都要从 JSON 重新做的工作（创建旧条目、按场景排序并添加上下文、计算标准化文本，
+以及建立精确、标准化、脚本文本、多级标准化键、分块匹配三元组和场景顺序的查找索引）预先完成，保存为 .npy 数组：
+
+    texts.npy / text_offsets.npy          驻留文本：UTF-8 编码的拼接文本及每条文本的起止位置（按字符计），下标 0 为空字符串
+    names.npy / name_offsets.npy          语音ID、角色ID、源文件名，格式同上
+    voice_<字段>.npy / script_<字段>.npy  旧语音列表（已按场景排序）和旧脚本列表的各字段列，文本字段为 texts 中的下标
+    map_<索引>_keys.npy / _key_offsets.npy / _indptr.npy / _rows.npy
+                                          各索引的键（格式同 texts）及 CSR 形式的候选项行号，候选项已按 voice_id / script_id 排序
+    triplet_keys.npy / triplet_rows.npy   分块匹配的三元组键（文本下标）及对应的三条旧脚本行号
+    scene_orders.npy / scene_rows.npy     旧语音全局场景顺序及对应的旧语音行号
+
+匹配时以内存映射方式读取这些数组，直接得到文本表、旧条目和查找索引，不再解析旧数据的 JSON 和建立索引。
+manifest.json 记录格式版本、两个 JSON 文件和建立索引的代码的摘要，任一不符时匹配器回退到从 JSON 建立索引。
+
+用法：
+    uv run corpus_index.py                       # 为当前目录的 voice_data.json / script_data.json 重新生成索引
+    uv run corpus_index.py --check               # 只检查索引是否与 JSON 一致
+"""
+import argparse
+import gc
+import json
+import os
+import shutil
+import sys
+from collections import defaultdict
+from contextlib import contextmanager
+from itertools import chain
+
+import numpy as np
+
+from checkpoints import file_digest
+from normalization import NORMALIZATION_LEVELS, ladder_keys, normalize_text
+from voice_records import OldVoiceEntry, TextTable, link_context
+
+# 索引目录，位于 voice_data.json 所在的目录
+CORPUS_INDEX_DIR = 'old_corpus_index'
+INDEX_MANIFEST = 'manifest.json'
+# 索引格式版本，数组的格式或含义变化时递增
+INDEX_VERSION = 1
+# 决定索引内容的代码，变化时已有的索引视为过期
+INDEX_SOURCES = ['corpus_index.py', 'normalization.py', 'voice_records.py']
+# 旧条目的字段列
+ENTRY_COLUMNS = ['character_id', 'voice_id', 'script_id', 'text_id', 'source_file', 'prev_id', 'next_id', 'normalized_id']
+# 名称列，保存为 names 中的下标，None 保存为 -1
+NAME_COLUMNS = {'character_id', 'voice_id', 'source_file'}
+# 查找索引（与 build_lookup_maps() 的返回值顺序相同）-> 候选项所在的列表
+LOOKUP_MAPS = {
+    'exact': 'voice',
+    'normalized': 'voice',
+    'script': 'script',
+    **{f'ladder_{name}': 'script' for name in NORMALIZATION_LEVELS},
+}
+
+
+class CorpusIndexError(RuntimeError):
+    """索引不存在、无法读取或与输入文件不一致。"""
+
+
+def corpus_index_dir(old_voice_file):
+    """旧语音数据文件对应的默认索引目录。"""
+    return os.path.join(os.path.dirname(os.path.abspath(old_voice_file)), CORPUS_INDEX_DIR)
+
+
+def source_digests():
+    """建立索引的代码的摘要。"""
+    directory = os.path.dirname(os.path.abspath(__file__))
+    return {name: file_digest(os.path.join(directory, name)) for name in INDEX_SOURCES}
+
+
+# --- 与匹配器共用的建立过程 ---
+
+def prepare_old_entries(old_data_raw, old_script_raw, text_table):
+    """
+    创建旧语音和旧脚本条目：旧语音按从 voice_id 解析出的场景信息排序，上下文只在同一场景内添加；
+    两个列表都预计算标准化文本（同样收录进文本表）。
+
+    Returns:
+        tuple: (old_data_list, old_script_list)。
+    """
+    old_data_list = [OldVoiceEntry.from_dict(entry, text_table) for entry in old_data_raw]
+    old_script_list = [OldVoiceEntry.from_dict(entry, text_table) for entry in old_script_raw]
+    old_data_list.sort(key=lambda x: (x.scene_id, x.scene_seq_id))
+    link_context(old_data_list, same_group=lambda a, b: a.scene_id == b.scene_id)
+
+    normalized_ids = {}
+    for entry in chain(old_data_list, old_script_list):
+        normalized_id = normalized_ids.get(entry.text_id)
+        if normalized_id is None:
+            normalized_id = normalized_ids[entry.text_id] = text_table.intern(normalize_text(entry.text))
+        entry.normalized_id = normalized_id
+    return old_data_list, old_script_list
+
+
+def build_lookup_maps(old_data_list, old_script_list):
+    """
+    建立旧数据的查找映射（一个文本可能对应多个语音）。
+
+    按 voice_id / script_id 的顺序插入，同一文本的候选项列表即已有序，确保优先匹配文件名靠前的语音。
+
+    Returns:
+        tuple: (old_data_map, old_data_normalized_map, old_script_map, old_ladder_maps)，
+            old_ladder_maps 为多级标准化键的哈希索引（每级一个）。
+    """
+    old_data_map = defaultdict(list)
+    old_data_normalized_map = defaultdict(list)
+    for entry in sorted(old_data_list, key=lambda e: e.voice_id):
+        if text := entry.text:
+            old_data_map[text].append(entry)
+            if normalized_text := entry.normalized:
+                old_data_normalized_map[normalized_text].append(entry)
+
+    old_script_map = defaultdict(list)
+    old_ladder_maps = [defaultdict(list) for _ in NORMALIZATION_LEVELS]
+    for entry in sorted(old_script_list, key=lambda e: e.script_id):
+        if text := entry.text:
+            old_script_map[text].append(entry)
+            for level_map, key in zip(old_ladder_maps, ladder_keys(text)):
+                if key:
+                    level_map[key].append(entry)
+    return old_data_map, old_data_normalized_map, old_script_map, old_ladder_maps
+
+
+def triplet_map(entries):
+    """连续三条非空台词的文本下标 -> 这三个条目，分块匹配使用。相同的三元组保留最后一次出现。"""
+    entries = [e for e in entries if e.text]
+    return {(a.text_id, b.text_id, c.text_id): (a, b, c) for a, b, c in zip(entries, entries[1:], entries[2:])}
+
+
+def scene_order_map(old_data_list):
+    """旧语音全局场景顺序 -> 旧语音条目。同一 voice_id 或同一场景顺序出现多次时保留最后一个。"""
+    voice_id_to_entry_map = {e.voice_id: e for e in old_data_list}
+    return {e.scene_order: e for e in voice_id_to_entry_map.values()}
+
+
+# --- 读取 ---
+
+def _csr_map(keys, indptr, rows, entries):
+    """由 CSR 数组还原 键 -> 旧条目列表 的字典。行号整体取出后按 indptr 切片，不逐个键追加。"""
+    flat = [entries[row] for row in rows.tolist()]
+    indptr = indptr.tolist()
+    return dict(zip(keys, [flat[start:end] for start, end in zip(indptr, indptr[1:])]))
+
+
+@contextmanager
+def _gc_paused():
+    """
+    读取索引时一次新建数十万个条目和候选项列表，它们之间没有循环引用；
+    期间暂停分代垃圾回收，避免每分配一批对象就扫描一遍已有的全部对象。
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def _strings(array, offsets):
+    joined = bytes(array).decode('utf-8')
+    offsets = offsets.tolist()
+    return [joined[start:end] for start, end in zip(offsets, offsets[1:])]
+
+
+class CorpusIndex:
+    """一个已通过校验的索引目录。数组以内存映射方式读取。"""
+
+    def __init__(self, directory, manifest):
+        self.directory = directory
+        self.manifest = manifest
+
+    def array(self, name):
+        return np.load(os.path.join(self.directory, f'{name}.npy'), mmap_mode='r')
+
+    def load_entries(self):
+        """
+        Returns:
+            tuple: (文本表, old_data_list, old_script_list)，与 prepare_old_entries() 的结果相同。
+        """
+        with _gc_paused():
+            text_table = TextTable.from_texts(_strings(self.array('texts'), self.array('text_offsets')))
+            names = _strings(self.array('names'), self.array('name_offsets'))
+            lists = []
+            for prefix in ('voice', 'script'):
+                columns = []
+                for column in ENTRY_COLUMNS:
+                    values = self.array(f'{prefix}_{column}').tolist()
+                    if column in NAME_COLUMNS:
+                        values = [names[i] if i >= 0 else None for i in values]
+                    columns.append(values)
+                lists.append([
+                    OldVoiceEntry(text_table, character_id, voice_id, script_id, text_id, source_file, prev_id, next_id, normalized_id=normalized_id)
+                    for character_id, voice_id, script_id, text_id, source_file, prev_id, next_id, normalized_id in zip(*columns)
+                ])
+        return text_table, lists[0], lists[1]
+
+    def lookup_maps(self, old_data_list, old_script_list):
+        """返回与 build_lookup_maps() 相同的映射（普通字典，查找不存在的键时不会新增条目）。"""
+        entry_lists = {'voice': old_data_list, 'script': old_script_list}
+        with _gc_paused():
+            maps = {
+                name: _csr_map(_strings(self.array(f'map_{name}_keys'), self.array(f'map_{name}_key_offsets')),
+                               self.array(f'map_{name}_indptr'), self.array(f'map_{name}_rows'), entry_lists[source])
+                for name, source in LOOKUP_MAPS.items()
+            }
+        return maps['exact'], maps['normalized'], maps['script'], [maps[f'ladder_{name}'] for name in NORMALIZATION_LEVELS]
+
+    def triplet_map(self, old_script_list):
+        """返回与 triplet_map() 相同的字典。"""
+        with _gc_paused():
+            slides = [tuple(old_script_list[row] for row in rows) for rows in self.array('triplet_rows').tolist()]
+            return dict(zip(map(tuple, self.array('triplet_keys').tolist()), slides))
+
+    def scene_order_map(self, old_data_list):
+        """返回与 scene_order_map() 相同的字典。"""
+        return dict(zip(self.array('scene_orders').tolist(), (old_data_list[row] for row in self.array('scene_rows').tolist())))
+
+
+def open_corpus_index(directory, old_voice_digest, old_script_digest):
+    """
+    打开索引目录并校验。
+
+    Args:
+        directory (str): 索引目录。
+        old_voice_digest, old_script_digest (str): 当前 voice_data.json / script_data.json 的 file_digest。
+
+    Raises:
+        CorpusIndexError: 索引不存在、版本不符，或与 JSON 文件、建立索引的代码不一致。
+    """
+    manifest_path = os.path.join(directory, INDEX_MANIFEST)
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        raise CorpusIndexError(f"找不到 {manifest_path}") from None
+    except (OSError, json.JSONDecodeError) as e:
+        raise CorpusIndexError(f"无法读取 {manifest_path}: {type(e).__name__}: {e}") from e
+    if manifest.get('version') != INDEX_VERSION:
+        raise CorpusIndexError(f"索引版本 {manifest.get('version')} 不受支持")
+    if manifest.get('inputs') != [old_voice_digest, old_script_digest]:
+        raise CorpusIndexError("索引与旧语音/旧脚本数据文件不一致")
+    if manifest.get('sources') != source_digests():
+        raise CorpusIndexError("建立索引的代码已变化")
+    missing = [name for name in manifest.get('arrays', []) if not os.path.isfile(os.path.join(directory, f'{name}.npy'))]
+    if missing:
+        raise CorpusIndexError(f"索引不完整: 缺少 {', '.join(missing)}")
+    return CorpusIndex(directory, manifest)
+
+
+# --- 生成 ---
+
+def _string_arrays(strings):
+    offsets = np.zeros(len(strings) + 1, dtype=np.int64)
+    np.cumsum([len(s) for s in strings], out=offsets[1:])
+    return np.frombuffer(''.join(strings).encode('utf-8'), dtype=np.uint8), offsets
+
+
+def _csr_arrays(name, mapping, rows_of):
+    keys, key_offsets = _string_arrays(list(mapping))
+    lists = list(mapping.values())
+    indptr = np.zeros(len(lists) + 1, dtype=np.int64)
+    np.cumsum([len(candidates) for candidates in lists], out=indptr[1:])
+    rows = np.fromiter((rows_of[id(e)] for candidates in lists for e in candidates), dtype=np.int32, count=int(indptr[-1]))
+    return {f'map_{name}_keys': keys, f'map_{name}_key_offsets': key_offsets, f'map_{name}_indptr': indptr, f'map_{name}_rows': rows}
+
+
+def build_corpus_index(old_voice_file, old_script_file, output_dir=None):
+    """
+    为旧语音/旧脚本数据文件生成索引目录（默认为 corpus_index_dir(old_voice_file)）。
+    先写入临时目录，完成后替换原目录。
+
+    Returns:
+        dict: 清单内容。
+    """
+    output_dir = output_dir or corpus_index_dir(old_voice_file)
+    with open(old_voice_file, 'r', encoding='utf-8') as f:
+        old_data_raw = json.load(f)
+    with open(old_script_file, 'r', encoding='utf-8') as f:
+        old_script_raw = json.load(f)
+
+    text_table = TextTable()
+    old_data_list, old_script_list = prepare_old_entries(old_data_raw, old_script_raw, text_table)
+    entry_lists = {'voice': old_data_list, 'script': old_script_list}
+    rows_of = {prefix: {id(e): i for i, e in enumerate(entries)} for prefix, entries in entry_lists.items()}
+
+    arrays = {}
+    arrays['texts'], arrays['text_offsets'] = _string_arrays([text_table[i] for i in range(len(text_table))])
+    names = {}
+    for prefix, entries in entry_lists.items():
+        for column in ENTRY_COLUMNS:
+            values = [getattr(e, column) for e in entries]
+            if column in NAME_COLUMNS:
+                values = [-1 if value is None else names.setdefault(value, len(names)) for value in values]
+                arrays[f'{prefix}_{column}'] = np.array(values, dtype=np.int32)
+            else:
+                arrays[f'{prefix}_{column}'] = np.array(values, dtype=np.int64 if column == 'script_id' else np.int32)
+    arrays['names'], arrays['name_offsets'] = _string_arrays(list(names))
+
+    lookup_maps = build_lookup_maps(old_data_list, old_script_list)
+    for (name, source), mapping in zip(LOOKUP_MAPS.items(), [*lookup_maps[:3], *lookup_maps[3]]):
+        arrays.update(_csr_arrays(name, mapping, rows_of[source]))
+
+    triplets = triplet_map(old_script_list)
+    arrays['triplet_keys'] = np.array(list(triplets), dtype=np.int32).reshape(-1, 3)
+    arrays['triplet_rows'] = np.array([[rows_of['script'][id(e)] for e in slide] for slide in triplets.values()], dtype=np.int32).reshape(-1, 3)
+    scene_orders = scene_order_map(old_data_list)
+    arrays['scene_orders'] = np.array(list(scene_orders), dtype=np.int64)
+    arrays['scene_rows'] = np.array([rows_of['voice'][id(e)] for e in scene_orders.values()], dtype=np.int32)
+
+    temp_dir = output_dir.rstrip('/\\') + '.tmp'
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    os.makedirs(temp_dir)
+    for name, array in arrays.items():
+        np.save(os.path.join(temp_dir, f'{name}.npy'), array)
+    manifest = {
+        'version': INDEX_VERSION,
+        'inputs': [file_digest(old_voice_file), file_digest(old_script_file)],
+        'sources': source_digests(),
+        'counts': {'texts': len(text_table), 'voice': len(old_data_list), 'script': len(old_script_list)},
+        'arrays': sorted(arrays),
+    }
+    with open(os.path.join(temp_dir, INDEX_MANIFEST), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.replace(temp_dir, output_dir)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description='为旧语音/旧脚本数据生成匹配器使用的预建索引。')
+    parser.add_argument('--old-voice-data', default='voice_data.json', help='旧语音数据 (默认: voice_data.json)')
+    parser.add_argument('--old-script-data', default='script_data.json', help='旧脚本数据 (默认: script_data.json)')
+    parser.add_argument('--output', default=None, help=f'索引目录 (默认: 旧语音数据所在目录下的 {CORPUS_INDEX_DIR})')
+    parser.add_argument('--check', action='store_true', help='只检查索引是否与数据文件和代码一致，不一致时退出码为 1')
+    args = parser.parse_args()
+
+    output_dir = args.output or corpus_index_dir(args.old_voice_data)
+    try:
+        if args.check:
+            index = open_corpus_index(output_dir, file_digest(args.old_voice_data), file_digest(args.old_script_data))
+            print(f"索引 {output_dir} 与数据文件一致: {index.manifest['counts']}")
+        else:
+            manifest = build_corpus_index(args.old_voice_data, args.old_script_data, output_dir)
+            print(f"索引已保存到 {output_dir}: {manifest['counts']}")
+    except CorpusIndexError as e:
+        print(f"错误：{e}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
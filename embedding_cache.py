@@ -0,0 +1,154 @@
+"""
+文本向量的磁盘缓存。
+
+向量按 (模型标识, 文本) 的摘要索引保存在一个 .npz 文件中。每次只对缓存中没有的文本调用模型编码，
+新结果追加到缓存后原子地写回，因此完整运行、按角色的子集运行和增量运行可以共用同一份缓存。
+分块编码时每块只追加到旁边的 .part 文件，全部完成后再整体写回一次；读取缓存时一并读入 .part 中完整的块。
+模型标识由 model_artifact.model_key() 根据模型清单中的模型名、版本和权重的 SHA-256 生成，换用其他模型时整个缓存失效。
+旧脚本的上下文文本和复核时使用的不含上下文的文本都存放在这里。
+"""
+import hashlib
+import os
+import threading
+
+import numpy as np
+import torch
+
+# 缓存文件：文本向量
+EMBEDDING_CACHE_FILE = 'old_script_embeddings.npz'
+
+
+def text_key(text):
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    文本向量缓存。path 为 None 时只在内存中缓存，不读写文件。
+
+    文件在创建对象时读取一次；encode 只对缺失的文本调用模型，新结果在调用 save 时写回文件。
+    encode 和 save 持有同一把锁，批量模式下多个任务线程可以共用一个缓存。
+    """
+
+    def __init__(self, path, model_name):
+        self.path = path
+        self.model_name = model_name
+        self._index = {}
+        # 容量按倍数增长的向量缓冲区，前 len(self._index) 行有效
+        self._buffer = None
+        self._dirty = False
+        self._lock = threading.Lock()
+        if path is not None:
+            self._load()
+
+    def _load(self):
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                if str(data['model_name']) == self.model_name:
+                    self._index = {key: i for i, key in enumerate(data['keys'].tolist())}
+                    self._buffer = data['embeddings']
+        except (FileNotFoundError, OSError, KeyError, ValueError):
+            pass
+        self._load_part()
+
+    def _load_part(self):
+        # 上次分块编码中断时留下的块：每块依次为模型标识、键、向量三个数组，末尾不完整的块丢弃
+        try:
+            f = open(self.path + '.part', 'rb')
+        except OSError:
+            return
+        with f:
+            while True:
+                try:
+                    model_name, keys, embeddings = (np.load(f, allow_pickle=False) for _ in range(3))
+                except (OSError, ValueError, EOFError):
+                    break
+                if str(model_name) != self.model_name:
+                    continue
+                self._add(keys.tolist(), embeddings)
+                self._dirty = True
+
+    def _add(self, keys, embeddings):
+        fresh = [i for i, key in enumerate(keys) if key not in self._index]
+        if len(fresh) < len(keys):
+            keys, embeddings = [keys[i] for i in fresh], embeddings[fresh]
+        self._append(embeddings)
+        for key in keys:
+            self._index[key] = len(self._index)
+
+    def _append_part(self, keys, embeddings):
+        with open(self.path + '.part', 'ab') as f:
+            np.save(f, np.array(self.model_name))
+            np.save(f, np.array(keys))
+            np.save(f, embeddings)
+
+    def _append(self, embeddings):
+        size = len(self._index)
+        if self._buffer is None:
+            self._buffer = np.empty((0, embeddings.shape[1]), dtype=np.float32)
+        if size + len(embeddings) > len(self._buffer):
+            buffer = np.empty((max(2 * len(self._buffer), size + len(embeddings)), embeddings.shape[1]), dtype=np.float32)
+            buffer[:size] = self._buffer[:size]
+            self._buffer = buffer
+        self._buffer[size:size + len(embeddings)] = embeddings
+
+    def save(self):
+        """有新编码的文本时原子地写回缓存文件。"""
+        with self._lock:
+            self._save()
+
+    def _save(self):
+        if self.path is None or not self._dirty:
+            return
+        keys = np.array(sorted(self._index, key=self._index.get))
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, model_name=np.array(self.model_name), keys=keys, embeddings=self._buffer[:len(keys)])
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+        try:
+            os.remove(self.path + '.part')
+        except FileNotFoundError:
+            pass
+
+    def missing_count(self, texts):
+        """缓存中没有的不同文本数，即 encode 需要实际编码的条数。"""
+        with self._lock:
+            return len({key for key in map(text_key, texts) if key not in self._index})
+
+    def encode(self, model, texts, chunk_size=None):
+        """
+        编码一组文本，优先从缓存读取。
+
+        设置 chunk_size 时缺失的文本按块编码，每块完成后追加到 .part 文件，全部完成后整体写回一次缓存文件；
+        中断后重新运行最多损失一块。
+
+        Returns:
+            tuple: (与 texts 一一对应的向量张量, 本次实际编码的文本数)。
+        """
+        keys = [text_key(text) for text in texts]
+        with self._lock:
+            return self._encode(model, texts, keys, chunk_size)
+
+    def _encode(self, model, texts, keys, chunk_size):
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in self._index and key not in missing:
+                missing[key] = text
+
+        missing_keys = list(missing)
+        step = chunk_size or len(missing_keys) or 1
+        for start in range(0, len(missing_keys), step):
+            chunk = missing_keys[start:start + step]
+            embeddings = model.encode([missing[key] for key in chunk], convert_to_numpy=True).astype(np.float32)
+            self._add(chunk, embeddings)
+            self._dirty = True
+            if chunk_size and self.path is not None:
+                self._append_part(chunk, embeddings)
+        if chunk_size and missing_keys:
+            self._save()
+
+        if not texts:
+            return torch.empty((0, 0)), 0
+        rows = [self._index[key] for key in keys]
+        return torch.from_numpy(self._buffer[rows]), len(missing)
@@ -1,6 +1,8 @@
 import os
 import re
 import json
+from corpus_index import build_corpus_index, corpus_index_dir
+from voice_records import OldVoiceEntry, TextTable, link_context
 
 # 配置
 # 源目录：包含原始日文脚本的文件夹
@@ -52,8 +54,8 @@ def clean_text(text):
     text = re.sub(r'骸x03]', '❤', text)
     return text.strip()
 
-def parse_script_file(file_path):
-    """解析单个脚本文件，提取对话数据。"""
+def parse_script_file(file_path, text_table):
+    """解析单个脚本文件，提取对话数据。文本收录到 text_table 中。"""
     voice_entries = []
     try:
         with open(file_path, 'r', encoding='shift_jis', errors='backslashreplace') as f:
@@ -95,13 +97,14 @@ def parse_script_file(file_path):
                 cleaned_dialogue = clean_text(dialogue_text)
 
                 if cleaned_dialogue:
-                    voice_entries.append({
-                        'character_id': current_char_id,
-                        'voice_id': voice_id,
-                        'script_id': script_id,
-                        'text': cleaned_dialogue,
-                        'source_file': os.path.basename(file_path)
-                    })
+                    voice_entries.append(OldVoiceEntry(
+                        text_table,
+                        character_id=current_char_id,
+                        voice_id=voice_id,
+                        script_id=script_id,
+                        text_id=text_table.intern(cleaned_dialogue),
+                        source_file=os.path.basename(file_path)
+                    ))
 
             i += 1
 
@@ -110,14 +113,20 @@ def parse_script_file(file_path):
 
     return voice_entries
 
-def main():
-    """主函数，遍历目录，处理文件并生成最终的JSON。"""
+def extract(source_dir, output_file, output_script_file):
+    """
+    遍历脚本目录，处理文件并生成语音数据和脚本数据两个JSON文件。
+
+    Returns:
+        bool: 源目录不存在时为 False。
+    """
     all_voice_data = []
-    source_folder = os.path.abspath(SOURCE_DIR)
+    text_table = TextTable()
+    source_folder = os.path.abspath(source_dir)
 
     if not os.path.isdir(source_folder):
         print(f"Error: Source directory not found at '{source_folder}'")
-        return
+        return False
 
     print(f"Scanning files in '{source_folder}'...")
 
@@ -127,7 +136,7 @@ def main():
         if filename.lower().endswith('.txt'):
             file_path = os.path.join(source_folder, filename)
             print(f"Processing {filename}...")
-            extracted_data = parse_script_file(file_path)
+            extracted_data = parse_script_file(file_path, text_table)
             if extracted_data:
                 all_voice_data.extend(extracted_data)
 
@@ -135,22 +144,21 @@ def main():
     print("\nDeduplicating entries by script_id...")
     unique_scripts = {}
     for entry in all_voice_data:
-        unique_scripts[entry['script_id']] = entry
-    all_script_data = list(unique_scripts.values())
+        unique_scripts[entry.script_id] = entry
+    # 两个列表的上下文不同，脚本列表使用独立的记录副本，文本仍共享同一个文本表
+    all_script_data = [entry.with_context(0, 0) for entry in unique_scripts.values()]
     # 重新排序以确保上下文正确
-    all_script_data.sort(key=lambda x: x['script_id'])
+    all_script_data.sort(key=lambda x: x.script_id)
     print(f"Deduplication complete. {len(all_script_data)} unique entries remaining.")
 
     # 添加上下文
     print("\nAdding context...")
-    for i, entry in enumerate(all_script_data):
-        entry['context_prev'] = all_script_data[i-1]['text'] if i > 0 else ""
-        entry['context_next'] = all_script_data[i+1]['text'] if i < len(all_script_data) - 1 else ""
+    link_context(all_script_data)
 
     # 保存到JSON文件
-    output_path = os.path.abspath(OUTPUT_SCRIPT_FILE)
+    output_path = os.path.abspath(output_script_file)
     with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(all_script_data, f, ensure_ascii=False, indent=4)
+        json.dump([entry.to_dict() for entry in all_script_data], f, ensure_ascii=False, indent=4)
     print(f"\nScript data saved to {output_path}")
     
 
@@ -158,36 +166,34 @@ def main():
     print("\nDeduplicating entries by voice_id...")
     unique_voices = {}
     for entry in all_voice_data:
-        unique_voices[entry['voice_id']] = entry
+        unique_voices[entry.voice_id] = entry
     all_voice_data = list(unique_voices.values())
     # 重新排序以确保上下文正确
-    all_voice_data.sort(key=lambda x: x['voice_id'])
+    all_voice_data.sort(key=lambda x: x.voice_id)
     print(f"Deduplication complete. {len(all_voice_data)} unique entries remaining.")
 
     # 添加上下文
     print("\nAdding context...")
-    for i, entry in enumerate(all_voice_data):
-        
-        # 添加上一句上下文
-        if i > 0:
-            entry['context_prev'] = all_voice_data[i-1]['text']
-        else:
-            entry['context_prev'] = ""
-            
-        # 添加下一句上下文
-        if i < len(all_voice_data) - 1:
-            entry['context_next'] = all_voice_data[i+1]['text']
-        else:
-            entry['context_next'] = ""
+    link_context(all_voice_data)
 
     # 保存到JSON文件
-    output_path = os.path.abspath(OUTPUT_FILE)
+    output_path = os.path.abspath(output_file)
     with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(all_voice_data, f, ensure_ascii=False, indent=4)
+        json.dump([entry.to_dict() for entry in all_voice_data], f, ensure_ascii=False, indent=4)
 
     print(f"\nExtraction complete. {len(all_voice_data)} voice entries found.")
     print(f"Data saved to {output_path}")
 
+    # 为匹配器生成预建的旧语料索引
+    print("\nBuilding old corpus index...")
+    manifest = build_corpus_index(output_file, output_script_file)
+    print(f"Corpus index saved to {corpus_index_dir(output_file)} ({manifest['counts']['texts']} texts).")
+    return True
+
+def main():
+    """主函数，遍历默认的脚本目录，处理文件并生成最终的JSON。"""
+    extract(SOURCE_DIR, OUTPUT_FILE, OUTPUT_SCRIPT_FILE)
+
 if __name__ == '__main__':
     # To run the full extraction, comment out or remove the test block below and uncomment the line below
     main()
@@ -0,0 +1,187 @@
+"""
+增量重新匹配。
+
+每次匹配结束时，为每个参与匹配的新语音条目记录一个输入指纹（文件名、文本、前后句、同文本候选项集合），
+并为每个成功匹配所使用的旧语音条目记录指纹。下一次以 --incremental 运行时，与上一次的指纹和
+merged_voice_data.json 对比：输入未变且所用旧条目未变的决策直接沿用，只对发生变化的条目及其邻近条目
+重新执行各遍匹配。沿用的匹配继续占用其旧语音ID；重新匹配条目之前占用的旧语音ID被释放，可以被重新分配。
+"""
+import hashlib
+import json
+
+from voice_records import MatchRecord, UnmatchedRecord
+
+# 输出文件：匹配输入指纹
+MATCH_FINGERPRINT_FILE = 'match_fingerprints.json'
+# 指纹文件格式版本，格式或匹配流程不兼容地变化时递增
+FINGERPRINT_VERSION = 1
+
+
+def _digest(*parts):
+    h = hashlib.blake2b(digest_size=12)
+    for part in parts:
+        h.update(str(part).encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+def options_fingerprint(args, model_name, ordinal_digest=None):
+    """
+    影响匹配决策的命令行选项的指纹。选项变化时所有决策都需要重新计算。
+
+    ordinal_digest 为使用中的序号表的摘要（未按序号表映射时为 None），序号表变化时同样重新计算。
+    """
+    return _digest(
+        FINGERPRINT_VERSION, model_name,
+        sorted(args.character_ids or []), args.match_active, args.match_battle, args.match_other, args.match_sfx,
+        args.no_similarity_search, args.similarity_threshold,
+        args.no_locality_search, args.locality_radius, args.locality_threshold,
+        args.verifier_chain, args.no_split_merge, args.split_merge_threshold, args.no_normalization_ladder,
+        # 未启用时长重新排序时不计入，保持原有指纹不变
+        *([args.duration_margin, args.duration_top_k] if getattr(args, 'duration_rerank', False) else []),
+        # 战斗语音和主动语音按序号表映射时，序号表（不存在时为空字符串）的摘要
+        *([ordinal_digest] if ordinal_digest is not None else []),
+        # 设置了计算预算时，未来得及处理的条目不能被沿用
+        *([args.budget_seconds, args.budget_encodes] if getattr(args, 'budget_seconds', None) is not None or getattr(args, 'budget_encodes', None) is not None else []),
+    )
+
+
+def old_entry_fingerprint(entry, with_context=False):
+    """
+    旧条目的指纹。
+
+    匹配结果中只记录旧条目本身的字段，因此校验已匹配的旧条目时不计入上下文（同一语音在 voice_data 和
+    script_data 中的上下文不同）；作为候选项集合计入新条目指纹时则计入上下文，因为第二遍依赖它。
+    """
+    fields = (entry.voice_id, entry.script_id, entry.character_id, entry.source_file, entry.text)
+    if with_context:
+        fields += (entry.context_prev, entry.context_next)
+    return _digest(*fields)
+
+
+def entry_fingerprints(entries, candidate_maps):
+    """
+    计算新语音条目的输入指纹。
+
+    Args:
+        entries (list): 参与匹配的新语音条目。
+        candidate_maps (list): (映射, 取键函数) 列表，如 (old_script_map, lambda e: e.text)，
+            用于收集与条目文本相同的旧条目，作为候选项集合计入指纹。
+
+    Returns:
+        dict: new_voice_id -> 指纹。
+    """
+    # 旧条目、(映射, 键) 和文本的指纹分别只计算一次：标准化键较宽松时，许多文本共用同一个很长的候选项列表
+    old_fingerprints = {}
+    key_fingerprints = {}
+    candidate_fingerprints = {}
+
+    def old_fingerprint(candidate):
+        result = old_fingerprints.get(id(candidate))
+        if result is None:
+            result = old_fingerprints[id(candidate)] = old_entry_fingerprint(candidate, with_context=True)
+        return result
+
+    def key_fingerprint(index, candidate_map, key):
+        result = key_fingerprints.get((index, key))
+        if result is None:
+            result = key_fingerprints[(index, key)] = _digest(*(old_fingerprint(candidate) for candidate in candidate_map.get(key, [])))
+        return result
+
+    def candidates_fingerprint(entry):
+        key = (entry.text_id, entry.normalized_id)
+        result = candidate_fingerprints.get(key)
+        if result is None:
+            result = candidate_fingerprints[key] = _digest(*(
+                key_fingerprint(index, candidate_map, key_of(entry))
+                for index, (candidate_map, key_of) in enumerate(candidate_maps)
+            ))
+        return result
+
+    return {
+        entry.id: _digest(entry.filename, entry.text, entry.context_prev, entry.context_next, candidates_fingerprint(entry))
+        for entry in entries
+    }
+
+
+def save_fingerprints(path, options, fingerprints, matched_data):
+    data = {
+        'version': FINGERPRINT_VERSION,
+        'options': options,
+        'entries': {str(new_voice_id): fingerprint for new_voice_id, fingerprint in fingerprints.items()},
+        'old': {record.old_entry.voice_id: old_entry_fingerprint(record.old_entry) for record in matched_data},
+    }
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+
+
+def load_previous_run(fingerprint_path, merged_path):
+    """
+    读取上一次运行的指纹和匹配结果。
+
+    Returns:
+        tuple: (指纹数据, 匹配决策)。匹配决策为 new_voice_id -> (old_voice_id, old_script_id, match_type)。
+               任一文件不存在或无法解析时返回 (None, None)。
+    """
+    try:
+        with open(fingerprint_path, 'r', encoding='utf-8') as f:
+            previous = json.load(f)
+        with open(merged_path, 'r', encoding='utf-8') as f:
+            merged = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None, None
+    decisions = {
+        record['new_voice_id']: (record['old_voice_id'], record['old_script_id'], record['match_type'])
+        for record in merged
+    }
+    return previous, decisions
+
+
+def plan_rematch(entries, fingerprints, previous, decisions, old_entry_by_key, radius):
+    """
+    确定需要重新匹配的条目，并沿用其余条目的上一次决策。
+
+    以下条目视为脏条目：上一次没有指纹或指纹变化的条目；上一次匹配到的旧条目已不存在或其指纹变化的条目。
+    脏条目前后 radius 个条目（按 id 顺序）一并重新匹配，因为分块匹配的空隙填充和局部窗口都依赖邻近条目的决策。
+
+    Args:
+        entries (list): 按 id 排序的全部参与匹配的新语音条目。
+        fingerprints (dict): 本次计算的 new_voice_id -> 指纹。
+        previous (dict): 上一次的指纹数据。
+        decisions (dict): 上一次的匹配决策。
+        old_entry_by_key (dict): (old_voice_id, old_script_id) -> 本次的旧条目。
+        radius (int): 邻近范围。
+
+    Returns:
+        tuple: (carried_matches, carried_unmatched, rematch_indices)。前两者为沿用的 MatchRecord / UnmatchedRecord 列表，
+               rematch_indices 为需要重新匹配的条目在 entries 中的下标（已排序）。
+    """
+    previous_entries = previous['entries']
+    previous_old = previous['old']
+    dirty = []
+    for i, entry in enumerate(entries):
+        if previous_entries.get(str(entry.id)) != fingerprints[entry.id]:
+            dirty.append(i)
+            continue
+        decision = decisions.get(entry.id)
+        if decision is not None:
+            old_entry = old_entry_by_key.get(decision[:2])
+            if old_entry is None or previous_old.get(old_entry.voice_id) != old_entry_fingerprint(old_entry):
+                dirty.append(i)
+
+    rematch = set()
+    for i in dirty:
+        rematch.update(range(max(0, i - radius), min(len(entries), i + radius + 1)))
+
+    carried_matches = []
+    carried_unmatched = []
+    for i, entry in enumerate(entries):
+        if i in rematch:
+            continue
+        decision = decisions.get(entry.id)
+        if decision is not None:
+            old_voice_id, old_script_id, match_type = decision
+            carried_matches.append(MatchRecord(entry, old_entry_by_key[(old_voice_id, old_script_id)], match_type))
+        else:
+            carried_unmatched.append(UnmatchedRecord(entry))
+    return carried_matches, carried_unmatched, sorted(rematch)
@@ -0,0 +1,172 @@
+"""
+按代价排序的匹配级联。
+
+每一级匹配器声明处理一个条目的估计耗时（微秒）和模型编码次数，调度器按两者折算出的代价从低到高依次执行，
+每一级只处理前面各级仍未解决的条目：
+
+    ordinal      战斗语音和主动语音的序号表映射（见 ordinal_mapping.py）
+    exact        第一遍：分块精确匹配和标准化匹配
+    context      第二遍：重复台词的上下文精确匹配
+    ladder       多级标准化键匹配
+    locality     局部窗口内的字面相似度匹配（字面无法判断时使用向量）
+    split_merge  拆分/合并对齐
+    vector       全局向量相似度匹配
+
+--budget-seconds / --budget-encodes 设置一次运行的计算预算：从第一级开始计时，统计送入模型编码的文本数量。
+时间预算用尽后不再开始新的搜索级（locality 及之后）；编码预算用尽后只跳过需要编码的级，split_merge 照常执行。
+旧脚本向量在编码前先检查缓存未命中的条数是否超出剩余的编码预算，超出时不加载向量（locality 只做字面匹配）。
+向量搜索在分块之间检查预算，剩余条目记为未匹配。locality 之前的各级只做哈希查找，总是执行。每一级处理、解决的条目数和实际耗时、编码次数写入 cascade_report.csv。
+"""
+import csv
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+
+# 输出文件：各级的处理数量和代价
+CASCADE_REPORT_CSV = 'cascade_report.csv'
+# 在 CPU 上编码一条文本的估计耗时（微秒），用于把编码次数折算为代价
+ENCODE_COST_US = 2000
+
+
+@dataclass(frozen=True)
+class Tier:
+    """
+    级联中的一级匹配器。
+
+    cost_us 和 encodes 是处理一个条目的估计耗时（微秒，不含编码）和模型编码次数；
+    budgeted 为 False 的级不受预算限制。
+    """
+    name: str
+    description: str
+    cost_us: float
+    encodes: float = 0.0
+    budgeted: bool = True
+
+    @property
+    def estimated_us(self):
+        """折算编码次数后的每条目估计代价，级联按它排序。"""
+        return self.cost_us + self.encodes * ENCODE_COST_US
+
+
+# 哈希查找各级的耗时按合成的 5.8 万条语料（单核 CPU）估计；局部窗口和拆分/合并按窗口内的比较次数估计，
+# 字面无法判断时局部窗口搜索才编码；向量搜索每条编码查询和复核文本，另需一次性编码旧脚本（有缓存时跳过）
+TIERS = [
+    Tier('ordinal', '序号表映射', 1, budgeted=False),
+    Tier('exact', '精确/标准化匹配', 30, budgeted=False),
+    Tier('context', '上下文匹配', 30, budgeted=False),
+    Tier('ladder', '标准化键匹配', 90, budgeted=False),
+    Tier('locality', '局部窗口搜索', 150, 0.2),
+    Tier('split_merge', '拆分/合并对齐', 600),
+    Tier('vector', '向量相似度匹配', 2000, 2),
+]
+
+
+@dataclass
+class TierStats:
+    """一级的执行结果。status 为 ran、restored（从检查点恢复）、partial（预算用尽时中途停止）、disabled 或 budget（因预算跳过）。"""
+    tier: Tier
+    status: str = 'ran'
+    entries: int = 0
+    matched: int = 0
+    remaining: int = 0
+    seconds: float = 0.0
+    encodes: int = 0
+
+    @property
+    def unmatched(self):
+        """本级处理后确定为未匹配、不再交给后续各级的条目数。"""
+        return self.entries - self.matched - self.remaining
+
+
+class MatchCascade:
+    """
+    级联调度器：按代价排序各级，记录每一级的结果，并检查计算预算。
+
+    Args:
+        budget_seconds (float, optional): 时间预算（秒），从创建时开始计时。
+        budget_encodes (int, optional): 模型编码次数（文本条数）的预算。
+    """
+
+    def __init__(self, budget_seconds=None, budget_encodes=None, tiers=TIERS):
+        self.budget_seconds = budget_seconds
+        self.budget_encodes = budget_encodes
+        self.tiers = sorted(tiers, key=lambda tier: tier.estimated_us)
+        self.start = time.perf_counter()
+        self.encodes = 0
+        self.stats = []
+
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    def charge(self, count):
+        """记录 count 次模型编码。"""
+        self.encodes += count
+
+    def exhausted(self, tier=None):
+        """
+        预算已用尽时返回原因，否则返回 None。
+
+        给出 tier 时，编码预算只限制需要编码的级（encodes 大于 0）。
+        """
+        if self.budget_seconds is not None and self.elapsed() >= self.budget_seconds:
+            return f"时间预算 {self.budget_seconds:g} 秒已用尽"
+        if self.budget_encodes is not None and self.encodes >= self.budget_encodes and (tier is None or tier.encodes > 0):
+            return f"编码预算 {self.budget_encodes} 次已用尽"
+        return None
+
+    def exceeds(self, count):
+        """再编码 count 条文本会超出预算（或预算已用尽）时返回原因，否则返回 None。"""
+        if reason := self.exhausted():
+            return reason
+        if self.budget_encodes is not None and self.encodes + count > self.budget_encodes:
+            return f"编码 {count} 条会超出编码预算 {self.budget_encodes} 次（已用 {self.encodes} 次）"
+        return None
+
+    def skip(self, tier, status):
+        self.stats.append(TierStats(tier, status))
+
+    @contextmanager
+    def run(self, tier, pending, matched_data):
+        """
+        执行一级，记录耗时、编码次数和新增的匹配数。
+
+        with 块中调用方把仍未解决的条目写入 stats.remaining；split_merge 等也处理已确定为未匹配的条目时自行增加 stats.entries。
+        """
+        stats = TierStats(tier, entries=len(pending))
+        matched_start = len(matched_data)
+        encodes_start = self.encodes
+        start = time.perf_counter()
+        try:
+            yield stats
+        finally:
+            stats.seconds = time.perf_counter() - start
+            stats.encodes = self.encodes - encodes_start
+            stats.matched = len(matched_data) - matched_start
+            self.stats.append(stats)
+
+
+class CountingEncoder:
+    """包装文本向量化模型，把每次送入编码的文本数量计入级联的编码次数。其余属性直接转发给模型。"""
+
+    def __init__(self, model, cascade):
+        self._model = model
+        self._cascade = cascade
+
+    def encode(self, sentences, *args, **kwargs):
+        self._cascade.charge(1 if isinstance(sentences, str) else len(sentences))
+        return self._model.encode(sentences, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._model, name)
+
+
+def write_cascade_report(path, stats):
+    with open(path, 'w', encoding='utf-8', newline='\n') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Tier', 'Status', 'EstimatedCostUs', 'Entries', 'Matched', 'Unmatched', 'Remaining', 'Seconds', 'UsPerEntry', 'Encodes'])
+        for tier_stats in stats:
+            writer.writerow([
+                tier_stats.tier.name, tier_stats.status, f"{tier_stats.tier.estimated_us:g}", tier_stats.entries, tier_stats.matched,
+                tier_stats.unmatched, tier_stats.remaining, f"{tier_stats.seconds:.3f}",
+                f"{tier_stats.seconds * 1e6 / tier_stats.entries:.0f}" if tier_stats.entries else '', tier_stats.encodes,
+            ])
@@ -0,0 +1,121 @@
+"""
+匹配脚本的日志设置。
+
+日志记录由 QueueHandler 放入队列，由 QueueListener 在后台线程格式化并写入 match_voice.log 和控制台，
+匹配循环中只有创建记录的开销，没有文件和终端 I/O。记录在入队时不做格式化，消息参数应使用
+%-风格（logger.debug("%s: %s", a, b)），被级别过滤掉的记录不会拼接字符串。
+
+各阶段使用独立的日志器 match.<阶段>，可以用 --log-level 单独设置级别；逐条目的日志使用 match.<阶段>.entries，
+默认只写入日志文件（DEBUG），可以用 --log-sample 只保留每 N 条中的一条。
+"""
+import argparse
+import atexit
+import itertools
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+# 日志文件
+LOG_FILE = 'match_voice.log'
+# 可单独设置级别的阶段
+STAGES = ('filter', 'ordinal', 'blockwise', 'context', 'ladder', 'locality', 'split_merge', 'vector')
+
+
+def stage_logger(stage):
+    """阶段的日志器，用于阶段开始、结束和统计信息。"""
+    return logging.getLogger(f'match.{stage}')
+
+
+def entry_logger(stage):
+    """阶段中逐条目的日志器。"""
+    return logging.getLogger(f'match.{stage}.entries')
+
+
+class DeferredQueueHandler(QueueHandler):
+    """不在调用线程中格式化记录，格式化交给 QueueListener 的后台线程。"""
+
+    def prepare(self, record):
+        return record
+
+
+class SampleFilter(logging.Filter):
+    """每 every 条记录保留一条。"""
+
+    def __init__(self, every):
+        super().__init__()
+        self.every = every
+        self._counter = itertools.count()
+
+    def filter(self, record):
+        return next(self._counter) % self.every == 0
+
+
+def parse_stage_level(spec):
+    """解析 'stage=LEVEL'，供 argparse 使用。"""
+    stage, _, level = spec.partition('=')
+    if stage not in STAGES:
+        raise argparse.ArgumentTypeError(f"未知的阶段 '{stage}'，可选: {', '.join(STAGES)}")
+    level_value = logging.getLevelName(level.upper())
+    if not isinstance(level_value, int):
+        raise argparse.ArgumentTypeError(f"未知的日志级别 '{level}'，可选: DEBUG、INFO、WARNING、ERROR")
+    return stage, level_value
+
+
+_listener = None
+
+
+def stop_logging():
+    """写出队列中剩余的记录并停止后台线程。程序退出时自动调用。"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+def setup_logging(log_file=LOG_FILE, verbose=False, stage_levels=(), sample_every=1, filters=()):
+    """
+    配置根日志器。重复调用时替换之前的设置。
+
+    Args:
+        log_file (str): 日志文件，每次运行时覆盖。记录 DEBUG 及以上级别。
+        verbose (bool): 控制台也输出 DEBUG 级别（逐条目）的日志，默认只输出 INFO 及以上级别。
+        stage_levels (list): (阶段, 级别) 列表，单独设置某个阶段的日志级别（同时作用于其逐条目日志）。
+        sample_every (int): 逐条目的日志每 sample_every 条只保留一条。
+        filters (list): 添加到队列处理器上的过滤器，对所有日志器的记录都生效。
+    """
+    global _listener
+    if _listener is None:
+        atexit.register(stop_logging)
+    stop_logging()
+
+    root = logging.getLogger()
+    root.setLevel(logging.DEBUG)
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+
+    file_handler = logging.FileHandler(log_file, mode='w', encoding='utf-8')
+    file_handler.setLevel(logging.DEBUG)
+    file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    console_handler = logging.StreamHandler()
+    console_handler.setLevel(logging.DEBUG if verbose else logging.INFO)
+    console_handler.setFormatter(logging.Formatter('%(message)s'))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = DeferredQueueHandler(log_queue)
+    for log_filter in filters:
+        queue_handler.addFilter(log_filter)
+    root.addHandler(queue_handler)
+    _listener = QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    _listener.start()
+
+    levels = dict(stage_levels)
+    for stage in STAGES:
+        stage_logger(stage).setLevel(levels.get(stage, logging.NOTSET))
+        entries = entry_logger(stage)
+        for log_filter in list(entries.filters):
+            entries.removeFilter(log_filter)
+        if sample_every > 1:
+            entries.addFilter(SampleFilter(sample_every))
+    return _listener
@@ -1,10 +1,14 @@
+import copy
 import json
 import os
 import re
 import argparse
 import logging
 from collections import defaultdict
-from sentence_transformers import SentenceTransformer, util
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from difflib import SequenceMatcher
+from sentence_transformers import util
 import torch
 import wave
 import struct
@@ -12,36 +16,31 @@ from pathlib import Path
 import sys
 import io
 import csv
-
-# --- Logging Setup ---
-# Create logger
+from functools import lru_cache
+from checkpoints import CHECKPOINT_DIR, RunCheckpoint, dump_candidate, dump_match, file_digest, load_candidate, load_match, run_fingerprint
+from condition_voice import TARGET_CHANNELS, TARGET_SAMPLE_RATE
+from corpus_index import CORPUS_INDEX_DIR, CorpusIndexError, build_lookup_maps, corpus_index_dir, open_corpus_index, prepare_old_entries, triplet_map
+from embedding_cache import EMBEDDING_CACHE_FILE, EmbeddingCache
+from model_artifact import MODEL_ARTIFACT_DIR, ModelArtifactError, check_artifact, load_model, model_key
+from match_cascade import CASCADE_REPORT_CSV, CountingEncoder, MatchCascade, write_cascade_report
+from match_logging import STAGES, entry_logger, parse_stage_level, setup_logging, stage_logger
+from incremental_match import MATCH_FINGERPRINT_FILE, entry_fingerprints, load_previous_run, options_fingerprint, plan_rematch, save_fingerprints
+from result_store import RESULT_DB_FILE, write_results
+from threshold_sweep import SWEEP_REPORT_CSV, SWEEP_SCORES_FILE, SWEEP_VERSION, collect_sweep_scores, evaluate_thresholds, load_labels, load_sweep_scores, save_sweep_scores, write_sweep_report
+from vector_shards import ShardedScorer, score_queries, score_queries_sharded
+from verifiers import DEFAULT_VERIFIER_CHAIN, parse_verifier, verify_pairs
+from ordinal_mapping import CHARACTER_MAPPING_FILE, ORDINAL_CATEGORIES, ORDINAL_TABLE_FILE, load_character_mapping, read_ordinal_table
+from normalization import NORMALIZATION_LEVELS, ladder_keys, ladder_match_type, normalize_text
+from voice_durations import DURATION_CACHE_FILE, DURATION_FLAGS_CSV, OLD_VOICE_WAV_DIR, REMAKE_VOICE_WAV_DIR, build_duration_index, flag_duration_outliers, pick_by_duration, write_duration_flags
+from voice_records import CandidateRecord, MatchRecord, OldVoiceEntry, RemakeVoiceEntry, TextTable, UnmatchedRecord, link_context
+
+# 日志在 main() 中通过 match_logging.setup_logging() 配置，各阶段使用 match_logging 中的阶段日志器
 logger = logging.getLogger()
-logger.setLevel(logging.DEBUG) # Set lowest level to capture all messages
-
-# Create file handler which logs even debug messages
-fh = logging.FileHandler('match_voice.log', mode='w', encoding='utf-8')
-fh.setLevel(logging.DEBUG)
-
-# Create console handler with a higher log level
-ch = logging.StreamHandler()
-ch.setLevel(logging.INFO)
 
-# Create formatter and add it to the handlers
-file_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
-console_formatter = logging.Formatter('%(message)s')
-fh.setFormatter(file_formatter)
-ch.setFormatter(console_formatter)
 
-# Add the handlers to the logger
-logger.addHandler(fh)
-logger.addHandler(ch)
-
-
-def create_empty_wav_file(path):
-    """在指定路径创建一个统一的、短小的静音WAV文件。"""
-    sample_rate = 22050  # VITS default sample rate
+def create_empty_wav_file(path, sample_rate=TARGET_SAMPLE_RATE, channels=TARGET_CHANNELS):
+    """在指定路径创建一个统一的、短小的静音WAV文件。默认格式与 condition_voice.py 的目标格式相同。"""
     duration_ms = 100
-    channels = 1
     sampwidth = 2  # 16-bit
     num_frames = int(duration_ms * (sample_rate / 1000.0))
 
@@ -50,7 +49,7 @@ def create_empty_wav_file(path):
         wav_file.setnchannels(channels)
         wav_file.setsampwidth(sampwidth)
         wav_file.setframerate(sample_rate)
-        frame = struct.pack('<h', 0)
+        frame = struct.pack('<h', 0) * channels
         wav_file.writeframes(frame * num_frames)
 
 # --- 配置 ---
@@ -70,11 +69,27 @@ SKIPPED_OUTPUT_FILE = 'skipped_voice_data.json'
 MATCH_RESULT_CSV = 'match_result.csv'
 
 
-def normalize_text(text):
-    """移除文本中的所有标点符号和空格，用于匹配。"""
-    # 此正则表达式应能处理日文和英文标点
-    return re.sub(r'[\s\W]', '', text)
+@dataclass
+class MatchPaths:
+    """一次匹配的输入文件和输出目录。输出文件使用固定的文件名，写入 output_dir 下。"""
+    new_voice_file: str = NEW_VOICE_FILE
+    old_voice_file: str = OLD_VOICE_FILE
+    old_script_file: str = OLD_SCRIPT_FILE
+    output_dir: str = '.'
+
+    def output(self, name):
+        return os.path.normpath(os.path.join(self.output_dir, name))
 
+
+# 角色语音: v<角色ID>_<类型>_<序号>.wav (e.g., v001_00_0001.wav, v327_gs_0002.wav)
+CHARACTER_VOICE_PATTERN = re.compile(r'^v(\d{3})_(\w{2})_(\d{4}[br]?)\.wav$')
+# 战斗/系统语音: v<角色ID>_<类型><序号>.wav (e.g., v001_b0001.wav, v001_s0001.wav, v001_b0118b.wav)
+BATTLE_SYSTEM_VOICE_PATTERN = re.compile(r'^v(\d{3})_([bs])(\d{4}[br]?)\.wav$')
+# 音效: v_se_<描述>.wav (e.g., v_se_cat_02.wav)
+SOUND_EFFECT_PATTERN = re.compile(r'^v_se_(.*)\.wav$')
+
+
+@lru_cache(maxsize=None)
 def classify_voice_file(filename):
     """
     根据文件名对语音文件进行分类。
@@ -87,8 +102,8 @@ def classify_voice_file(filename):
               例如 {'type': 'character_voice', 'character_id': '001', 'category': 'main', 'number': '0001'}
               或 {'type': 'sound_effect', 'description': 'cat_02'}
     """
-    # 角色语音: v<角色ID>_<类型>_<序号>.wav (e.g., v001_00_0001.wav, v327_gs_0002.wav)
-    match = re.match(r'^v(\d{3})_(\w{2})_(\d{4}[br]?)\.wav$', filename)
+    # 角色语音: v<角色ID>_<类型>_<序号>.wav
+    match = CHARACTER_VOICE_PATTERN.match(filename)
     if match:
         char_id, category_code, number = match.groups()
 
@@ -109,8 +124,8 @@ def classify_voice_file(filename):
             'number': number
         }
 
-    # 战斗/系统语音: v<角色ID>_<类型><序号>.wav (e.g., v001_b0001.wav, v001_s0001.wav, v001_b0118b.wav)
-    match = re.match(r'^v(\d{3})_([bs])(\d{4}[br]?)\.wav$', filename)
+    # 战斗/系统语音: v<角色ID>_<类型><序号>.wav
+    match = BATTLE_SYSTEM_VOICE_PATTERN.match(filename)
     if match:
         char_id, category_code, number = match.groups()
         category_map = {
@@ -124,8 +139,8 @@ def classify_voice_file(filename):
             'number': number
         }
 
-    # 音效: v_se_<描述>.wav (e.g., v_se_cat_02.wav)
-    match = re.match(r'^v_se_(.*)\.wav$', filename)
+    # 音效: v_se_<描述>.wav
+    match = SOUND_EFFECT_PATTERN.match(filename)
     if match:
         description = match.group(1)
         return {
@@ -135,66 +150,110 @@ def classify_voice_file(filename):
 
     return {'type': 'unknown', 'filename': filename}
 
-def find_best_match(new_entry, old_data_map, old_data_normalized_map, old_script_list, model, old_embeddings, args, used_old_voice_ids, methods):
-    """执行指定方法的匹配策略来查找最佳匹配。"""
-    new_text = new_entry['text']
-
-    # 1. 精确匹配
-    if 'exact' in methods and new_text in old_data_map:
-        for candidate in old_data_map[new_text]:
-            if candidate['voice_id'] not in used_old_voice_ids:
-                return candidate, 'exact'
-
-    # 2. 移除标点后匹配
-    if 'normalized' in methods and (normalized_new_text := normalize_text(new_text)) and normalized_new_text in old_data_normalized_map:
-        for candidate in old_data_normalized_map[normalized_new_text]:
-            if candidate['voice_id'] not in used_old_voice_ids:
-                return candidate, 'normalized'
-
-    # 3. 向量相似度匹配
-    if 'vector' in methods and not args.no_similarity_search:
-        contextual_new_text = f"{new_entry.get('context_prev', '')} {new_text} {new_entry.get('context_next', '')}".strip()
-        query_embedding = model.encode(contextual_new_text, convert_to_tensor=True)
-        hits = util.semantic_search(query_embedding, old_embeddings, top_k=1)
-        if hits and hits[0][0]['score'] > args.similarity_threshold:
-            best_match_candidate = old_script_list[hits[0][0]['corpus_id']]
-            score = hits[0][0]['score']
-            match_type = f'vector_search ({score:.2f})'
-            # check vector similarity of old text and matched text, in ignorance of context
-            best_match_text = best_match_candidate['text']
-            new_text = new_entry['text']
-            best_match_text_embedding = model.encode(best_match_text, convert_to_tensor=True)
-            new_text_embedding = model.encode(new_text, convert_to_tensor=True)
-            # calculate vector similarity, don't use semantic_search
-            text_similarity = util.cos_sim(new_text_embedding, best_match_text_embedding)[0][0].item()
-            if text_similarity >= args.similarity_threshold:
-                return best_match_candidate, match_type
-
-    return None, None
-
-def blockwise_match(scripts, voice_table, old_voice_id_to_entry_map):
-    """按照3个为一组进行匹配，之后将匹配结果之间的空隙使用边界的匹配结果作为提示再次匹配，输出匹配的结果"""
-    scripts = [s for s in scripts if s.get('text')]
-    voice_table = [v for v in voice_table if v.get('text')]
-    script_slide_iterators = [scripts[i:] for i in range(3)]
-    voice_table_slide_iterators = [voice_table[i:] for i in range(3)]
-    script_id_map = {script['script_id']: script for script in scripts}
-    voice_table_id_map = {voice['id']: voice for voice in voice_table}
-    script_context_map = {script_slide[0]['text'] + "||" + script_slide[1]['text'] + "||" + script_slide[2]['text']: script_slide for script_slide in zip(*script_slide_iterators)}
-    voice_table_context_map = {voice_slide[0]['text'] + "||" + voice_slide[1]['text'] + "||" + voice_slide[2]['text']: voice_slide for voice_slide in zip(*voice_table_slide_iterators)}
+def contextual_text(entry):
+    """返回带前后句上下文的文本，用于向量检索。"""
+    return f"{entry.context_prev} {entry.text} {entry.context_next}".strip()
+
+def vector_match(entries, old_script_list, model, old_embeddings, args, embed=None, candidate_log=None, duration_penalty=None, scorer=None, used_old_voice_ids=None):
+    """
+    对一批条目执行向量相似度匹配。
+
+    先用带上下文的文本在旧脚本向量中检索最相似的条目，再用复核器链（--verifier-chain）复核台词本身是否相近：
+    字面复核器直接比较标准化文本，无法下结论时才用不含上下文的文本向量计算相似度。
+    查询按批编码；--vector-workers 大于 1 时，查询被拆分给多个进程，旧脚本向量矩阵通过共享内存共享。
+
+    Args:
+        embed (callable, optional): 文本列表 -> 向量张量，供 embedding 复核器使用，默认直接调用模型编码。
+        candidate_log (list, optional): 记录每个条目的最佳候选项及其分数、复核结果，供结果数据库使用。
+        duration_penalty (callable, optional): 时长惩罚函数。设置时检索前 --duration-top-k 个候选项，
+            在分数相近的候选项中选择时长最一致的一个。
+        scorer (ShardedScorer, optional): 多次调用共用的分片检索器（进程池）；未设置且 --vector-workers 大于 1 时每次调用单独启动进程池。
+        used_old_voice_ids (set, optional): 已被前面各级使用的旧语音ID。设置时检索前 --duration-top-k 个候选项，
+            跳过已使用的旧语音；同一批中多个条目复核通过同一旧语音时只保留第一个。本函数不修改这个集合。
+
+    Returns:
+        list: 与 entries 一一对应的 (旧脚本条目, match_type) 元组，未匹配时为 (None, None)。
+    """
+    contextual_texts = [contextual_text(entry) for entry in entries]
+    bare_texts = [entry.text for entry in entries]
+    old_texts = [entry.text for entry in old_script_list]
+    top_k = args.duration_top_k if duration_penalty is not None or used_old_voice_ids else 1
+    if scorer is not None and len(entries) > 1:
+        scores = scorer.score(contextual_texts, bare_texts, args.similarity_threshold, verify=False, top_k=top_k)
+    elif getattr(args, 'vector_workers', 1) > 1 and len(entries) > 1:
+        scores = score_queries_sharded(old_embeddings, old_texts, contextual_texts, bare_texts, args.similarity_threshold, args.model_dir, args.vector_workers, verify=False, top_k=top_k)
+    else:
+        scores = score_queries(model, old_embeddings, old_texts, contextual_texts, bare_texts, args.similarity_threshold, verify=False, top_k=top_k)
+    if used_old_voice_ids:
+        # 去掉已使用的旧语音，剩余候选项中分数最高的成为命中
+        for i, hit in enumerate(scores):
+            if hit is not None:
+                ranked = [(c, s) for c, s in hit[3] if old_script_list[c].voice_id not in used_old_voice_ids]
+                scores[i] = (ranked[0][0], ranked[0][1], None, ranked) if ranked else None
+    if duration_penalty is not None:
+        for i, hit in enumerate(scores):
+            if hit is not None and len(hit[3]) > 1:
+                _, score, corpus_id = pick_by_duration(entries[i], [(old_script_list[c], s, c) for c, s in hit[3]], args.duration_margin, duration_penalty)
+                scores[i] = (corpus_id, score, None)
+
+    hits = [
+        (i, hit[0], hit[1]) for i, hit in enumerate(scores)
+        if hit is not None and hit[1] > args.similarity_threshold
+    ]
+    if embed is None:
+        embed = lambda texts: model.encode(texts, convert_to_tensor=True)
+    # check similarity of old text and matched text, in ignorance of context
+    verdicts = verify_pairs(args.verifier_chain, [(entries[i], old_script_list[corpus_id]) for i, corpus_id, _ in hits], embed, args.similarity_threshold)
+
+    if verdicts:
+        verifier_counts = defaultdict(int)
+        for _, _, verifier in verdicts:
+            verifier_counts[verifier] += 1
+        stage_logger('vector').info("复核 %d 个命中: %s", len(verdicts), "，".join(f"{name} {count}" for name, count in verifier_counts.items()))
+
+    results = [(None, None)] * len(entries)
+    claimed = set()
+    for (i, corpus_id, score), (accepted, _, _) in zip(hits, verdicts):
+        if accepted and (used_old_voice_ids is None or old_script_list[corpus_id].voice_id not in claimed):
+            claimed.add(old_script_list[corpus_id].voice_id)
+            results[i] = (old_script_list[corpus_id], f'vector_search ({score:.2f})')
+
+    if candidate_log is not None:
+        verdict_by_index = {i: verdict for (i, _, _), verdict in zip(hits, verdicts)}
+        for i, hit in enumerate(scores):
+            if hit is not None:
+                _, similarity, verifier = verdict_by_index.get(i, (False, None, None))
+                candidate_log.append(CandidateRecord(entries[i].id, 'vector_search', old_script_list[hit[0]], hit[1], similarity, verifier, results[i][0] is not None))
+    return results
+
+def blockwise_match(scripts, voice_table, old_voice_id_to_entry_map, script_context_map=None, old_voice_scene_order_to_entry_map=None):
+    """
+    按照3个为一组进行匹配，之后将匹配结果之间的空隙使用边界的匹配结果作为提示再次匹配，输出匹配的结果
+
+    script_context_map 和 old_voice_scene_order_to_entry_map 可以由预建的旧语料索引提供，未提供时在这里建立。
+    """
+    scripts = [s for s in scripts if s.text]
+    voice_table = [v for v in voice_table if v.text]
+    script_id_map = {script.script_id: script for script in scripts}
+    # 新旧数据共用同一个文本表，三元组直接用文本下标作为键
+    if script_context_map is None:
+        script_context_map = triplet_map(scripts)
+    voice_table_context_map = triplet_map(voice_table)
     voice_table_context_match = {}
     for voice_context, voice_slide in voice_table_context_map.items():
         if voice_context in script_context_map:
             matched_pairs = zip(voice_slide, script_context_map[voice_context])
             for voice, script in matched_pairs:
-                voice_table_context_match[voice['id']] = script['script_id']
+                voice_table_context_match[voice.id] = script.script_id
     
-    voice_table_context_match_stage1 = [(voice['id'], voice_table_context_match.get(voice['id'],None)) for voice in voice_table]
-    for voice_id, script_id in voice_table_context_match_stage1:
-        if script_id is not None:
-            logger.info(f"{voice_id}: {script_id} | {script_id_map[script_id]['voice_id']}")
-        else:
-            logger.info(f"{voice_id}: None")
+    voice_table_context_match_stage1 = [(voice.id, voice_table_context_match.get(voice.id,None)) for voice in voice_table]
+    entries_log = entry_logger('blockwise')
+    if entries_log.isEnabledFor(logging.DEBUG):
+        for voice_id, script_id in voice_table_context_match_stage1:
+            if script_id is not None:
+                entries_log.debug("%s: %s | %s", voice_id, script_id, script_id_map[script_id].voice_id)
+            else:
+                entries_log.debug("%s: None", voice_id)
     
     def find_none_blocks(matched_items):
         """Find continuous subranges of None values in a list of matched items."""
@@ -235,32 +294,29 @@ def blockwise_match(scripts, voice_table, old_voice_id_to_entry_map):
         start_idx, end_idx = margin_hint['range']
         hint_before, hint_after = margin_hint['hint_before'], margin_hint['hint_after']
         if end_idx - start_idx + 1 == (hint_after[1] - 1) - (hint_before[1] + 1) + 1:
-            logger.info(f"Found continuous margin: {margin_hint}")
+            entries_log.debug("Found continuous margin: %s", margin_hint)
             for idx in range(start_idx, end_idx + 1):
                 predicate_script_id = hint_before[1]+1 + (idx - start_idx)
                 if predicate_script_id not in script_id_map:
-                    logger.info(f"Mapping {voice_table_context_match_stage1[idx][0]} to None | Skipped")
+                    entries_log.debug("Mapping %s to None | Skipped", voice_table_context_match_stage1[idx][0])
                     continue
-                logger.info(f"Mapping {voice_table_context_match_stage1[idx][0]} to {predicate_script_id} | {script_id_map[predicate_script_id]['voice_id']}")
+                entries_log.debug("Mapping %s to %s | %s", voice_table_context_match_stage1[idx][0], predicate_script_id, script_id_map[predicate_script_id].voice_id)
                 script_margin_hint_match[voice_table_context_match_stage1[idx][0]] = predicate_script_id
 
     voice_table_context_match.update(script_margin_hint_match)
-    voice_table_context_match_stage2 = [(voice['id'], voice_table_context_match.get(voice['id'], None)) for voice in voice_table]
+    voice_table_context_match_stage2 = [(voice.id, voice_table_context_match.get(voice.id, None)) for voice in voice_table]
     
     context_match_margins_stage2, voice_margin_hints= find_none_blocks(voice_table_context_match_stage2)
 
-    def get_old_voice_scene_order(old_voice_id):
-        return int(old_voice_id[3:10])
-
-    old_voice_scene_order_to_entry_map = {get_old_voice_scene_order(old_voice_id): old_voice_entry for old_voice_id, old_voice_entry in old_voice_id_to_entry_map.items()}
+    if old_voice_scene_order_to_entry_map is None:
+        old_voice_scene_order_to_entry_map = {old_voice_entry.scene_order: old_voice_entry for old_voice_entry in old_voice_id_to_entry_map.values()}
 
     voice_margin_hint_match = {}
     for margin_hint in voice_margin_hints :
         start_match_idx, end_match_idx = margin_hint['range']
         hint_before, hint_after = margin_hint['hint_before'], margin_hint['hint_after']
-        hint_before_old_voice_id, hint_after_old_voice_id = script_id_map[hint_before[1]].get('voice_id'), script_id_map[hint_after[1]].get('voice_id')
-        hint_before_old_voice_scene_order = get_old_voice_scene_order(hint_before_old_voice_id)
-        hint_after_old_voice_scene_order = get_old_voice_scene_order(hint_after_old_voice_id)
+        hint_before_old_voice_scene_order = script_id_map[hint_before[1]].scene_order
+        hint_after_old_voice_scene_order = script_id_map[hint_after[1]].scene_order
         if (hint_after_old_voice_scene_order - 1) - (hint_before_old_voice_scene_order + 1) + 1 == end_match_idx - start_match_idx + 1:
             is_all_has_voice = True
             for idx in range(start_match_idx, end_match_idx + 1):
@@ -269,39 +325,446 @@ def blockwise_match(scripts, voice_table, old_voice_id_to_entry_map):
                     is_all_has_voice = False
                     break
             if is_all_has_voice:
-                logger.info(f"Found continuous margin: {margin_hint}")
+                entries_log.debug("Found continuous margin: %s", margin_hint)
                 for idx in range(start_match_idx, end_match_idx + 1):
                     predicate_voice_id = hint_before_old_voice_scene_order + 1 + idx - start_match_idx
-                    logger.info(f"Mapping {voice_table_context_match_stage2[idx][0]} to {old_voice_scene_order_to_entry_map[predicate_voice_id]['script_id']} | {old_voice_scene_order_to_entry_map[predicate_voice_id]['voice_id']}")
-                    voice_table_context_match[voice_table_context_match_stage2[idx][0]] = old_voice_scene_order_to_entry_map[predicate_voice_id]['script_id']
+                    entries_log.debug("Mapping %s to %s | %s", voice_table_context_match_stage2[idx][0], old_voice_scene_order_to_entry_map[predicate_voice_id].script_id, old_voice_scene_order_to_entry_map[predicate_voice_id].voice_id)
+                    voice_table_context_match[voice_table_context_match_stage2[idx][0]] = old_voice_scene_order_to_entry_map[predicate_voice_id].script_id
                 
     voice_table_context_match.update(voice_margin_hint_match)    
-    voice_table_context_match_to_old_voice_id = {id: old_voice_id_to_entry_map[script_id_map[script_id]['voice_id']] for id, script_id in voice_table_context_match.items()}
+    voice_table_context_match_to_old_voice_id = {id: old_voice_id_to_entry_map[script_id_map[script_id].voice_id] for id, script_id in voice_table_context_match.items()}
 
     return voice_table_context_match_to_old_voice_id
 
-def create_silent_wav(path, duration_ms=100):
+def ladder_match(entries, ladder_maps, used_old_voice_ids):
     """
-    Creates a silent WAV file.
+    多级标准化键匹配：按 NORMALIZATION_LEVELS 的顺序在各级哈希索引中查找剩余条目。
+
+    某一级未被使用的候选项只有一个、且没有其他剩余条目的键相同时直接匹配；否则只保留该级前后句键也相同的候选项，
+    剩下一个时匹配，剩下多个时停止（更宽松的级别只会有更多候选项），留给局部窗口搜索和向量搜索。
+
+    Args:
+        entries (list): 剩余的新条目，按 ID 排序。
+        ladder_maps (list): 每级一个 标准化键 -> 旧脚本条目列表 的映射。
+        used_old_voice_ids (set): 已使用的旧语音ID，匹配成功时就地更新。
 
-    :param path: Path to save the WAV file.
-    :param duration_ms: Duration of the silence in milliseconds.
+    Returns:
+        tuple: (匹配结果 [(新条目, 旧条目, match_type)], 未匹配的条目)。
     """
-    sample_rate = 22050  # VITS default sample rate
-    channels = 1
-    sampwidth = 2  # 16-bit
-    num_frames = int(duration_ms * (sample_rate / 1000.0))
+    def unused(candidates):
+        # 只需要区分 0、1、多个：找到两个不同的未使用语音即可停止
+        found = {}
+        for candidate in candidates:
+            if candidate.voice_id not in used_old_voice_ids and candidate.voice_id not in found:
+                found[candidate.voice_id] = candidate
+                if len(found) > 1:
+                    break
+        return list(found.values())
+
+    # (级别, 标准化键) -> {(前一句的键, 后一句的键): 旧脚本条目列表}，只为出现歧义的键建立
+    context_indexes = {}
+
+    def context_candidates(level, key, prev_key, next_key):
+        index = context_indexes.get((level, key))
+        if index is None:
+            index = context_indexes[(level, key)] = defaultdict(list)
+            for candidate in ladder_maps[level][key]:
+                index[(ladder_keys(candidate.context_prev)[level], ladder_keys(candidate.context_next)[level])].append(candidate)
+        return index.get((prev_key, next_key), ())
+
+    new_key_counts = [defaultdict(int) for _ in NORMALIZATION_LEVELS]
+    for new_entry in entries:
+        for counts, key in zip(new_key_counts, ladder_keys(new_entry.text)):
+            counts[key] += 1
+
+    matches = []
+    remaining = []
+    for new_entry in entries:
+        best_match = None
+        for level, key in enumerate(ladder_keys(new_entry.text)):
+            if not key:
+                continue
+            candidates = unused(ladder_maps[level].get(key, ()))
+            if not candidates:
+                continue
+            if len(candidates) > 1 or new_key_counts[level][key] > 1:
+                candidates = unused(context_candidates(level, key, ladder_keys(new_entry.context_prev)[level], ladder_keys(new_entry.context_next)[level]))
+                if len(candidates) > 1:
+                    break
+                if not candidates:
+                    continue
+            best_match = (candidates[0], ladder_match_type(level))
+            break
 
-    with wave.open(str(path), 'wb') as wav_file:
-        wav_file.setnchannels(channels)
-        wav_file.setsampwidth(sampwidth)
-        wav_file.setframerate(sample_rate)
-        # Write zero frames for silence
-        frame = struct.pack('<h', 0)
-        wav_file.writeframes(frame * num_frames)
+        if best_match is None:
+            remaining.append(new_entry)
+            continue
+        used_old_voice_ids.add(best_match[0].voice_id)
+        matches.append((new_entry, *best_match))
+    return matches, remaining
 
-def main():
-    """主函数，执行匹配和生成文件。"""
+def locality_windows(entries, anchor_map, old_position_map, radius):
+    """
+    根据前后锚点为每个未匹配条目推算旧语音顺序中的候选窗口。
+
+    锚点是已在前面阶段匹配成功的条目。以前一个锚点为例，若目标条目在新数据中位于锚点之后第 k 条，
+    则其在旧语音顺序中的期望位置为锚点位置 + k，窗口为期望位置前后 radius 条；后一个锚点同理。
+    两个窗口取并集，因此窗口大小始终有界。
+
+    Args:
+        entries (list): 按 id 排序的全部待处理新语音条目。
+        anchor_map (dict): new_voice_id -> 已匹配的旧语音 voice_id。
+        old_position_map (dict): 旧语音 voice_id -> 在按场景排序的旧语音列表中的位置。
+        radius (int): 期望位置两侧的窗口半径。
+
+    Returns:
+        dict: new_voice_id -> 排序后的候选位置列表。没有任何锚点的条目不会出现在结果中。
+    """
+    anchor_positions = [
+        old_position_map.get(anchor_map[entry.id]) if entry.id in anchor_map else None
+        for entry in entries
+    ]
+
+    # 每个条目之前和之后最近的锚点 (条目下标, 旧语音位置)
+    prev_anchors = [None] * len(entries)
+    last_anchor = None
+    for i, position in enumerate(anchor_positions):
+        prev_anchors[i] = last_anchor
+        if position is not None:
+            last_anchor = (i, position)
+    next_anchors = [None] * len(entries)
+    last_anchor = None
+    for i in range(len(entries) - 1, -1, -1):
+        next_anchors[i] = last_anchor
+        if anchor_positions[i] is not None:
+            last_anchor = (i, anchor_positions[i])
+
+    windows = {}
+    for i, entry in enumerate(entries):
+        if entry.id in anchor_map:
+            continue
+        positions = set()
+        if prev_anchors[i] is not None:
+            anchor_idx, anchor_position = prev_anchors[i]
+            expected = anchor_position + (i - anchor_idx)
+            positions.update(range(expected - radius, expected + radius + 1))
+        if next_anchors[i] is not None:
+            anchor_idx, anchor_position = next_anchors[i]
+            expected = anchor_position - (anchor_idx - i)
+            positions.update(range(expected - radius, expected + radius + 1))
+        if positions:
+            windows[entry.id] = sorted(positions)
+    return windows
+
+def locality_candidates(window, old_data_list, used_old_voice_ids):
+    """返回窗口内有文本且尚未被使用的旧语音条目。"""
+    return [
+        old_data_list[position] for position in window
+        if 0 <= position < len(old_data_list)
+        and old_data_list[position].text
+        and old_data_list[position].voice_id not in used_old_voice_ids
+    ]
+
+def locality_match(remaining_entries, windows, old_data_list, used_old_voice_ids, args, model=None, old_embeddings=None, old_script_index_map=None, embed=None, candidate_log=None, duration_penalty=None):
+    """
+    只在锚点附近的窗口内为剩余条目打分并选出最佳候选项。
+
+    先对窗口内候选项计算标准化文本的字面相似度；达不到阈值且模型可用时，再用上下文向量
+    只与窗口内候选项计算相似度，并按与第三遍相同的方式用复核器链复核。设置 duration_penalty 时，
+    两种打分中与最高分相差不超过 --duration-margin 的候选项按时长一致性选择。
+
+    Returns:
+        tuple: (matches, anchorless)。matches 为 (新条目, 旧条目, match_type) 的列表；
+               anchorless 为没有锚点、需要回退到全局向量搜索的条目列表。
+    """
+    matches = []
+    anchorless = []
+    pending_vector = []
+    for new_entry in remaining_entries:
+        window = windows.get(new_entry.id)
+        if window is None:
+            anchorless.append(new_entry)
+            continue
+
+        candidates = locality_candidates(window, old_data_list, used_old_voice_ids)
+        if not candidates:
+            continue
+
+        new_normalized = new_entry.normalized or new_entry.text
+        if duration_penalty is not None:
+            scored = [(candidate, SequenceMatcher(None, new_normalized, candidate.normalized or candidate.text).ratio()) for candidate in candidates]
+            best_candidate, best_score = pick_by_duration(new_entry, scored, args.duration_margin, duration_penalty)
+        else:
+            best_candidate, best_score = None, 0.0
+            for candidate in candidates:
+                candidate_normalized = candidate.normalized or candidate.text
+                score = SequenceMatcher(None, new_normalized, candidate_normalized).ratio()
+                if score > best_score:
+                    best_candidate, best_score = candidate, score
+
+        if best_score >= args.locality_threshold:
+            used_old_voice_ids.add(best_candidate.voice_id)
+            matches.append((new_entry, best_candidate, f'locality ({best_score:.2f})'))
+        elif model is not None and old_script_index_map:
+            scored_candidates = [c for c in candidates if c.voice_id in old_script_index_map]
+            if scored_candidates:
+                pending_vector.append((new_entry, scored_candidates))
+
+    if pending_vector:
+        # 批量编码查询，避免逐条调用模型
+        contextual_texts = [contextual_text(entry) for entry, _ in pending_vector]
+        query_embeddings = model.encode(contextual_texts, convert_to_tensor=True)
+        if embed is None:
+            embed = lambda texts: model.encode(texts, convert_to_tensor=True)
+        for (new_entry, candidates), query_embedding in zip(pending_vector, query_embeddings):
+            candidates = [c for c in candidates if c.voice_id not in used_old_voice_ids]
+            if not candidates:
+                continue
+            rows = [old_script_index_map[c.voice_id] for c in candidates]
+            scores = util.cos_sim(query_embedding, old_embeddings[rows].to(query_embedding.device))[0]
+            if duration_penalty is not None:
+                best_candidate, score = pick_by_duration(new_entry, list(zip(candidates, scores.tolist())), args.duration_margin, duration_penalty)
+            else:
+                best_idx = int(torch.argmax(scores))
+                best_candidate, score = candidates[best_idx], scores[best_idx].item()
+            if score <= args.similarity_threshold:
+                continue
+            accepted, similarity, verifier = verify_pairs(args.verifier_chain, [(new_entry, best_candidate)], embed, args.similarity_threshold)[0]
+            if candidate_log is not None:
+                candidate_log.append(CandidateRecord(new_entry.id, 'locality_vector', best_candidate, score, similarity, verifier, accepted))
+            if accepted:
+                used_old_voice_ids.add(best_candidate.voice_id)
+                matches.append((new_entry, best_candidate, f'locality_vector ({score:.2f})'))
+
+    return matches, anchorless
+
+def split_merge_match(entries, unmatched_ids, matched_old_entries, windows, old_data_list, used_old_voice_ids, threshold, max_parts=3):
+    """
+    在锚点附近的窗口内为拆分或合并过的台词做多对一对齐。
+
+    拆分：重制版把一句旧台词拆成了 2~max_parts 条语音。把同一角色的相邻未匹配条目依次拼接，
+    与窗口内的旧台词比较标准化文本的字面相似度，所有组成条目都指向同一个旧语音。拆分后的一部分可能已经单独
+    匹配到了这句旧台词，因此也会把未匹配条目与前后已匹配的同角色条目拼接，与后者所匹配的旧台词比较。
+    合并：重制版把同一场景中同一角色连续的 2~max_parts 句旧台词合并成了一条语音。把窗口内连续的旧台词拼接后
+    与该条目比较，条目指向其中第一句旧语音。
+
+    每个条目只比较窗口内的有限个候选项和有限种拼接方式，因此开销与未匹配条目数成线性关系。
+
+    Args:
+        entries (list): 按 id 排序的全部待处理新语音条目。
+        unmatched_ids (set): 目前未匹配的新语音ID。
+        matched_old_entries (dict): 已匹配的新语音ID -> 旧条目。
+        windows (dict): locality_windows 的结果。
+        old_data_list (list): 按场景排序的旧语音列表。
+        used_old_voice_ids (set): 已被使用的旧语音ID，对齐成功的旧语音（合并时为被合并的每一句）会加入其中。
+        threshold (float): 字面相似度阈值。
+        max_parts (int): 一组拼接的最大条数。
+
+    Returns:
+        list: (新条目, 旧条目, match_type) 的列表。与已匹配条目拼接成功时，该已匹配条目也会以新的 match_type 出现在列表中。
+    """
+    def similarity(a, b):
+        return SequenceMatcher(None, a, b).ratio()
+
+    def normalized(entry):
+        return entry.normalized or entry.text
+
+    matches = []
+    resolved = set()
+    for i, new_entry in enumerate(entries):
+        if new_entry.id not in unmatched_ids or new_entry.id in resolved or new_entry.id not in windows:
+            continue
+
+        # 同一角色的后续未匹配条目（中间允许夹着其他角色的语音），遇到已匹配的同角色条目即停止
+        group = [new_entry]
+        for next_entry in entries[i + 1:i + 1 + 2 * max_parts]:
+            if len(group) == max_parts:
+                break
+            if next_entry.character_id != new_entry.character_id:
+                continue
+            if next_entry.id not in unmatched_ids or next_entry.id in resolved:
+                break
+            group.append(next_entry)
+
+        best = None  # (score, old_entry, parts, kind, 占用的旧语音ID)
+        window = [position for position in windows[new_entry.id] if 0 <= position < len(old_data_list)]
+        for position in window:
+            candidate = old_data_list[position]
+            if not candidate.text or candidate.voice_id in used_old_voice_ids:
+                continue
+            # 拆分：多条新语音对应一句旧台词
+            joined = ''
+            for parts, member in enumerate(group, start=1):
+                joined += normalized(member)
+                if parts < 2:
+                    continue
+                score = similarity(joined, normalized(candidate))
+                if score >= threshold and (best is None or score > best[0]):
+                    best = (score, candidate, group[:parts], 'split', [candidate.voice_id])
+            # 合并：一条新语音对应同一场景、同一角色连续的多句旧台词
+            joined = normalized(candidate)
+            for parts in range(2, max_parts + 1):
+                position_next = position + parts - 1
+                if position_next >= len(old_data_list):
+                    break
+                following = old_data_list[position_next]
+                if (following.scene_id != candidate.scene_id or following.voice_id[:3] != candidate.voice_id[:3]
+                        or not following.text or following.voice_id in used_old_voice_ids):
+                    break
+                joined += normalized(following)
+                score = similarity(normalized(new_entry), joined)
+                if score >= threshold and (best is None or score > best[0]):
+                    best = (score, candidate, parts, 'merge', [entry.voice_id for entry in old_data_list[position:position_next + 1]])
+
+        # 与前后已匹配的同角色条目拼接
+        if best is None:
+            for step in (-1, 1):
+                neighbour = None
+                for j in range(i + step, i + step * (2 * max_parts + 1), step):
+                    if not 0 <= j < len(entries):
+                        break
+                    if entries[j].character_id == new_entry.character_id:
+                        neighbour = entries[j]
+                        break
+                if neighbour is None or neighbour.id not in matched_old_entries:
+                    continue
+                old_entry = matched_old_entries[neighbour.id]
+                parts = [neighbour, new_entry] if step < 0 else [new_entry, neighbour]
+                score = similarity(''.join(normalized(member) for member in parts), normalized(old_entry))
+                if score >= threshold and (best is None or score > best[0]):
+                    best = (score, old_entry, parts, 'split', [old_entry.voice_id])
+
+        if best is None:
+            continue
+        score, old_entry, parts, kind, claimed = best
+        # 合并时被合并的后续旧台词同样被占用，不能再参与其他条目的对齐或后续各级
+        used_old_voice_ids.update(claimed)
+        if kind == 'split':
+            for part, member in enumerate(parts, start=1):
+                resolved.add(member.id)
+                matches.append((member, old_entry, f'split ({part}/{len(parts)}, {score:.2f})'))
+        else:
+            resolved.add(new_entry.id)
+            matches.append((new_entry, old_entry, f'merge ({parts}, {score:.2f})'))
+    return matches
+
+def sweep_candidates(remaining_entries, entries_to_process, matched_data, old_data_list, old_position_map, used_old_voice_ids, args):
+    """
+    为阈值扫描找出所有取决于相似度阈值的条目。
+
+    与正常流程相同，先执行局部窗口的字面匹配（与阈值无关，成功的条目加入 matched_data）；有锚点但未匹配的条目
+    只在窗口内打分，没有锚点的条目（或禁用局部窗口搜索时的全部剩余条目）在整个旧脚本列表中打分。
+
+    Returns:
+        list: (新条目, scope, 候选项) 元组。scope 为 'window' 时候选项为窗口内的旧语音条目，为 'global' 时为 None。
+    """
+    sweep_entries = []
+    if not args.no_locality_search:
+        remaining_entries.sort(key=lambda x: x.id)
+        anchor_map = {record.new_entry.id: record.old_entry.voice_id for record in matched_data}
+        windows = locality_windows(entries_to_process, anchor_map, old_position_map, args.locality_radius)
+        lexical_matches, anchorless_entries = locality_match(remaining_entries, windows, old_data_list, used_old_voice_ids, args)
+        logger.info(f"局部窗口字面匹配: {len(lexical_matches)} 条，不参与阈值扫描。")
+        matched_data.extend(build_matched_record(*match) for match in lexical_matches)
+        resolved_ids = {new_entry.id for new_entry, _, _ in lexical_matches}
+        resolved_ids.update(entry.id for entry in anchorless_entries)
+        for new_entry in remaining_entries:
+            if new_entry.id not in resolved_ids:
+                sweep_entries.append((new_entry, 'window', locality_candidates(windows[new_entry.id], old_data_list, used_old_voice_ids)))
+        remaining_entries = anchorless_entries
+    sweep_entries.extend((new_entry, 'global', None) for new_entry in remaining_entries)
+    return sweep_entries
+
+def score_sweep_candidates(sweep_entries, old_script_list, old_script_index_map, model, old_embeddings, args):
+    """为 sweep_candidates 的结果打分，窗口内的候选项只取有旧脚本向量的条目。"""
+    logger.info(f"正在为 {len(sweep_entries)} 条候选条目打分 (top_k={args.sweep_top_k})...")
+    scored_entries = [
+        (new_entry, scope, None if candidates is None else [
+            old_script_index_map[candidate.voice_id] for candidate in candidates if candidate.voice_id in old_script_index_map
+        ])
+        for new_entry, scope, candidates in sweep_entries
+    ]
+    contextual_texts = [contextual_text(entry) for entry, _, _ in scored_entries]
+    return collect_sweep_scores(model, old_embeddings, old_script_list, scored_entries, contextual_texts, args.sweep_top_k, args.verifier_chain)
+
+def sweep_split_merge(entries, matched_data, unmatched_ids, old_data_list, old_position_map, used_old_voice_ids, args):
+    """
+    返回阈值扫描使用的拆分/合并对齐函数，与正常流程一样在局部窗口搜索之后、第三遍之前执行。
+
+    返回的函数接收某个阈值下局部窗口向量匹配的结果 {new_voice_id: 旧语音ID}，把它们与前面各级的匹配一起作为锚点，
+    对仍未匹配的条目执行 split_merge_match，返回对齐成功的 {new_voice_id: 旧语音ID}。
+    """
+    base_matches = {record.new_entry.id: record.old_entry for record in matched_data}
+
+    def split_merge(window_matches):
+        matched_old_entries = dict(base_matches)
+        matched_old_entries.update((new_voice_id, old_data_list[old_position_map[old_voice_id]]) for new_voice_id, old_voice_id in window_matches.items())
+        anchor_map = {new_voice_id: old_entry.voice_id for new_voice_id, old_entry in matched_old_entries.items()}
+        windows = locality_windows(entries, anchor_map, old_position_map, args.locality_radius)
+        matches = split_merge_match(
+            entries, unmatched_ids - window_matches.keys(), matched_old_entries, windows, old_data_list,
+            used_old_voice_ids | set(anchor_map.values()), args.split_merge_threshold
+        )
+        return {new_entry.id: old_entry.voice_id for new_entry, old_entry, _ in matches if new_entry.id not in matched_old_entries}
+
+    return split_merge
+
+def report_threshold_sweep(sweep_scores, args, paths, split_merge=None):
+    """在打分结果上评估 --threshold-sweep 给出的阈值，把报告写入输出目录并输出到日志。"""
+    labels = load_labels(args.sweep_labels) if args.sweep_labels else None
+    report = evaluate_thresholds(sweep_scores, args.threshold_sweep, args.similarity_threshold, labels, args.verifier_chain, split_merge)
+    write_sweep_report(paths.output(SWEEP_REPORT_CSV), report)
+
+    logger.info(f"\n--- 阈值扫描 (基准阈值: {args.similarity_threshold}，候选条目: {len(sweep_scores)}) ---")
+    for row in report:
+        line = f"阈值 {row['Threshold']:.3f}: 匹配 {row['Matched']}，相对基准变化 {row['ChangedVsBaseline']}"
+        if labels:
+            precision = f"{row['Precision']:.3f}" if row['Precision'] is not None else '-'
+            recall = f"{row['Recall']:.3f}" if row['Recall'] is not None else '-'
+            line += f"，标注样本: 匹配 {row['LabelledMatched']}，正确 {row['Correct']}，准确率 {precision}，召回率 {recall}"
+        logger.info(line)
+    if labels and report:
+        logger.info(f"标注样本中正确答案出现在前 {args.sweep_top_k} 个候选项内的条目: {report[0]['LabelledInTopK']}")
+    logger.info(f"扫描报告已保存到: {paths.output(SWEEP_REPORT_CSV)}")
+
+def plan_corpus_speakers(character_ids, character_mapping, matched_data):
+    """
+    推断按角色筛选时可能涉及的旧角色ID。
+
+    旧角色ID来自两个来源：角色ID映射文件中这些角色对应的旧角色，以及前两遍已经匹配成功的条目所用旧语音的角色。
+    两者都为空时返回 None，表示无法推断，应使用完整的旧脚本。
+    """
+    speakers = set()
+    for character_id in character_ids:
+        speakers.update(character_mapping.get(character_id, ()))
+    speakers.update(record.old_entry.voice_id[:3] for record in matched_data)
+    return speakers or None
+
+def precompute_features(text_table, new_entries):
+    """
+    特征预计算阶段：为每个新条目计算一次标准化文本和分类，保存在记录的字段中。
+
+    标准化文本同样收录进文本表，并按文本下标缓存，同一文本只计算一次。旧条目的标准化文本由
+    corpus_index.prepare_old_entries() 计算（或从预建索引读取），场景ID、场景顺序在记录创建时已解析。
+    """
+    normalized_ids = {}
+
+    def normalized_id(text_id):
+        result = normalized_ids.get(text_id)
+        if result is None:
+            result = normalized_ids[text_id] = text_table.intern(normalize_text(text_table[text_id]))
+        return result
+
+    for entry in new_entries:
+        entry.normalized_id = normalized_id(entry.text_id)
+        if entry.filename is not None:
+            entry.classification = classify_voice_file(f"{entry.filename}.wav")
+
+def build_matched_record(new_entry, old_entry, match_type):
+    """根据新旧条目构造一条匹配结果记录。"""
+    return MatchRecord(new_entry, old_entry, match_type)
+
+def build_arg_parser():
     parser = argparse.ArgumentParser(description='匹配新旧语音数据。')
     parser.add_argument(
         '--character-ids',
@@ -331,438 +794,1041 @@ def main():
     parser.add_argument(
         '-v', '--verbose',
         action='store_true',
-        help='输出详细的日志信息，包括跳过的条目。'
+        help='在控制台输出详细的日志信息，包括跳过的条目和逐条目的匹配过程（日志文件中总是包含）。'
     )
+    parser.add_argument('--log-level', nargs='+', type=parse_stage_level, default=[], metavar='STAGE=LEVEL', help=f'单独设置某个阶段的日志级别，如 blockwise=WARNING。阶段: {", ".join(STAGES)}')
+    parser.add_argument('--log-sample', type=int, default=1, metavar='N', help='逐条目的日志每 N 条只保留一条 (默认: 1，即全部保留)')
+    parser.add_argument('--ordinal-table', default=ORDINAL_TABLE_FILE, help=f'战斗语音和主动语音的序号表，由 ordinal_mapping.py learn 生成或手工编写 (默认: {ORDINAL_TABLE_FILE})')
+    parser.add_argument('--no-ordinal-mapping', action='store_true', help='战斗语音和主动语音不按序号表映射，与主线语音一样经过文本匹配和向量搜索')
     parser.add_argument('--no-similarity-search', action='store_true', help='禁用向量相似度搜索')
     parser.add_argument('--similarity-threshold', type=float, default=0.85, help='设置向量相似度搜索的阈值 (默认: 0.85)')
+    parser.add_argument('--verifier-chain', nargs='+', type=parse_verifier, default=[parse_verifier(spec) for spec in DEFAULT_VERIFIER_CHAIN], metavar='NAME[:ACCEPT[:REJECT]]', help=f'向量检索命中后的复核器链，按顺序执行，可选 edit、ngram、embedding。相似度不低于 ACCEPT 时通过，低于 REJECT 时拒绝，否则交给下一个复核器 (默认: {" ".join(DEFAULT_VERIFIER_CHAIN)})')
+    parser.add_argument('--vector-workers', type=int, default=1, help='向量搜索使用的进程数。大于 1 时按条目分片并行，旧脚本向量矩阵通过共享内存共享 (默认: 1)')
+    parser.add_argument('--no-locality-search', action='store_true', help='禁用基于相邻锚点的局部窗口搜索，所有剩余条目直接进入全局向量搜索')
+    parser.add_argument('--locality-radius', type=int, default=5, help='局部窗口搜索中，期望位置两侧的候选半径 (默认: 5)')
+    parser.add_argument('--locality-threshold', type=float, default=0.75, help='局部窗口搜索的字面相似度阈值 (默认: 0.75)')
+    parser.add_argument('--no-split-merge', action='store_true', help='禁用拆分/合并对齐，即不尝试把多条相邻语音与一句旧台词（或反过来）对应')
+    parser.add_argument('--split-merge-threshold', type=float, default=0.85, help='拆分/合并对齐的字面相似度阈值 (默认: 0.85)')
+    parser.add_argument('--no-normalization-ladder', action='store_true', help='禁用第二遍之后的多级标准化键匹配（NFKC、标点、注音括号、假名）')
+    parser.add_argument('--duration-rerank', action='store_true', help=f'读取新旧语音WAV的时长，在分数相近的候选项（上下文匹配的重复台词、局部窗口和向量搜索的候选项）中选择时长比例最一致的一个，并把时长明显不一致的匹配写入 {DURATION_FLAGS_CSV}')
+    parser.add_argument('--remake-voice-wav', default=REMAKE_VOICE_WAV_DIR, help=f'重制版语音WAV目录 (默认: {REMAKE_VOICE_WAV_DIR})')
+    parser.add_argument('--old-voice-wav', default=OLD_VOICE_WAV_DIR, help=f'转换后的 Evo 语音WAV目录 (默认: {OLD_VOICE_WAV_DIR})')
+    parser.add_argument('--duration-cache', default=DURATION_CACHE_FILE, help=f'WAV 时长缓存文件 (默认: {DURATION_CACHE_FILE})')
+    parser.add_argument('--duration-margin', type=float, default=0.02, help='与最高分相差不超过此值的候选项按时长重新选择 (默认: 0.02)')
+    parser.add_argument('--duration-top-k', type=int, default=5, help='向量搜索时参与时长重新排序的候选项数量 (默认: 5)')
+    parser.add_argument('--duration-flag-ratio', type=float, default=2.0, help=f'时长比例偏离基准超过此倍数的匹配写入 {DURATION_FLAGS_CSV} (默认: 2.0)')
+    parser.add_argument('--budget-seconds', type=float, default=None, help='本次匹配的时间预算（秒）。各级匹配按估计代价从低到高执行，预算用尽后不再开始新的搜索级，向量搜索在分块之间停止，剩余条目记为未匹配 (默认: 不限制)')
+    parser.add_argument('--budget-encodes', type=int, default=None, help='本次匹配送入模型编码的文本条数预算，用尽后的行为与 --budget-seconds 相同 (默认: 不限制)')
+    parser.add_argument('--full-corpus', action='store_true', help=f'使用 --character-ids 时仍对完整的旧脚本创建向量并搜索。默认只使用 {CHARACTER_MAPPING_FILE} 和前两遍匹配结果推断出的相关旧角色的台词')
+    parser.add_argument('--model-dir', default=MODEL_ARTIFACT_DIR, help=f'由 model_artifact.py pack 打包的本地模型目录，只从本地加载，不访问网络 (默认: {MODEL_ARTIFACT_DIR})')
+    parser.add_argument('--corpus-index', default=None, help=f'extract_voice_data.py 生成的旧语料预建索引目录，与旧数据文件一致时直接使用，否则从 JSON 建立索引 (默认: 旧语音数据所在目录下的 {CORPUS_INDEX_DIR})')
+    parser.add_argument('--no-corpus-index', action='store_true', help='不使用预建索引，总是从 JSON 建立旧数据的查找索引')
+    parser.add_argument('--embedding-cache', default=EMBEDDING_CACHE_FILE, help=f'旧脚本上下文向量的缓存文件 (默认: {EMBEDDING_CACHE_FILE})')
+    parser.add_argument('--no-embedding-cache', action='store_true', help='不读写向量缓存，每次重新编码')
+    parser.add_argument('--incremental', action='store_true', help=f'增量模式：与上一次运行的 {MATCH_FINGERPRINT_FILE} 和 {MERGED_OUTPUT_FILE} 对比，沿用输入未变的匹配决策，只重新匹配发生变化的条目及其邻近条目')
+    parser.add_argument('--incremental-radius', type=int, default=10, help='增量模式下与变化条目一起重新匹配的前后邻近条目数 (默认: 10)')
+    parser.add_argument('--resume', action='store_true', help='从上一次中断的运行恢复：输入文件和匹配选项未变时跳过检查点中已完成的阶段和向量搜索分块')
+    parser.add_argument('--checkpoint-dir', default=CHECKPOINT_DIR, help=f'阶段检查点目录，运行成功结束后删除 (默认: {CHECKPOINT_DIR})')
+    parser.add_argument('--checkpoint-chunk', type=int, default=1000, help='向量编码和向量搜索的分块大小，每块完成后写入检查点，中断时最多损失一块 (默认: 1000)')
+    parser.add_argument('--result-db', default=RESULT_DB_FILE, help=f'同时写入的 SQLite 结果数据库，可用 result_store.py 查询 (默认: {RESULT_DB_FILE})')
+    parser.add_argument('--no-result-db', action='store_true', help='不写入结果数据库')
+    parser.add_argument('--game', help='写入结果数据库时使用的游戏标识，同一游戏的旧结果会被替换 (默认: 当前目录名)')
+    parser.add_argument('--threshold-sweep', type=float, nargs='+', metavar='THRESHOLD', help='阈值扫描模式：对向量匹配候选只打分一次，评估给出的多个阈值并输出报告，不写入匹配结果文件')
+    parser.add_argument('--sweep-top-k', type=int, default=5, help='阈值扫描模式下每个条目保存的候选项数量 (默认: 5)')
+    parser.add_argument('--sweep-labels', help='阈值扫描模式下用于计算准确率和召回率的标注文件，格式与 match_result.csv 相同')
+    parser.add_argument('--sweep-cache', default=SWEEP_SCORES_FILE, help=f'阈值扫描的打分缓存文件，位于输出目录中。输入文件、匹配选项和模型与缓存一致时直接在缓存上评估，不再编码 (默认: {SWEEP_SCORES_FILE})')
     parser.add_argument('--no-map-failed-to-empty', dest='map_failed_to_empty', action='store_false', help='禁用“将匹配失败的语音指向空WAV文件”的功能（默认开启）。')
-    args = parser.parse_args()
+    parser.add_argument('--empty-wav-rate', type=int, default=TARGET_SAMPLE_RATE, help=f'EMPTY.wav 的采样率，应与 condition_voice.py --sample-rate 一致 (默认: {TARGET_SAMPLE_RATE})')
+    return parser
+
+
+@dataclass
+class MatchResult:
+    """VoiceMatcher.match() 的结果，由 VoiceMatcher.export() 写出。"""
+    args: argparse.Namespace
+    matched: list = field(default_factory=list)
+    unmatched: list = field(default_factory=list)
+    skipped: list = field(default_factory=list)
+    candidates: list = field(default_factory=list)
+    total: int = 0
+    processed: int = 0
+    carried: int = 0
+    rematched: int = 0
+    vector_search: int = 0
+    locality: int = 0
+    split_merge: int = 0
+    # --duration-rerank: 时长明显不一致的匹配结果
+    duration_flags: list = None
+    # 各级匹配的执行结果和代价
+    cascade: MatchCascade = None
+    # 供增量模式和检查点使用
+    options: str = None
+    fingerprints: dict = None
+    checkpoint: RunCheckpoint = None
+
+    def stats(self):
+        return {
+            'total': self.total,
+            'processed': self.processed,
+            'matched': len(self.matched),
+            'vector_search': self.vector_search,
+            'locality': self.locality,
+            'split_merge': self.split_merge,
+        }
 
-    # 如果启用了映射到空文件功能，则提前创建该文件
-    if args.map_failed_to_empty:
-        empty_wav_path = Path('voice/wav/EMPTY.wav')
-        create_empty_wav_file(empty_wav_path)
-        logger.info(f"已创建或更新统一的空WAV文件: {empty_wav_path}")
 
-    try:
-        with open(NEW_VOICE_FILE, 'r', encoding='utf-8') as f:
-            new_data = json.load(f)['data'][0]['data']
-        with open(OLD_VOICE_FILE, 'r', encoding='utf-8') as f:
-            old_data_list = json.load(f)
-        with open(OLD_SCRIPT_FILE, 'r', encoding='utf-8') as f:
-            old_script_list = json.load(f)
-    except FileNotFoundError as e:
-        logger.error(f"错误：找不到文件 {e.filename}")
-        return
-    except (json.JSONDecodeError, KeyError, IndexError) as e:
-        logger.error(f"错误：解析JSON文件或找不到键时出错: {e}")
-        return
-
-    # 为新语音数据添加上下文
-    logger.info("正在为新语音数据添加上下文...")
-    new_data_unsorted = new_data.copy()
-    # 根据 'id' 字段排序以确保对话顺序
-    new_data.sort(key=lambda x: x.get('id', ''))
-    for i, entry in enumerate(new_data):
-        # 添加上一句上下文
-        if i > 0:
-            entry['context_prev'] = new_data[i-1].get('text', '')
-        else:
-            entry['context_prev'] = ""
-            
-        # 添加下一句上下文
-        if i < len(new_data) - 1:
-            entry['context_next'] = new_data[i+1].get('text', '')
-        else:
-            entry['context_next'] = ""
-    logger.info("上下文添加完成。")
-
-    # 为旧语音数据添加上下文
-    logger.info("正在为旧语音数据添加上下文...")
-    # 从 voice_id 解析场景信息并排序
-    for entry in old_data_list:
-        voice_id = entry.get('voice_id', '')
-        if isinstance(voice_id, str) and len(voice_id) >= 10:
-            entry['scene_id'] = voice_id[3:6]
-            entry['scene_seq_id'] = int(voice_id[6:10])
-        else:
-            # 为不符合格式的ID设置默认值以便排序
-            entry['scene_id'] = ""
-            entry['scene_seq_id'] = -1
-
-    old_data_list.sort(key=lambda x: (x.get('scene_id', ''), x.get('scene_seq_id', '')))
-    for i, entry in enumerate(old_data_list):
-        # 检查是否在同一场景内
-        is_same_scene_prev = (i > 0 and 
-                              old_data_list[i-1].get('scene_id') == entry.get('scene_id'))
-        
-        is_same_scene_next = (i < len(old_data_list) - 1 and 
-                              old_data_list[i+1].get('scene_id') == entry.get('scene_id'))
+class VoiceMatcher:
+    """
+    匹配器的库接口，分为加载、建立索引、匹配、导出四个阶段。
+
+        matcher = VoiceMatcher()
+        matcher.load()                          # 或 matcher.load(t_voice=..., voice_data=..., script_data=...)
+        result = matcher.match()                # 可以用不同的选项多次调用
+        matcher.match(build_arg_parser().parse_args(['--character-ids', '001']))
+        matcher.export(result)                  # 写出与命令行相同的结果文件
+
+    load() 之后建立的查找索引、加载的模型和旧脚本向量在多次 match() 调用之间复用，重新 load() 时才会丢弃。
+    match() 不写任何文件（检查点和增量模式读取的上一次结果除外），结果文件由 export() 写出。
+
+    Args:
+        args (argparse.Namespace, optional): build_arg_parser() 解析出的选项，默认为命令行的默认选项。
+        paths (MatchPaths, optional): 输入文件和输出目录。
+        model (SentenceTransformer, optional): 已加载的模型，默认在第一次需要时加载。
+        embedding_cache (EmbeddingCache, optional): 共用的向量缓存，设置时忽略 --embedding-cache。
+    """
+
+    def __init__(self, args=None, paths=None, model=None, embedding_cache=None):
+        self.args = args if args is not None else build_arg_parser().parse_args([])
+        self.paths = paths or MatchPaths()
+        self.model = model
+        # 模型目录的标识，向量缓存和匹配选项的指纹按它区分模型
+        self.model_key = model_key(self.args.model_dir)
+        self.shared_embedding_cache = embedding_cache
+        self._embedding_caches = {}
+        self.loaded = False
+        self.indexed = False
+
+    # --- 加载 ---
+
+    def load(self, t_voice=None, voice_data=None, script_data=None):
+        """
+        读取新旧数据并添加上下文、预计算特征。
+
+        三个参数分别是 t_voice.json、voice_data.json、script_data.json 已解析的内容，未提供的从 paths 中的文件读取。
+        旧数据从文件读取且与 extract_voice_data.py 生成的预建索引（见 corpus_index.py）一致时，旧条目直接从索引读取。
+
+        Raises:
+            FileNotFoundError, json.JSONDecodeError, KeyError, IndexError: 输入文件无法读取或格式不符。
+        """
+        self._t_voice = t_voice
+        sources = ((t_voice, self.paths.new_voice_file), (voice_data, self.paths.old_voice_file), (script_data, self.paths.old_script_file))
+        self.input_digests = [
+            file_digest(path) if table is None else run_fingerprint(json.dumps(table, ensure_ascii=False, sort_keys=True))
+            for table, path in sources
+        ]
 
-        # 添加上一句上下文
-        if is_same_scene_prev:
-            entry['context_prev'] = old_data_list[i-1].get('text', '')
+        # 旧数据的 JSON 与预建索引一致时，旧条目和查找索引直接从索引中读取
+        self.corpus_index = None
+        if voice_data is None and script_data is None and not self.args.no_corpus_index:
+            index_dir = self.args.corpus_index or corpus_index_dir(self.paths.old_voice_file)
+            try:
+                self.corpus_index = open_corpus_index(index_dir, *self.input_digests[1:])
+            except CorpusIndexError as e:
+                logger.info(f"不使用预建的旧语料索引 {index_dir}: {e}。从 JSON 建立索引。")
+
+        def read(table, path):
+            if table is not None:
+                return table
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+
+        new_data_raw = read(t_voice, self.paths.new_voice_file)['data'][0]['data']
+
+        # 新旧数据共用一个文本表，上下文只保存文本下标
+        if self.corpus_index is not None:
+            logger.info(f"正在从预建索引 {self.corpus_index.directory} 读取旧数据...")
+            self.text_table, self.old_data_list, self.old_script_list = self.corpus_index.load_entries()
         else:
-            entry['context_prev'] = ""
-        
-        # 添加下一句上下文
-        if is_same_scene_next:
-            entry['context_next'] = old_data_list[i+1].get('text', '')
+            # 旧语音按从 voice_id 解析出的场景信息排序，上下文只在同一场景内添加
+            logger.info("正在为旧语音数据添加上下文...")
+            self.text_table = TextTable()
+            self.old_data_list, self.old_script_list = prepare_old_entries(
+                read(voice_data, self.paths.old_voice_file), read(script_data, self.paths.old_script_file), self.text_table)
+        logger.info("旧数据上下文添加完成。")
+        self.new_data = [RemakeVoiceEntry.from_dict(entry, self.text_table) for entry in new_data_raw]
+        del new_data_raw
+
+        # 为新语音数据添加上下文
+        logger.info("正在为新语音数据添加上下文...")
+        self.new_data_unsorted = self.new_data.copy()
+        # 根据 'id' 字段排序以确保对话顺序
+        self.new_data.sort(key=lambda x: x.id)
+        link_context(self.new_data)
+        logger.info("上下文添加完成。")
+
+        # 预计算标准化文本、分类等特征列，后续各阶段和输出直接读取
+        precompute_features(self.text_table, self.new_data)
+
+        self.loaded = True
+        self.indexed = False
+        # 旧脚本向量：(旧角色集合) -> (向量搜索范围, 向量)
+        self._corpus_embeddings = {}
+        # (新语音目录, 旧语音目录, 缓存文件) -> DurationIndex
+        self._duration_indexes = {}
+        return self
+
+    # --- 建立索引 ---
+
+    def build_index(self):
+        """为旧数据建立查找索引。已建立时直接返回。"""
+        if self.indexed:
+            return self
+        if not self.loaded:
+            self.load()
+
+        # 为旧数据、旧脚本数据创建快速查找映射，以及多级标准化键的哈希索引（每级一个）；有预建索引时直接使用
+        if self.corpus_index is not None:
+            self.old_data_map, self.old_data_normalized_map, self.old_script_map, self.old_ladder_maps = self.corpus_index.lookup_maps(self.old_data_list, self.old_script_list)
+            self.old_script_context_map = self.corpus_index.triplet_map(self.old_script_list)
+            self.old_scene_order_map = self.corpus_index.scene_order_map(self.old_data_list)
         else:
-            entry['context_next'] = ""
-    logger.info("旧数据上下文添加完成。")
-
-    if not args.no_similarity_search:
-        # 加载预训练的 sentence-transformer 模型
-        # 'paraphrase-multilingual-MiniLM-L12-v2' 是一个性能优秀的多语言模型
-        logger.info("正在加载文本向量化模型...")
-        model = SentenceTransformer('paraphrase-multilingual-MiniLM-L12-v2')
-        logger.info("模型加载完成。")
+            self.old_data_map, self.old_data_normalized_map, self.old_script_map, self.old_ladder_maps = build_lookup_maps(self.old_data_list, self.old_script_list)
+            # 分块匹配的三元组和场景顺序映射在 blockwise_match 中建立
+            self.old_script_context_map = None
+            self.old_scene_order_map = None
+
+        # 创建 voice_id 到 old_data_list 条目的映射
+        self.old_voice_id_to_entry_map = {e.voice_id: e for e in self.old_data_list}
+        # 旧语音在按场景排序后的位置，供局部窗口搜索使用
+        self.old_position_map = {e.voice_id: i for i, e in enumerate(self.old_data_list)}
+        # (voice_id, script_id) 到旧条目的映射，供增量模式和检查点恢复使用
+        self.old_entry_by_key = {}
+        for entry in self.old_data_list + self.old_script_list:
+            self.old_entry_by_key.setdefault((entry.voice_id, entry.script_id), entry)
+
+        self.indexed = True
+        return self
+
+    def encoder(self):
+        """返回文本向量化模型，第一次调用时加载。"""
+        if self.model is None:
+            # 加载预训练的 sentence-transformer 模型
+            logger.info(f"正在从 {self.args.model_dir} 加载文本向量化模型...")
+            self.model = load_model(self.args.model_dir)
+            logger.info("模型加载完成。")
+        return self.model
+
+    def _embedding_cache(self, args, checkpoint):
+        # 不使用向量缓存时，已编码的分块仍写入检查点目录，供 --resume 使用
+        if args.no_embedding_cache:
+            return EmbeddingCache(checkpoint.path('embeddings.npz'), self.model_key)
+        if self.shared_embedding_cache is not None:
+            return self.shared_embedding_cache
+        if args.embedding_cache not in self._embedding_caches:
+            self._embedding_caches[args.embedding_cache] = EmbeddingCache(args.embedding_cache, self.model_key)
+        return self._embedding_caches[args.embedding_cache]
+
+    def _vector_corpus(self, args, matched_data, checkpoint, load_encoder, cascade=None):
+        """
+        返回 (向量搜索范围, 向量, 向量缓存)。同一范围的向量只创建一次。
+
+        load_encoder 在需要编码时才调用，返回模型。给出 cascade 时先检查缓存未命中的条数，
+        编码会超出预算时不加载模型也不编码，返回 None。
+        """
+        # 按角色筛选时，只对可能涉及的旧角色的台词创建向量
+        speakers = None
+        if args.character_ids and not args.full_corpus:
+            speakers = plan_corpus_speakers(args.character_ids, load_character_mapping(self.paths.output(CHARACTER_MAPPING_FILE)), matched_data)
+        vector_corpus = self.old_script_list
+        if speakers:
+            vector_corpus = [entry for entry in self.old_script_list if entry.voice_id[:3] in speakers]
+            logger.info(f"子集模式: 旧角色 {sorted(speakers)}，向量搜索范围 {len(vector_corpus)}/{len(self.old_script_list)} 条旧脚本。")
+        elif args.character_ids and not args.full_corpus:
+            logger.info("子集模式: 无法推断相关的旧角色，使用完整的旧脚本。")
+
+        embedding_cache = self._embedding_cache(args, checkpoint)
+        key = frozenset(speakers) if speakers else None
+        if key in self._corpus_embeddings:
+            logger.info("沿用已创建的旧脚本上下文向量嵌入。")
+            return self._corpus_embeddings[key] + (embedding_cache,)
 
         # 为旧数据创建向量嵌入
+        old_contextual_texts = [contextual_text(entry) for entry in vector_corpus]
+        if cascade is not None and (reason := cascade.exceeds(embedding_cache.missing_count(old_contextual_texts))):
+            logger.warning(f"{reason}，不创建旧脚本上下文向量嵌入，跳过所有向量匹配。")
+            return None
         logger.info("正在为旧脚本数据创建上下文向量嵌入...")
-        old_contextual_texts = [
-            f"{entry.get('context_prev', '')} {entry.get('text', '')} {entry.get('context_next', '')}".strip()
-            for entry in old_script_list
-        ]
-        old_embeddings = model.encode(old_contextual_texts, convert_to_tensor=True)
-        logger.info("向量嵌入创建完成。")
-    else:
-        logger.info("跳过向量嵌入创建，因为 --no-similarity-search 被设置。")
+        old_embeddings, encoded_count = embedding_cache.encode(load_encoder(), old_contextual_texts, chunk_size=args.checkpoint_chunk)
+        logger.info(f"向量嵌入创建完成 (新编码 {encoded_count} 条，其余来自缓存)。")
+        self._corpus_embeddings[key] = (vector_corpus, old_embeddings)
+        return vector_corpus, old_embeddings, embedding_cache
+
+    def _ordinal_table(self, args):
+        """
+        读取序号表，返回 (重制版角色ID, 分类, 序号) -> 旧条目。文件不存在时返回空字典。
+
+        旧数据中没有的旧语音（如只存在于语音目录中的战斗语音）创建一个只有语音ID、没有文本的旧条目。
+        """
+        path = self.paths.output(args.ordinal_table)
+        try:
+            table = read_ordinal_table(path)
+        except FileNotFoundError:
+            logger.warning(f"找不到序号表 {path}，战斗语音和主动语音都将记为未匹配。可以运行 `uv run ordinal_mapping.py learn` 从已有的匹配结果中学习，或使用 --no-ordinal-mapping。")
+            return {}
+        entries = {}
+        for key, (voice_id, _) in table.items():
+            entry = self.old_voice_id_to_entry_map.get(voice_id)
+            if entry is None:
+                entry = self.old_entry_by_key.setdefault((voice_id, -1), OldVoiceEntry(self.text_table, voice_id[:3], voice_id, -1, 0, None))
+            entries[key] = entry
+        return entries
+
+    # --- 匹配 ---
+
+    def match(self, args=None):
+        """
+        按 args（默认为构造时的选项）执行所有匹配阶段，返回 MatchResult。
+
+        args.threshold_sweep 在这里被忽略，阈值扫描使用 threshold_sweep()。检查点目录在 export() 写出结果后删除。
+        """
+        return self._match(args if args is not None else self.args, sweep=False)
+
+    def threshold_sweep(self, args=None):
+        """
+        执行哈希查找各级和局部窗口的字面匹配后，为所有取决于相似度阈值的向量匹配候选打分。
+
+        打分结果缓存在输出目录的 --sweep-cache 中，输入文件、匹配选项和模型与缓存一致时直接读取缓存。
+
+        Returns:
+            tuple: (打分结果, 拆分/合并对齐函数)，后者见 threshold_sweep.decide_all，--no-split-merge 时为 None。
+        """
+        args = args if args is not None else self.args
+        if args.no_similarity_search:
+            raise ValueError("阈值扫描需要向量模型，不能与 --no-similarity-search 同时使用。")
+        return self._match(args, sweep=True)
+
+    def durations(self, args):
+        """读取新旧条目的语音时长（--duration-rerank）。相同的目录只读取一次。"""
+        key = (args.remake_voice_wav, args.old_voice_wav, self.paths.output(args.duration_cache))
+        if key not in self._duration_indexes:
+            index = build_duration_index(self.new_data, self.old_data_list + self.old_script_list, *key)
+            logger.info(f"读取语音时长: 新语音 {len(index.new_durations)} 条，旧语音 {len(index.old_durations)} 条。")
+            self._duration_indexes[key] = index
+        return self._duration_indexes[key]
+
+    def _match(self, args, sweep):
+        self.build_index()
+        old_data_list = self.old_data_list
+        old_script_list = self.old_script_list
+        old_script_map = self.old_script_map
+        old_position_map = self.old_position_map
+        old_entry_by_key = self.old_entry_by_key
+
+        result = MatchResult(args, total=len(self.new_data))
+        matched_data = result.matched
+        unmatched_data = result.unmatched
+        skipped_data = result.skipped
+        candidate_log = result.candidates
+        used_old_voice_ids = set() # 用于跟踪已匹配的旧语音ID
+
+        # 筛选出需要处理的条目
+        entries_to_process = []
+        for new_entry in self.new_data:
+            if not new_entry.text or new_entry.filename is None:
+                continue
+
+            classification = new_entry.classification
+            category = classification.get('category')
+            file_type = classification.get('type')
+
+            allowed_categories = {'main'}
+            if args.match_active: allowed_categories.add('active_voice')
+            if args.match_battle: allowed_categories.add('battle'); allowed_categories.add('battle_voice')
+            if args.match_other: allowed_categories.add('unknown')
+
+            should_process = False
+            if file_type == 'sound_effect' and args.match_sfx:
+                should_process = True
+            elif file_type == 'character_voice' and category in allowed_categories:
+                should_process = True
+
+            if args.character_ids and classification.get('character_id') not in args.character_ids:
+                should_process = False
+
+            if should_process:
+                entries_to_process.append(new_entry)
+            else:
+                reason = f"类别 '{category or file_type}' 未被命令行选项启用或角色ID不匹配"
+                skipped_data.append(UnmatchedRecord(new_entry, reason))
+                entry_logger('filter').debug("跳过 %s: %s", new_entry.filename, reason)
+
+        result.processed = len(entries_to_process)
+        logger.info(f"开始处理 {result.processed} 条符合条件的语音数据...")
+
+        # 战斗语音和主动语音按序号表映射，不参与文本匹配、局部窗口和向量搜索
+        ordinal_table = None
+        if not args.no_ordinal_mapping and (args.match_battle or args.match_active):
+            ordinal_table = self._ordinal_table(args)
+        ordinal_ids = {
+            entry.id for entry in entries_to_process
+            if ordinal_table is not None and entry.classification.get('category') in ORDINAL_CATEGORIES
+        }
+        text_entries = [entry for entry in entries_to_process if entry.id not in ordinal_ids]
+
+        # 记录每个条目的输入指纹，供下一次增量运行判断哪些决策可以沿用
+        result.options = options_fingerprint(args, self.model_key, (file_digest(self.paths.output(args.ordinal_table)) or '') if ordinal_table is not None else None)
+        result.fingerprints = entry_fingerprints(entries_to_process, [
+            (old_script_map, lambda e: e.text),
+            (self.old_data_map, lambda e: e.text),
+            (self.old_data_normalized_map, lambda e: e.normalized),
+            *(
+                (level_map, lambda e, level=level: ladder_keys(e.text)[level])
+                for level, level_map in enumerate(self.old_ladder_maps)
+            ),
+        ])
+
+        entries_to_match = entries_to_process
+        blockwise_entries = text_entries
+        if args.incremental:
+            previous, previous_decisions = load_previous_run(self.paths.output(MATCH_FINGERPRINT_FILE), self.paths.output(MERGED_OUTPUT_FILE))
+            if previous is None:
+                logger.warning(f"找不到或无法解析上一次的 {MATCH_FINGERPRINT_FILE} / {MERGED_OUTPUT_FILE}，执行完整匹配。")
+            elif previous.get('options') != result.options:
+                logger.warning("匹配选项、模型或指纹格式与上一次运行不同，执行完整匹配。")
+            else:
+                carried_matches, carried_unmatched, rematch_indices = plan_rematch(
+                    entries_to_process, result.fingerprints, previous, previous_decisions, old_entry_by_key, args.incremental_radius
+                )
+                matched_data.extend(carried_matches)
+                unmatched_data.extend(carried_unmatched)
+                used_old_voice_ids.update(record.old_entry.voice_id for record in carried_matches)
+                result.carried = len(carried_matches) + len(carried_unmatched)
+                entries_to_match = [entries_to_process[i] for i in rematch_indices]
+                # 分块匹配依赖相邻条目组成的三元组和空隙两侧的提示，额外带上两侧的条目作为上下文，其结果不采用
+                padded_indices = set()
+                for i in rematch_indices:
+                    padded_indices.update(range(max(0, i - args.incremental_radius), min(len(entries_to_process), i + args.incremental_radius + 1)))
+                blockwise_entries = [entries_to_process[i] for i in sorted(padded_indices) if entries_to_process[i].id not in ordinal_ids]
+                logger.info(f"增量模式: 沿用 {result.carried} 条决策（其中匹配 {len(carried_matches)} 条），重新匹配 {len(entries_to_match)} 条。")
+        result.rematched = len(entries_to_match)
+
+        # 阶段检查点：中断后以 --resume 重新运行时跳过已完成的阶段和分块
+        checkpoint_dir = self.paths.output(args.checkpoint_dir)
+        checkpoint = result.checkpoint = RunCheckpoint(checkpoint_dir, run_fingerprint(
+            result.options, args.full_corpus, args.checkpoint_chunk,
+            *self.input_digests, file_digest(self.paths.output(CHARACTER_MAPPING_FILE)),
+            [entry.id for entry in entries_to_match], [entry.id for entry in blockwise_entries],
+        ), args.resume)
+        if checkpoint.resumed:
+            logger.info(f"从检查点 {checkpoint_dir} 恢复运行。")
+        elif checkpoint.mismatched:
+            logger.warning("输入文件或匹配选项与检查点不一致，重新开始匹配。")
+        entry_by_id = {entry.id: entry for entry in entries_to_match}
+
+        # 时长基准比例由第一遍的结果估计，并随第一遍的结果一起写入检查点
+        duration_index = self.durations(args) if args.duration_rerank and not sweep else None
+        duration_scale = 1.0
+        duration_penalty = None
+
+        # 模型和旧脚本向量在第一个需要它们的级中加载；送入模型的文本条数计入编码预算
+        cascade = result.cascade = MatchCascade(args.budget_seconds, args.budget_encodes)
+        if args.no_similarity_search:
+            logger.info("跳过向量嵌入创建，因为 --no-similarity-search 被设置。")
         model = None
         old_embeddings = None
+        embedding_cache = None
+        embed = None
+        vector_corpus = old_script_list
+        # voice_id 到旧脚本向量行号的映射，供局部窗口搜索使用
+        old_script_index_map = {}
+
+        # 旧脚本向量的编码会超出预算时不再加载，各级按没有模型处理
+        vector_over_budget = False
+
+        def load_vector_model():
+            nonlocal model, old_embeddings, embedding_cache, embed, vector_corpus, vector_over_budget
+            if model is not None or vector_over_budget or args.no_similarity_search:
+                return
+            corpus = self._vector_corpus(args, matched_data, checkpoint, lambda: CountingEncoder(self.encoder(), cascade), cascade)
+            if corpus is None:
+                vector_over_budget = True
+                return
+            model = CountingEncoder(self.encoder(), cascade)
+            vector_corpus, old_embeddings, embedding_cache = corpus
+            # 复核时不含上下文的文本同样经过缓存编码
+            embed = lambda texts: embedding_cache.encode(model, texts)[0]
+            old_script_index_map.clear()
+            for i, entry in enumerate(vector_corpus):
+                old_script_index_map.setdefault(entry.voice_id, i)
+
+        def restore_matches(stage_data):
+            for row in stage_data['matches']:
+                record = build_matched_record(*load_match(row, entry_by_id, old_entry_by_key))
+                used_old_voice_ids.add(record.old_entry.voice_id)
+                matched_data.append(record)
+            return [entry_by_id[new_voice_id] for new_voice_id in stage_data['remaining']]
+
+        def save_matches(stage, stage_start, remaining, **extra):
+            checkpoint.save(stage, {
+                'matches': [dump_match(record.new_entry, record.old_entry, record.match_type) for record in matched_data[stage_start:]],
+                'remaining': [entry.id for entry in remaining],
+                **extra,
+            })
 
-    # 为旧数据创建快速查找映射（一个文本可能对应多个语音）
-    old_data_map = defaultdict(list)
-    old_data_normalized_map = defaultdict(list)
-    for entry in old_data_list:
-        if text := entry.get('text'):
-            # 精确匹配映射
-            old_data_map[text].append(entry)
-            
-            # 标准化文本映射
-            normalized_text = normalize_text(text)
-            if normalized_text:
-                old_data_normalized_map[normalized_text].append(entry)
-
-    # 为旧脚本数据创建快速查找映射
-    old_script_map = defaultdict(list)
-    for entry in old_script_list:
-        if text := entry.get('text'):
-            old_script_map[text].append(entry)
-
-    # 创建 voice_id 到 old_data_list 条目的映射
-    old_voice_id_to_entry_map = {e['voice_id']: e for e in old_data_list}
-
-    # 对候选项列表进行排序，确保优先匹配文件名靠前的语音
-    logger.info("正在对具有相同文本的候选项进行排序...")
-    for text in old_data_map:
-        old_data_map[text].sort(key=lambda e: e.get('voice_id', ''))
-    for text in old_data_normalized_map:
-        old_data_normalized_map[text].sort(key=lambda e: e.get('voice_id', ''))
-    for text in old_script_map:
-        old_script_map[text].sort(key=lambda e: e.get('script_id', 0))
-    logger.info("排序完成。")
-
-    matched_data = []
-    unmatched_data = []
-    skipped_data = []
-    used_old_voice_ids = set() # 用于跟踪已匹配的旧语音ID
-    
-    total_count = len(new_data)
-    processed_count = 0
-    vector_search_success_count = 0
-
-    # 筛选出需要处理的条目
-    entries_to_process = []
-    for new_entry in new_data:
-        if 'text' not in new_entry or not new_entry['text'] or 'filename' not in new_entry:
-            continue
-
-        classification = classify_voice_file(f"{new_entry['filename']}.wav")
-        category = classification.get('category')
-        file_type = classification.get('type')
-
-        allowed_categories = {'main'}
-        if args.match_active: allowed_categories.add('active_voice')
-        if args.match_battle: allowed_categories.add('battle'); allowed_categories.add('battle_voice')
-        if args.match_other: allowed_categories.add('unknown')
+        # --- 序号表映射: 战斗语音和主动语音按 (角色, 分类, 序号) 直接查找 ---
+        def run_ordinal(pending, stats):
+            remaining = []
+            ordinal_count = 0
+            for new_entry in pending:
+                if new_entry.id not in ordinal_ids:
+                    remaining.append(new_entry)
+                    continue
+                classification = new_entry.classification
+                old_entry = ordinal_table.get((classification.get('character_id'), classification.get('category'), classification.get('number')))
+                if old_entry is None:
+                    unmatched_data.append(UnmatchedRecord(new_entry))
+                    continue
+                if old_entry.voice_id in used_old_voice_ids:
+                    entry_logger('ordinal').debug("  - 序号表中的旧语音已被占用: New ID %s -> %s", new_entry.id, old_entry.voice_id)
+                    unmatched_data.append(UnmatchedRecord(new_entry))
+                    continue
+                ordinal_count += 1
+                entry_logger('ordinal').debug("  - 序号表映射成功: New ID %s -> %s", new_entry.id, old_entry.voice_id)
+                used_old_voice_ids.add(old_entry.voice_id)
+                matched_data.append(build_matched_record(new_entry, old_entry, 'ordinal'))
+            stage_logger('ordinal').info("序号表映射完成: %d 条战斗/主动语音中成功映射 %d 条。", len(pending) - len(remaining), ordinal_count)
+            return remaining
+
+        # --- Pass 1: Exact and Normalized Matching ---
+        def run_exact(pending, stats):
+            nonlocal duration_scale, duration_penalty
+            blockwise_log = stage_logger('blockwise')
+            exact_stage = checkpoint.load('exact')
+            if exact_stage is not None:
+                stats.status = 'restored'
+                remaining_entries_pass2 = restore_matches(exact_stage)
+                duration_scale = exact_stage.get('duration_scale', 1.0)
+                if duration_index is not None:
+                    duration_penalty = duration_index.penalty(duration_scale)
+                blockwise_log.info("从检查点恢复第一遍结果: 成功匹配 %d 条。", len(exact_stage['matches']))
+                return remaining_entries_pass2
+
+            stage_start = len(matched_data)
+            blockwise_log.info("\n--- 第一遍: 执行精确匹配和标准化匹配 ---")
+            remaining_entries_pass2 = []
+            pass1_success_count = 0
+            blockwise_match_result = blockwise_match(old_script_list, blockwise_entries, self.old_voice_id_to_entry_map, self.old_script_context_map, self.old_scene_order_map)
+            blockwise_entries_log = entry_logger('blockwise')
+            for new_entry in pending:
+                match_type = "exact"
+                best_match = blockwise_match_result.get(new_entry.id)
+
+                # 已被前面各级或增量模式沿用的匹配占用的旧语音不能再次使用，条目交给后续各级
+                if best_match and best_match.voice_id in used_old_voice_ids:
+                    blockwise_entries_log.debug("  - 分块匹配的旧语音已被占用: New ID %s -> %s", new_entry.id, best_match.voice_id)
+                    best_match = None
+
+                if best_match:
+                    pass1_success_count += 1
+                    used_old_voice_ids.add(best_match.voice_id)
+                    matched_data.append(build_matched_record(new_entry, best_match, match_type))
+                else:
+                    remaining_entries_pass2.append(new_entry)
+            blockwise_log.info("第一遍完成: 成功匹配 %d 条。", pass1_success_count)
+
+            if duration_index is not None:
+                duration_scale, samples = duration_index.estimate_scale((record.new_entry, record.old_entry) for record in matched_data)
+                duration_penalty = duration_index.penalty(duration_scale)
+                logger.info(f"时长基准比例 (新/旧): {duration_scale:.3f}（{samples} 个样本）")
+
+            remaining_entries_pass2.sort(key=lambda x: x.id)
+            save_matches('exact', stage_start, remaining_entries_pass2, duration_scale=duration_scale)
+            return remaining_entries_pass2
+
+        # --- Pass 2: Contextual Matching for Ambiguous Entries ---
+        def run_context(pending, stats):
+            context_stage = checkpoint.load('context')
+            if context_stage is not None:
+                stats.status = 'restored'
+                stage_logger('context').info("从检查点恢复第二遍结果: 成功匹配 %d 条。", len(context_stage['matches']))
+                return restore_matches(context_stage)
+
+            stage_start = len(matched_data)
+            context_log = entry_logger('context')
+            stage_logger('context').info("\n--- 第二遍: 对剩余条目中存在歧义的部分执行上下文精确匹配 ---")
+            pass2_success_count = 0
+            remaining_entries_pass3 = []  # Entries that will go to vector search
+            for new_entry in reversed(pending):
+                new_text = new_entry.text
+
+                # Find potential candidates from script data for contextual matching
+                candidates = old_script_map.get(new_text, [])
+
+                # Only perform context match if there's ambiguity (multiple candidates)
+                if new_text and len(candidates) > 1:
+                    found_context_match = False
+                    # 已被前面各级或本级先前条目使用的旧语音不再参与匹配
+                    candidates = [candidate for candidate in candidates if candidate.voice_id not in used_old_voice_ids]
+                    if duration_penalty is not None:
+                        # 上下文相同的候选项有多个时按时长选择
+                        context_candidates = [
+                            (candidate, 1.0) for candidate in candidates
+                            if new_entry.prev_id == candidate.prev_id and new_entry.next_id == candidate.next_id
+                        ]
+                        if len(context_candidates) > 1:
+                            candidates = [pick_by_duration(new_entry, context_candidates, 0.0, duration_penalty)[0]]
+                    for candidate in candidates:
+
+                        # Triplet check: current text (already matches), previous, and next context
+                        if new_entry.prev_id == candidate.prev_id and new_entry.next_id == candidate.next_id:
+
+                            pass2_success_count += 1
+                            context_log.debug(
+                                "  - 上下文匹配成功: New ID %s\n    - New Context: ['%s', '%s', '%s']\n    - Old Context: ['%s', '%s', '%s']",
+                                new_entry.id, new_entry.context_prev, new_entry.text, new_entry.context_next,
+                                candidate.context_prev, candidate.text, candidate.context_next
+                            )
+
+                            used_old_voice_ids.add(candidate.voice_id)
+                            matched_data.append(build_matched_record(new_entry, candidate, 'context'))
+                            found_context_match = True
+                            break # Found a match, no need to check other candidates
+
+                    if not found_context_match:
+                        remaining_entries_pass3.append(new_entry)
+                else:
+                    # If no ambiguity, pass to the next stage
+                    remaining_entries_pass3.append(new_entry)
+            stage_logger('context').info("第二遍完成: 成功匹配 %d 条。", pass2_success_count)
+            save_matches('context', stage_start, remaining_entries_pass3)
+            return remaining_entries_pass3
+
+        # --- 标准化键匹配: 按多级标准化键在哈希索引中查找 ---
+        def run_ladder(pending, stats):
+            ladder_log = stage_logger('ladder')
+            ladder_stage = checkpoint.load('ladder')
+            if ladder_stage is not None:
+                stats.status = 'restored'
+                ladder_log.info("从检查点恢复标准化键匹配结果: 成功匹配 %d 条。", len(ladder_stage['matches']))
+                return restore_matches(ladder_stage)
+
+            stage_start = len(matched_data)
+            ladder_log.info("\n--- 标准化键匹配: 依次按 %s 级标准化键查找剩余条目 ---", " / ".join(NORMALIZATION_LEVELS))
+            pending.sort(key=lambda x: x.id)
+            ladder_matches, remaining = ladder_match(pending, self.old_ladder_maps, used_old_voice_ids)
+            level_counts = defaultdict(int)
+            for new_entry, best_match, match_type in ladder_matches:
+                entry_logger('ladder').debug("  - 标准化键匹配成功: New ID %s -> %s %s", new_entry.id, best_match.voice_id, match_type)
+                level_counts[match_type] += 1
+                matched_data.append(build_matched_record(new_entry, best_match, match_type))
+            ladder_log.info("标准化键匹配完成: 成功匹配 %d 条（%s）。", len(ladder_matches), "，".join(f"{match_type} {count}" for match_type, count in level_counts.items()) or "无")
+            save_matches('ladder', stage_start, remaining)
+            return remaining
+
+        # --- Locality Pass: 在相邻锚点附近的窗口内搜索 ---
+        def run_locality(pending, stats):
+            # 只有前面各级之后仍有剩余条目时才加载模型并创建旧脚本向量
+            if pending:
+                load_vector_model()
+            locality_log = stage_logger('locality')
+            locality_log.info("\n--- 局部窗口搜索: 根据相邻锚点在旧语音顺序的有限窗口内匹配 ---")
+            pending.sort(key=lambda x: x.id)
+            anchor_map = {record.new_entry.id: record.old_entry.voice_id for record in matched_data}
+            windows = locality_windows(text_entries, anchor_map, old_position_map, args.locality_radius)
+            locality_stage = checkpoint.load('locality')
+            if locality_stage is not None:
+                stats.status = 'restored'
+                locality_matches = [load_match(row, entry_by_id, old_entry_by_key) for row in locality_stage['matches']]
+                used_old_voice_ids.update(best_match.voice_id for _, best_match, _ in locality_matches)
+                anchorless_entries = [entry_by_id[new_voice_id] for new_voice_id in locality_stage['anchorless']]
+                candidate_log.extend(load_candidate(row, old_entry_by_key) for row in locality_stage['candidates'])
+                locality_log.info("从检查点恢复局部窗口搜索结果。")
+            else:
+                candidate_start = len(candidate_log)
+                locality_matches, anchorless_entries = locality_match(
+                    pending, windows, old_data_list, used_old_voice_ids, args,
+                    model=model, old_embeddings=old_embeddings, old_script_index_map=old_script_index_map, embed=embed,
+                    candidate_log=candidate_log, duration_penalty=duration_penalty
+                )
+                checkpoint.save('locality', {
+                    'matches': [dump_match(*match) for match in locality_matches],
+                    'anchorless': [entry.id for entry in anchorless_entries],
+                    'candidates': [dump_candidate(candidate) for candidate in candidate_log[candidate_start:]],
+                })
+            for new_entry, best_match, match_type in locality_matches:
+                result.locality += 1
+                entry_logger('locality').debug("  - 局部窗口匹配成功: New ID %s %s", new_entry.id, match_type)
+                matched_data.append(build_matched_record(new_entry, best_match, match_type))
+
+            # 有锚点但窗口内没有合适候选项的条目不再进行全局搜索
+            locality_matched_ids = {new_entry.id for new_entry, _, _ in locality_matches}
+            anchorless_ids = {entry.id for entry in anchorless_entries}
+            for new_entry in pending:
+                if new_entry.id not in locality_matched_ids and new_entry.id not in anchorless_ids:
+                    unmatched_data.append(UnmatchedRecord(new_entry))
+            locality_log.info("局部窗口搜索完成: 成功匹配 %d 条，%d 条没有锚点，回退到全局搜索。", result.locality, len(anchorless_entries))
+            return anchorless_entries
+
+        # --- Split/Merge Pass: 拆分或合并过的台词的多对一对齐 ---
+        def run_split_merge(pending, stats):
+            # 局部窗口搜索判定为未匹配的条目也参与对齐
+            stats.entries += len(unmatched_data)
+            if not unmatched_data and not pending:
+                return pending
+            split_merge_log = stage_logger('split_merge')
+            split_merge_log.info("\n--- 拆分/合并对齐: 在锚点附近的窗口内匹配被拆分或合并的台词 ---")
+            anchor_map = {record.new_entry.id: record.old_entry.voice_id for record in matched_data}
+            windows = locality_windows(text_entries, anchor_map, old_position_map, args.locality_radius)
+            matched_records = {record.new_entry.id: record for record in matched_data}
+            # 对齐占用的旧语音直接记入 used_old_voice_ids，后续各级不再使用
+            used_old_voice_ids.update(anchor_map.values())
+            split_merge_matches = split_merge_match(
+                text_entries, {record.new_entry.id for record in unmatched_data} | {entry.id for entry in pending},
+                {new_voice_id: record.old_entry for new_voice_id, record in matched_records.items()},
+                windows, old_data_list, used_old_voice_ids, args.split_merge_threshold
+            )
+            for new_entry, best_match, match_type in split_merge_matches:
+                entry_logger('split_merge').debug("  - 拆分/合并对齐成功: New ID %s -> %s %s", new_entry.id, best_match.voice_id, match_type)
+                if new_entry.id in matched_records:
+                    # 已匹配的另一部分只更新 match_type
+                    matched_records[new_entry.id].match_type = match_type
+                    continue
+                result.split_merge += 1
+                matched_data.append(build_matched_record(new_entry, best_match, match_type))
+            split_merge_ids = {new_entry.id for new_entry, _, _ in split_merge_matches}
+            unmatched_data[:] = [record for record in unmatched_data if record.new_entry.id not in split_merge_ids]
+            split_merge_log.info("拆分/合并对齐完成: 成功匹配 %d 条。", result.split_merge)
+            return [entry for entry in pending if entry.id not in split_merge_ids]
+
+        # --- Pass 3: Vector Similarity Matching ---
+        def run_vector(pending, stats):
+            vector_log = stage_logger('vector')
+            vector_entries_log = entry_logger('vector')
+            vector_log.info("\n--- 第三遍: 对剩余条目执行向量相似度匹配 ---")
+            if pending:
+                load_vector_model()
+            pass3_success_count = 0
+            vector_entries = pending
+            if model is None:
+                if vector_over_budget:
+                    stats.status = 'budget'
+                vector_results = [(None, None)] * len(pending)
+            else:
+                # 按块检索，每块的结果写入检查点；每块开始前检查预算
+                vector_results = []
+                restored_chunks = 0
+                # 分片检索的进程池和共享内存在本级内只创建一次（第一次检索时启动），所有分块共用
+                scorer = ShardedScorer(old_embeddings, None, args.model_dir, args.vector_workers) if args.vector_workers > 1 else None
+                with scorer or nullcontext():
+                    for chunk_index, chunk_start in enumerate(range(0, len(pending), args.checkpoint_chunk)):
+                        chunk_entries = pending[chunk_start:chunk_start + args.checkpoint_chunk]
+                        stage = f'vector.{chunk_index:05d}'
+                        chunk_stage = checkpoint.load(stage)
+                        if chunk_stage is not None:
+                            restored_chunks += 1
+                            chunk_results = [
+                                (None, None) if row is None else (old_entry_by_key[(row[0], row[1])], row[2])
+                                for row in chunk_stage['results']
+                            ]
+                            candidate_log.extend(load_candidate(row, old_entry_by_key) for row in chunk_stage['candidates'])
+                            used_old_voice_ids.update(best_match.voice_id for best_match, _ in chunk_results if best_match)
+                        elif reason := cascade.exhausted():
+                            vector_log.warning("%s，剩余 %d 条不再执行向量搜索。", reason, len(pending) - chunk_start)
+                            stats.status = 'partial'
+                            vector_entries = pending[:chunk_start]
+                            break
+                        else:
+                            if args.vector_workers > 1 and len(chunk_entries) > 1:
+                                # 分片时查询在子进程中编码，不经过 CountingEncoder
+                                cascade.charge(len(chunk_entries))
+                            candidate_start = len(candidate_log)
+                            chunk_results = vector_match(chunk_entries, vector_corpus, model, old_embeddings, args, embed=embed, candidate_log=candidate_log, duration_penalty=duration_penalty, scorer=scorer, used_old_voice_ids=used_old_voice_ids)
+                            used_old_voice_ids.update(best_match.voice_id for best_match, _ in chunk_results if best_match)
+                            checkpoint.save(stage, {
+                                'results': [None if best_match is None else [best_match.voice_id, best_match.script_id, match_type] for best_match, match_type in chunk_results],
+                                'candidates': [dump_candidate(candidate) for candidate in candidate_log[candidate_start:]],
+                            })
+                        vector_results.extend(chunk_results)
+                if restored_chunks:
+                    vector_log.info("从检查点恢复 %d 个向量搜索分块。", restored_chunks)
+                    if restored_chunks * args.checkpoint_chunk >= len(pending):
+                        stats.status = 'restored'
+            for new_entry, (best_match, match_type) in zip(vector_entries, vector_results):
+
+                if best_match:
+                    pass3_success_count += 1
+                    if vector_entries_log.isEnabledFor(logging.DEBUG):
+                        vector_entries_log.debug(
+                            "  - 向量相似度匹配成功: New ID %s %s\n    - New Context: [%s]\n    - Old Context: [%s]",
+                            new_entry.id, match_type[13:], contextual_text(new_entry), contextual_text(best_match)
+                        )
+
+                    result.vector_search += 1
+                    matched_data.append(build_matched_record(new_entry, best_match, match_type))
+                else:
+                    unmatched_data.append(UnmatchedRecord(new_entry))
+            vector_log.info("第三遍完成: 成功匹配 %d 条。", pass3_success_count)
+            if embedding_cache is not None:
+                embedding_cache.save()
+            return pending[len(vector_entries):]
+
+        # 阈值扫描只执行哈希查找的各级，之后为剩余条目打分
+        runners = {'exact': run_exact, 'context': run_context}
+        if ordinal_table is not None:
+            runners['ordinal'] = run_ordinal
+        if not args.no_normalization_ladder:
+            runners['ladder'] = run_ladder
+        if not sweep:
+            if not args.no_locality_search:
+                runners['locality'] = run_locality
+            if not args.no_split_merge:
+                runners['split_merge'] = run_split_merge
+            # 禁用向量搜索时这一级仍然执行，把剩余条目记为未匹配
+            runners['vector'] = run_vector
+
+        pending = entries_to_match
+        for tier in cascade.tiers:
+            runner = runners.get(tier.name)
+            if runner is None:
+                cascade.skip(tier, 'disabled')
+                continue
+            if tier.budgeted and (reason := cascade.exhausted(tier)):
+                logger.warning(f"{reason}，跳过 {tier.description}（{len(pending)} 条未解决）。")
+                cascade.skip(tier, 'budget')
+                continue
+            with cascade.run(tier, pending, matched_data) as stats:
+                pending = runner(pending, stats)
+                stats.remaining = len(pending)
+
+        if sweep:
+            sweep_entries = sweep_candidates(pending, text_entries, matched_data, old_data_list, old_position_map, used_old_voice_ids, args)
+            cache_path = self.paths.output(args.sweep_cache)
+            sweep_fingerprint = run_fingerprint(
+                SWEEP_VERSION, result.options, args.full_corpus, args.sweep_top_k,
+                *self.input_digests, file_digest(self.paths.output(CHARACTER_MAPPING_FILE)),
+                [(entry.id, scope) for entry, scope, _ in sweep_entries],
+            )
+            sweep_scores = load_sweep_scores(cache_path, sweep_fingerprint)
+            if sweep_scores is not None:
+                logger.info(f"输入文件、匹配选项和模型与打分缓存 {cache_path} 一致，直接使用缓存的打分结果。")
+            else:
+                if sweep_entries:
+                    load_vector_model()
+                sweep_scores = score_sweep_candidates(sweep_entries, vector_corpus, old_script_index_map, model, old_embeddings, args)
+                save_sweep_scores(cache_path, sweep_scores, args.sweep_top_k, args.similarity_threshold, sweep_fingerprint)
+                logger.info(f"打分结果已保存到: {cache_path}")
+            split_merge = None
+            if not args.no_split_merge:
+                split_merge = sweep_split_merge(
+                    text_entries, matched_data, {entry.id for entry, _, _ in sweep_entries},
+                    old_data_list, old_position_map, used_old_voice_ids, args
+                )
+            return sweep_scores, split_merge
+
+        # 预算用尽时未被处理的条目记为未匹配
+        unmatched_data.extend(UnmatchedRecord(new_entry) for new_entry in pending)
+
+        if duration_index is not None:
+            result.duration_flags = flag_duration_outliers(matched_data, duration_index, duration_scale, args.duration_flag_ratio)
+
+        # 按 new_voice_id 排序
+        matched_data.sort(key=lambda x: x.new_entry.id)
+        return result
+
+    # --- 导出 ---
+
+    def export(self, result, paths=None):
+        """
+        写出匹配结果文件、结果数据库和更新后的 t_voice.json，删除检查点目录并输出统计。
+
+        Args:
+            result (MatchResult): match() 的结果。
+            paths (MatchPaths, optional): 输出目录，默认为构造时的 paths。
+
+        Returns:
+            dict: 匹配统计。
+        """
+        paths = paths or self.paths
+        args = result.args
+        matched_data = result.matched
+        unmatched_data = result.unmatched
+        skipped_data = result.skipped
+
+        # 写入输出文件
+        with open(paths.output(MERGED_OUTPUT_FILE), 'w', encoding='utf-8') as f:
+            json.dump([record.to_dict() for record in matched_data], f, ensure_ascii=False, indent=4)
+
+        with open(paths.output(UNMATCHED_OUTPUT_FILE), 'w', encoding='utf-8') as f:
+            json.dump([record.to_dict() for record in unmatched_data], f, ensure_ascii=False, indent=4)
+
+        with open(paths.output(SKIPPED_OUTPUT_FILE), 'w', encoding='utf-8') as f:
+            json.dump([record.to_dict() for record in skipped_data], f, ensure_ascii=False, indent=4)
+
+        records_by_new_voice_id = {record.new_entry.id: record for record in skipped_data}
+        records_by_new_voice_id.update((record.new_entry.id, record) for record in unmatched_data)
+        records_by_new_voice_id.update((record.new_entry.id, record) for record in matched_data)
+        with open(paths.output(MATCH_RESULT_CSV), 'w', encoding='utf-8', newline='\n') as f:
+            writer = csv.writer(f)
+            writer.writerow(['RemakeVoiceID', 'RemakeVoiceFilename', 'OldScriptId', 'OldVoiceFilename', 'MatchType', 'RemakeVoiceType', 'RemakeVoiceCharacterId', 'RemakeVoiceCategory', 'RemakeVoiceOrderPerCharacter', 'RemakeVoiceText', 'OldVoiceText'])
+            writer.writerows(
+                records_by_new_voice_id[new_voice_entry.id].csv_row()
+                for new_voice_entry in self.new_data_unsorted
+                if new_voice_entry.id in records_by_new_voice_id
+            )
+
+        save_fingerprints(paths.output(MATCH_FINGERPRINT_FILE), result.options, result.fingerprints, matched_data)
+
+        if result.duration_flags is not None:
+            write_duration_flags(paths.output(DURATION_FLAGS_CSV), result.duration_flags)
+
+        if result.cascade is not None:
+            write_cascade_report(paths.output(CASCADE_REPORT_CSV), result.cascade.stats)
+
+        if not args.no_result_db:
+            game = args.game or os.path.basename(os.getcwd())
+            write_results(paths.output(args.result_db), game, matched_data, unmatched_data, skipped_data, result.candidates)
+
+        # 输出已全部写入，不再需要检查点
+        if result.checkpoint is not None:
+            result.checkpoint.finish()
+
+        # --- 更新 t_voice.json ---
+        logger.info("\n正在将匹配结果应用到新的 t_voice.json...")
+
+        # 1. 创建已匹配和未匹配的ID查找集
+        id_to_old_filename_map = {record.new_entry.id: "ch" + record.old_entry.voice_id[:-1] for record in matched_data}
+        unmatched_ids = {record.new_entry.id for record in unmatched_data}
+
+        # 2. 重新加载原始 t_voice.json 数据（数据由 load() 传入时复制一份，不修改调用方的数据）
+        try:
+            if self._t_voice is not None:
+                t_voice_content = copy.deepcopy(self._t_voice)
+            else:
+                with open(self.paths.new_voice_file, 'r', encoding='utf-8') as f:
+                    t_voice_content = json.load(f)
+
+            # 假设数据结构总是 'data' -> list -> 'data' -> list of entries
+            voice_entries = t_voice_content['data'][0]['data']
+
+            # 3. 遍历并更新 t_voice.json 数据
+            updated_count = 0
+            unmatched_mapped_count = 0
+            for entry in voice_entries:
+                voice_id = entry.get('id')
+                if voice_id in id_to_old_filename_map:
+                    entry['filename'] = id_to_old_filename_map[voice_id]
+                    updated_count += 1
+                elif args.map_failed_to_empty and voice_id in unmatched_ids:
+                    entry['filename'] = 'EMPTY'
+                    unmatched_mapped_count += 1
+
+            logger.info(f"\n成功更新 {updated_count} 个已匹配的语音条目。")
+            if args.map_failed_to_empty:
+                logger.info(f"已将 {unmatched_mapped_count} 个未匹配的语音条目指向 EMPTY.wav。")
+
+            # 4. 确保 output 目录存在
+            output_dir = paths.output('output')
+            if not os.path.exists(output_dir):
+                os.makedirs(output_dir)
+
+            # 5. 写入新的 t_voice.json 文件
+            output_t_voice_path = os.path.join(output_dir, 't_voice.json')
+            with open(output_t_voice_path, 'w', encoding='utf-8') as f:
+                json.dump(t_voice_content, f, ensure_ascii=False, indent=4)
+
+            logger.info(f"成功更新 {updated_count} 个条目。")
+            logger.info(f"新的 t_voice.json 已保存到: {output_t_voice_path}")
+
+        except Exception as e:
+            logger.error(f"错误：更新 t_voice.json 失败: {e}")
+
+        # --- 打印统计结果 ---
+        stats = result.stats()
+        logger.info("\n--- 匹配完成 ---")
+        logger.info(f"总计 (输入文件): {stats['total']}")
+        logger.info(f"处理 (符合条件): {stats['processed']}")
+        logger.info(f"成功: {stats['matched']} (其中向量搜索: {stats['vector_search']}，局部窗口: {stats['locality']}，拆分/合并: {stats['split_merge']})")
+        logger.info(f"失败: {stats['processed'] - stats['matched']}")
+        if args.incremental:
+            logger.info(f"增量模式沿用: {result.carried}，重新匹配: {result.rematched}")
+        if result.cascade is not None:
+            logger.info("各级匹配 (按估计代价排序):")
+            for tier_stats in result.cascade.stats:
+                if tier_stats.status in ('disabled', 'budget'):
+                    logger.info(f"  {tier_stats.tier.name:<12} {'已禁用' if tier_stats.status == 'disabled' else '预算用尽，跳过'}")
+                    continue
+                logger.info(
+                    f"  {tier_stats.tier.name:<12} 处理 {tier_stats.entries}，匹配 {tier_stats.matched}，未匹配 {tier_stats.unmatched}，"
+                    f"剩余 {tier_stats.remaining}，耗时 {tier_stats.seconds:.2f} 秒，编码 {tier_stats.encodes}"
+                    + {'restored': '（从检查点恢复）', 'partial': '（预算用尽，中途停止）'}.get(tier_stats.status, '')
+                )
+            logger.info(f"各级匹配的代价已保存到: {paths.output(CASCADE_REPORT_CSV)}")
+        logger.info(f"成功匹配的数据已保存到: {paths.output(MERGED_OUTPUT_FILE)}")
+        logger.info(f"未匹配的数据已保存到: {paths.output(UNMATCHED_OUTPUT_FILE)}")
+        logger.info(f"跳过匹配的数据已保存到: {paths.output(SKIPPED_OUTPUT_FILE)}")
+        logger.info(f"匹配结果已保存到: {paths.output(MATCH_RESULT_CSV)}")
+        if result.duration_flags is not None:
+            logger.info(f"时长明显不一致的 {len(result.duration_flags)} 条匹配已保存到: {paths.output(DURATION_FLAGS_CSV)}")
+        if not args.no_result_db:
+            logger.info(f"结果数据库已更新: {paths.output(args.result_db)} (游戏: {game})")
+        return stats
+
+
+def run_matching(args, paths=None, shared_model=None, shared_embedding_cache=None):
+    """
+    执行一次完整的匹配并写出结果文件。
 
-        should_process = False
-        if file_type == 'sound_effect' and args.match_sfx:
-            should_process = True
-        elif file_type == 'character_voice' and category in allowed_categories:
-            should_process = True
+    Args:
+        args (argparse.Namespace): build_arg_parser() 解析出的选项。
+        paths (MatchPaths, optional): 输入文件和输出目录，默认为当前目录下的默认文件。
+        shared_model (SentenceTransformer, optional): 已加载的模型，批量模式下多个任务共用；默认在需要时才加载。
+        shared_embedding_cache (EmbeddingCache, optional): 多个任务共用的向量缓存，设置时忽略 --embedding-cache。
 
-        if args.character_ids and classification.get('character_id') not in args.character_ids:
-            should_process = False
+    Returns:
+        dict: 匹配统计；阈值扫描时为空字典；输入文件无法读取时为 None。
+    """
+    # 需要向量搜索时先检查模型目录，缺失时在加载数据之前报错
+    if shared_model is None and not args.no_similarity_search:
+        try:
+            check_artifact(args.model_dir)
+        except ModelArtifactError as e:
+            logger.error(f"错误：{e}")
+            return None
+
+    matcher = VoiceMatcher(args, paths, model=shared_model, embedding_cache=shared_embedding_cache)
+    try:
+        matcher.load()
+    except FileNotFoundError as e:
+        logger.error(f"错误：找不到文件 {e.filename}")
+        return None
+    except (json.JSONDecodeError, KeyError, IndexError) as e:
+        logger.error(f"错误：解析JSON文件或找不到键时出错: {e}")
+        return None
 
-        if should_process:
-            entries_to_process.append(new_entry)
-        else:
-            reason = f"类别 '{category or file_type}' 未被命令行选项启用或角色ID不匹配"
-            skipped_data.append({
-                'new_voice_id': new_entry['id'],
-                'new_filename': new_entry['filename'],
-                'classification': classification,
-                'text': new_entry['text'],
-                'reason': reason,
-            })
-            logger.info(f"跳过 {new_entry['filename']}: {reason}")
-
-    processed_count = len(entries_to_process)
-    logger.info(f"开始处理 {processed_count} 条符合条件的语音数据...")
-
-    # --- Pass 1: Exact and Normalized Matching ---
-    logger.info("\n--- 第一遍: 执行精确匹配和标准化匹配 ---")
-    remaining_entries_pass2 = []
-    pass1_success_count = 0
-    blockwise_match_result = blockwise_match(old_script_list, entries_to_process, old_voice_id_to_entry_map)
-    for new_entry in entries_to_process:
-        match_type = "exact"
-        best_match = blockwise_match_result.get(new_entry.get('id'))
-
-        if best_match:
-            pass1_success_count += 1
-            used_old_voice_ids.add(best_match['voice_id'])
-            classification = classify_voice_file(f"{new_entry.get('filename')}.wav")
-            matched_data.append({
-                'new_voice_id': new_entry.get('id'),
-                'new_filename': new_entry.get('filename'),
-                'new_text': new_entry['text'],
-                'old_voice_id': best_match.get('voice_id'),
-                'old_script_id': best_match.get('script_id'),
-                'old_scene_id': best_match.get('scene_id'),
-                'old_scene_seq_id': best_match.get('scene_seq_id'),
-                'old_text': best_match.get('text'),
-                'character_id': best_match.get('character_id'),
-                'source_file': best_match.get('source_file'),
-                'match_type': match_type,
-                'classification': classification
-            })
-        else:
-            remaining_entries_pass2.append(new_entry)
-    logger.info(f"第一遍完成: 成功匹配 {pass1_success_count} 条。")
-
-    reverted_count = 0
-    remaining_entries_pass2.sort(key=lambda x: x['id'])
-
-    # --- Pass 2: Contextual Matching for Ambiguous Entries ---
-    logger.info("\n--- 第二遍: 对剩余条目中存在歧义的部分执行上下文精确匹配 ---")
-    pass2_success_count = 0
-    remaining_entries_pass3 = []  # Entries that will go to vector search
-    for new_entry in reversed(remaining_entries_pass2):
-        new_text = new_entry.get('text', '')
-        
-        # Find potential candidates from script data for contextual matching
-        candidates = old_script_map.get(new_text, [])
-        
-        # Only perform context match if there's ambiguity (multiple candidates)
-        if new_text and len(candidates) > 1:
-            found_context_match = False
-            for candidate in candidates:
+    if args.threshold_sweep:
+        try:
+            sweep_scores, split_merge = matcher.threshold_sweep()
+        except ValueError as e:
+            logger.error(f"错误：{e}")
+            return None
+        report_threshold_sweep(sweep_scores, args, matcher.paths, split_merge)
+        return {}
 
-                # Triplet check: current text (already matches), previous, and next context
-                if new_entry.get('context_prev', '') == candidate.get('context_prev', '') and \
-                   new_entry.get('context_next', '') == candidate.get('context_next', ''):
-                    
-                    pass2_success_count += 1
-                    logger.debug(f"  - 上下文匹配成功: New ID {new_entry['id']}")
-                    logger.debug(f"    - New Context: ['{new_entry.get('context_prev', '')}', '{new_entry.get('text', '')}', '{new_entry.get('context_next', '')}']")
-                    logger.debug(f"    - Old Context: ['{candidate.get('context_prev', '')}', '{candidate.get('text', '')}', '{candidate.get('context_next', '')}']")
-
-                    used_old_voice_ids.add(candidate['voice_id'])
-                    classification = classify_voice_file(f"{new_entry.get('filename')}.wav")
-                    matched_data.append({
-                        'new_voice_id': new_entry.get('id'),
-                        'new_filename': new_entry.get('filename'),
-                        'new_text': new_entry['text'],
-                        'old_voice_id': candidate.get('voice_id'),
-                        'old_script_id': candidate.get('script_id'),
-                        'old_scene_id': candidate.get('scene_id'),
-                        'old_scene_seq_id': candidate.get('scene_seq_id'),
-                        'old_text': candidate.get('text'),
-                        'character_id': candidate.get('character_id'),
-                        'source_file': candidate.get('source_file'),
-                        'match_type': 'context',
-                        'classification': classification
-                    })
-                    found_context_match = True
-                    break # Found a match, no need to check other candidates
-            
-            if not found_context_match:
-                remaining_entries_pass3.append(new_entry)
-        else:
-            # If no ambiguity, pass to the next stage
-            remaining_entries_pass3.append(new_entry)
-    logger.info(f"第二遍完成: 成功匹配 {pass2_success_count} 条。")
-
-    # --- Pass 3: Vector Similarity Matching ---
-    logger.info("\n--- 第三遍: 对剩余条目执行向量相似度匹配 ---")
-    pass3_success_count = 0
-    for new_entry in remaining_entries_pass3:
-        best_match, match_type = find_best_match(new_entry, old_data_map, old_data_normalized_map, old_script_list, model, old_embeddings, args, used_old_voice_ids, methods=['vector'])
-
-        if best_match:
-            pass3_success_count += 1
-            logger.debug(f"  - 向量相似度匹配成功: New ID {new_entry['id']} {match_type[13:]}")
-            logger.debug(f"    - New Context: [{new_entry['context_prev']} {new_entry['text']} {new_entry['context_next']}]")
-            logger.debug(f"    - Old Context: [{best_match['context_prev']} {best_match['text']} {best_match['context_next']}]")
-
-            vector_search_success_count += 1
-            classification = classify_voice_file(f"{new_entry.get('filename')}.wav")
-            matched_data.append({
-                'new_voice_id': new_entry.get('id'),
-                'new_filename': new_entry.get('filename'),
-                'new_text': new_entry['text'],
-                'old_voice_id': best_match.get('voice_id'),
-                'old_script_id': best_match.get('script_id'),
-                'old_scene_id': best_match.get('scene_id'),
-                'old_scene_seq_id': best_match.get('scene_seq_id'),
-                'old_text': best_match.get('text'),
-                'character_id': best_match.get('character_id'),
-                'source_file': best_match.get('source_file'),
-                'match_type': match_type,
-                'classification': classification
-            })
-        else:
-            unmatched_data.append({
-                'new_voice_id': new_entry.get('id'),
-                'new_filename': new_entry.get('filename'),
-                'classification': classification,
-                'text': new_entry['text']
-            })
-    logger.info(f"第三遍完成: 成功匹配 {pass3_success_count} 条。")
+    return matcher.export(matcher.match())
 
-    # 最终成功数就是 matched_data 列表的长度
-    success_count = len(matched_data)
 
-    # 在写入前按 new_voice_id 排序
-    matched_data.sort(key=lambda x: x['new_voice_id'])
+def main():
+    """主函数，执行匹配和生成文件。"""
+    args = build_arg_parser().parse_args()
+    setup_logging(verbose=args.verbose, stage_levels=args.log_level, sample_every=args.log_sample)
 
-    # 写入输出文件
-    with open(MERGED_OUTPUT_FILE, 'w', encoding='utf-8') as f:
-        json.dump(matched_data, f, ensure_ascii=False, indent=4)
-    
-    with open(UNMATCHED_OUTPUT_FILE, 'w', encoding='utf-8') as f:
-        json.dump(unmatched_data, f, ensure_ascii=False, indent=4)
-    
-    with open(SKIPPED_OUTPUT_FILE, 'w', encoding='utf-8') as f:
-        json.dump(skipped_data, f, ensure_ascii=False, indent=4)
-
-    matched_data_new_voice_id_map = {entry['new_voice_id']: entry for entry in matched_data}
-    unmatched_data_new_voice_id_map = {entry['new_voice_id']: entry for entry in unmatched_data}
-    skipped_data_new_voice_id_map = {entry['new_voice_id']: entry for entry in skipped_data}
-    with open(MATCH_RESULT_CSV, 'w', encoding='utf-8', newline='\n') as f:
-        writer = csv.writer(f)
-        writer.writerow(['RemakeVoiceID', 'RemakeVoiceFilename', 'OldScriptId', 'OldVoiceFilename', 'MatchType', 'RemakeVoiceType', 'RemakeVoiceCharacterId', 'RemakeVoiceCategory', 'RemakeVoiceOrderPerCharacter', 'RemakeVoiceText', 'OldVoiceText'])
-        rows_to_write = []
-        for new_voice_entry in new_data_unsorted:
-            matched_entry = matched_data_new_voice_id_map.get(new_voice_entry['id'])
-            if matched_entry:
-                rows_to_write.append([
-                    new_voice_entry['id'],
-                    new_voice_entry['filename'],
-                    matched_entry['old_script_id'],
-                    "ch" + matched_entry['old_voice_id'][:-1],
-                    matched_entry['match_type'],
-                    matched_entry['classification']['type'],
-                    matched_entry['classification']['character_id'],
-                    matched_entry['classification']['category'],
-                    matched_entry['classification']['number'],
-                    matched_entry['new_text'],
-                    matched_entry['old_text']
-                ])
-            else  :
-                unmatched_entry = unmatched_data_new_voice_id_map.get(new_voice_entry['id'])
-                if unmatched_entry:
-                    rows_to_write.append([
-                        unmatched_entry['new_voice_id'],
-                        unmatched_entry['new_filename'],
-                        '',
-                        '',
-                        'unmatched',
-                        unmatched_entry['classification']['type'],
-                        unmatched_entry['classification']['character_id'],
-                        unmatched_entry['classification']['category'],
-                        unmatched_entry['classification']['number'],
-                        unmatched_entry['text'],
-                        ''
-                    ])
-                else:
-                    skipped_entry = skipped_data_new_voice_id_map.get(new_voice_entry['id'])
-                    rows_to_write.append([
-                        skipped_entry['new_voice_id'],
-                        skipped_entry['new_filename'],
-                        '',
-                        '',
-                        'skipped',
-                        skipped_entry['classification']['type'],
-                        skipped_entry['classification'].get('character_id', ''),
-                        skipped_entry['classification'].get('category', ''),
-                        skipped_entry['classification'].get('number', ''),
-                        skipped_entry['text'],
-                        ''
-                    ])
-        writer.writerows(rows_to_write)
-
-    # --- 更新 t_voice.json ---
-    logger.info("\n正在将匹配结果应用到新的 t_voice.json...")
-    
-    # 1. 创建已匹配和未匹配的ID查找集
-    id_to_old_filename_map = {entry['new_voice_id']: "ch" + entry['old_voice_id'][:-1] for entry in matched_data}
-    unmatched_ids = {entry['new_voice_id'] for entry in unmatched_data}
+    # 如果启用了映射到空文件功能，则提前创建该文件
+    if args.map_failed_to_empty and not args.threshold_sweep:
+        empty_wav_path = Path('voice/wav/EMPTY.wav')
+        create_empty_wav_file(empty_wav_path, args.empty_wav_rate)
+        logger.info(f"已创建或更新统一的空WAV文件: {empty_wav_path}")
 
-    # 2. 重新加载原始 t_voice.json 数据
-    try:
-        with open(NEW_VOICE_FILE, 'r', encoding='utf-8') as f:
-            t_voice_content = json.load(f)
-        
-        # 假设数据结构总是 'data' -> list -> 'data' -> list of entries
-        voice_entries = t_voice_content['data'][0]['data']
-
-        # 3. 遍历并更新 t_voice.json 数据
-        updated_count = 0
-        unmatched_mapped_count = 0
-        for entry in voice_entries:
-            voice_id = entry.get('id')
-            if voice_id in id_to_old_filename_map:
-                entry['filename'] = id_to_old_filename_map[voice_id]
-                updated_count += 1
-            elif args.map_failed_to_empty and voice_id in unmatched_ids:
-                entry['filename'] = 'EMPTY'
-                unmatched_mapped_count += 1
-
-        logger.info(f"\n成功更新 {updated_count} 个已匹配的语音条目。")
-        if args.map_failed_to_empty:
-            logger.info(f"已将 {unmatched_mapped_count} 个未匹配的语音条目指向 EMPTY.wav。")
-
-        # 4. 确保 output 目录存在
-        output_dir = 'output'
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir)
-
-        # 5. 写入新的 t_voice.json 文件
-        output_t_voice_path = os.path.join(output_dir, 't_voice.json')
-        with open(output_t_voice_path, 'w', encoding='utf-8') as f:
-            json.dump(t_voice_content, f, ensure_ascii=False, indent=4)
-        
-        logger.info(f"成功更新 {updated_count} 个条目。")
-        logger.info(f"新的 t_voice.json 已保存到: {output_t_voice_path}")
-
-    except Exception as e:
-        logger.error(f"错误：更新 t_voice.json 失败: {e}")
-
-    # --- 打印统计结果 ---
-    logger.info("\n--- 匹配完成 ---")
-    logger.info(f"总计 (输入文件): {total_count}")
-    logger.info(f"处理 (符合条件): {processed_count}")
-    logger.info(f"成功: {success_count} (其中向量搜索: {vector_search_success_count})")
-    logger.info(f"失败: {processed_count - success_count}")
-    logger.info(f"成功匹配的数据已保存到: {MERGED_OUTPUT_FILE}")
-    logger.info(f"未匹配的数据已保存到: {UNMATCHED_OUTPUT_FILE}")
-    logger.info(f"跳过匹配的数据已保存到: {SKIPPED_OUTPUT_FILE}")
-    logger.info(f"匹配结果已保存到: {MATCH_RESULT_CSV}")
+    run_matching(args)
 
 if __name__ == '__main__':
     main()
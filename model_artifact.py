@@ -0,0 +1,175 @@
+"""
+固定版本的本地模型文件。
+
+匹配时不再按模型名从 Hugging Face Hub 解析模型，而是从项目内的目录（默认 models/paraphrase-multilingual-MiniLM-L12-v2）加载：
+目录中包含 safetensors 权重、tokenizer、配置，以及记录每个文件大小和 SHA-256 的 model_artifact.json。
+safetensors 权重由 transformers 以内存映射方式读取，不经过 pickle，冷启动更快；加载时只使用本地文件，
+不访问网络。目录缺失或不完整时立即报错，不会回退到下载。
+
+用法：
+    uv run model_artifact.py pack                # 在有网络的机器上下载并打包模型
+    uv run model_artifact.py verify              # 校验所有文件的 SHA-256
+    uv run model_artifact.py pack --revision <commit> --output models/my-model
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import sys
+
+import sentence_transformers
+from sentence_transformers import SentenceTransformer
+
+MODEL_NAME = 'paraphrase-multilingual-MiniLM-L12-v2'
+# 项目内的模型目录
+MODEL_ARTIFACT_DIR = os.path.join('models', MODEL_NAME)
+# 模型目录中的清单文件
+MANIFEST_FILE = 'model_artifact.json'
+ARTIFACT_VERSION = 1
+
+
+class ModelArtifactError(RuntimeError):
+    """模型目录缺失、不完整或校验失败。"""
+
+
+def file_sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def check_artifact(path=MODEL_ARTIFACT_DIR, verify_checksums=False):
+    """
+    检查模型目录是否完整。
+
+    默认只比较文件大小，verify_checksums 为 True 时逐个计算 SHA-256。
+
+    Returns:
+        dict: 清单内容。
+
+    Raises:
+        ModelArtifactError: 目录缺失、清单无法读取、文件缺失或与清单不一致。
+    """
+    manifest_path = os.path.join(path, MANIFEST_FILE)
+    if not os.path.isfile(manifest_path):
+        raise ModelArtifactError(
+            f"找不到模型目录 {path}（缺少 {MANIFEST_FILE}）。"
+            f"请在有网络的机器上运行 `uv run model_artifact.py pack --output {path}`，再把该目录复制过来。"
+        )
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        files = manifest['files']
+    except (OSError, json.JSONDecodeError, KeyError, TypeError) as e:
+        raise ModelArtifactError(f"无法读取模型清单 {manifest_path}: {type(e).__name__}: {e}") from e
+    if manifest.get('version') != ARTIFACT_VERSION:
+        raise ModelArtifactError(f"模型清单 {manifest_path} 的版本 {manifest.get('version')} 不受支持，请重新打包。")
+    if not any(name.endswith('.safetensors') for name in files):
+        raise ModelArtifactError(f"模型目录 {path} 中没有 safetensors 权重，请重新打包。")
+
+    for name, info in files.items():
+        file_path = os.path.join(path, *name.split('/'))
+        try:
+            size = os.path.getsize(file_path)
+        except OSError:
+            raise ModelArtifactError(f"模型目录 {path} 不完整: 缺少 {name}。") from None
+        if size != info['size']:
+            raise ModelArtifactError(f"模型文件 {name} 的大小 ({size}) 与清单 ({info['size']}) 不一致。")
+        if verify_checksums and file_sha256(file_path) != info['sha256']:
+            raise ModelArtifactError(f"模型文件 {name} 的 SHA-256 与清单不一致。")
+    return manifest
+
+
+def model_key(path=MODEL_ARTIFACT_DIR):
+    """
+    模型目录的标识：清单中的模型名、版本和 safetensors 权重的 SHA-256，供向量缓存和匹配选项的指纹使用。
+
+    重新打包为其他版本或 --model-dir 指向其他模型时标识随之变化。清单无法读取时（此时模型也无法加载）返回 MODEL_NAME。
+    """
+    try:
+        with open(os.path.join(path, MANIFEST_FILE), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        weights = sorted((name, info['sha256']) for name, info in manifest['files'].items() if name.endswith('.safetensors'))
+    except (OSError, json.JSONDecodeError, KeyError, TypeError, AttributeError):
+        return MODEL_NAME
+    h = hashlib.sha256()
+    for name, sha256 in weights:
+        h.update(f"{name}:{sha256}\n".encode('utf-8'))
+    return f"{manifest.get('model_name', MODEL_NAME)}@{manifest.get('revision') or ''}:{h.hexdigest()[:32]}"
+
+
+def load_model(path=MODEL_ARTIFACT_DIR, verify_checksums=False):
+    """检查模型目录后只从本地文件加载模型。"""
+    check_artifact(path, verify_checksums)
+    return SentenceTransformer(path, local_files_only=True)
+
+
+def pack_model(model_name=MODEL_NAME, output_dir=MODEL_ARTIFACT_DIR, revision=None):
+    """
+    下载模型并以 safetensors 格式保存到 output_dir，写入清单。先写入临时目录，完成后替换原目录。
+
+    Returns:
+        dict: 清单内容。
+    """
+    model = SentenceTransformer(model_name, revision=revision)
+    temp_dir = output_dir.rstrip('/\\') + '.tmp'
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    model.save(temp_dir, safe_serialization=True)
+
+    files = {}
+    for root, _, names in os.walk(temp_dir):
+        for name in sorted(names):
+            file_path = os.path.join(root, name)
+            relative = os.path.relpath(file_path, temp_dir).replace(os.sep, '/')
+            files[relative] = {'size': os.path.getsize(file_path), 'sha256': file_sha256(file_path)}
+    if not any(name.endswith('.safetensors') for name in files):
+        shutil.rmtree(temp_dir, ignore_errors=True)
+        raise ModelArtifactError(f"模型 {model_name} 没有以 safetensors 格式保存。")
+
+    manifest = {
+        'version': ARTIFACT_VERSION,
+        'model_name': model_name,
+        'revision': revision,
+        'sentence_transformers': sentence_transformers.__version__,
+        'files': dict(sorted(files.items())),
+    }
+    with open(os.path.join(temp_dir, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.makedirs(os.path.dirname(os.path.abspath(output_dir)), exist_ok=True)
+    os.replace(temp_dir, output_dir)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description='打包或校验固定版本的本地模型文件。')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    pack_parser = subparsers.add_parser('pack', help='下载模型并打包到项目目录（需要网络）')
+    pack_parser.add_argument('--model', default=MODEL_NAME, help=f'模型名或本地路径 (默认: {MODEL_NAME})')
+    pack_parser.add_argument('--revision', default=None, help='固定的模型版本（Hub 上的 commit 或 tag）')
+    pack_parser.add_argument('--output', default=MODEL_ARTIFACT_DIR, help=f'输出目录 (默认: {MODEL_ARTIFACT_DIR})')
+
+    verify_parser = subparsers.add_parser('verify', help='校验模型目录中所有文件的 SHA-256')
+    verify_parser.add_argument('path', nargs='?', default=MODEL_ARTIFACT_DIR, help=f'模型目录 (默认: {MODEL_ARTIFACT_DIR})')
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'pack':
+            print(f"正在下载并打包模型 {args.model}...")
+            manifest = pack_model(args.model, args.output, args.revision)
+            print(f"已打包 {len(manifest['files'])} 个文件到: {args.output}")
+        else:
+            manifest = check_artifact(args.path, verify_checksums=True)
+            print(f"模型目录 {args.path} 校验通过: {manifest['model_name']} ({len(manifest['files'])} 个文件)")
+    except ModelArtifactError as e:
+        print(f"错误：{e}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+多级标准化键：同一句台词在新旧版本中常有全角/半角、省略号写法、乱码控制字符、注音括号和小写假名等差异。
+每一级在上一级的基础上进一步放宽，匹配时按顺序在各级的哈希索引中查找，命中的级别记录在 match_type 中。
+
+    exact   原文
+    nfkc    NFKC 标准化（全角/半角统一），乱码 '骸x02]' 等统一为 '❤'
+    punct   再移除所有标点符号和空格（省略号 '…'/'・・・'/'...' 等随之统一）
+    ruby    先移除 clean_text 添加的注音括号 '（…）'，再移除标点符号和空格
+    kana    再把片假名转为平假名、小写假名转为普通假名，并移除长音符号
+"""
+import re
+import unicodedata
+from functools import lru_cache
+
+NORMALIZATION_LEVELS = ['exact', 'nfkc', 'punct', 'ruby', 'kana']
+
+# clean_text 未能替换的乱码控制字符，与 '❤' 视为相同
+ARTIFACT_PATTERN = re.compile(r'骸[xX]0[0-9a-fA-F]\]')
+# 能处理日文和英文标点
+PUNCTUATION_PATTERN = re.compile(r'[\s\W]')
+# NFKC 之后全角括号已变为半角
+RUBY_PATTERN = re.compile(r'\([^()]*\)')
+SMALL_KANA = dict(zip('ぁぃぅぇぉっゃゅょゎゕゖ', 'あいうえおつやゆよわかけ'))
+
+
+def _kana_table():
+    table = {ord(small): large for small, large in SMALL_KANA.items()}
+    for code in range(ord('ァ'), ord('ヶ') + 1):
+        hiragana = chr(code - 0x60)
+        table[code] = SMALL_KANA.get(hiragana, hiragana)
+    table[ord('ー')] = None
+    return table
+
+
+KANA_TABLE = _kana_table()
+
+
+@lru_cache(maxsize=None)
+def ladder_keys(text):
+    """返回文本在 NORMALIZATION_LEVELS 各级的标准化键。"""
+    nfkc = ARTIFACT_PATTERN.sub('❤', unicodedata.normalize('NFKC', text))
+    punct = PUNCTUATION_PATTERN.sub('', nfkc)
+    ruby = PUNCTUATION_PATTERN.sub('', RUBY_PATTERN.sub('', nfkc))
+    kana = ruby.translate(KANA_TABLE)
+    return text, nfkc, punct, ruby, kana
+
+
+def normalize_text(text):
+    """移除文本中的所有标点符号和空格，用于第一遍的标准化匹配。"""
+    return PUNCTUATION_PATTERN.sub('', text)
+
+
+def ladder_match_type(level):
+    """第 level 级命中时的 match_type：原文为 'exact'，其余为 'normalized (<级别>)'。"""
+    name = NORMALIZATION_LEVELS[level]
+    return 'exact' if name == 'exact' else f'normalized ({name})'
@@ -0,0 +1,226 @@
+"""
+战斗语音和主动语音的表驱动映射。
+
+战斗语音（b、bv）和主动语音（av）多为不带上下文的短句，文本匹配和向量搜索既慢又很少命中。
+这些类别改为按序号表确定性地映射：ordinal_voice_table.csv 的每一行把 (重制版角色ID, 分类, 角色内序号)
+对应到一个旧语音文件，匹配时直接按键查找，不经过文本匹配和向量搜索（match_type 为 ordinal）。
+
+序号表可以手工编写，也可以用 learn 命令从已有的匹配结果中学习：
+    1. 结果中已匹配的这些类别的条目直接写入表中（Source 为 matched）。
+    2. 同一角色、同一分类的已匹配条目中，旧语音位于同一场景且“旧场景内序号 - 新序号”相同的占多数时，
+       把这个规则推广到该角色同一分类的其他序号（Source 为 rule）。某个角色没有已匹配条目，但其他角色的规则
+       在场景和偏移上一致时，通过角色ID映射（voice_id_mapping.csv）得到旧角色后同样推广。
+       推算出的旧语音必须存在于旧数据中（或 --old-voice-wav 目录中有对应的文件）。
+    3. 已有序号表中的行保持不变（Source 为 table），学习的结果只补充缺少的行。
+
+用法：
+    uv run ordinal_mapping.py learn                              # 从 match_result.csv 学习，写入 ordinal_voice_table.csv
+    uv run ordinal_mapping.py learn --results run_a/match_result.csv --old-voice-wav voice/wav
+    uv run ordinal_mapping.py show
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+from collections import Counter, defaultdict
+
+from voice_records import parse_scene
+
+# 输入文件：generate_id_mapping.py 生成的角色ID映射
+CHARACTER_MAPPING_FILE = 'voice_id_mapping.csv'
+# 输入/输出文件：序号表
+ORDINAL_TABLE_FILE = 'ordinal_voice_table.csv'
+# 按序号表映射的分类
+ORDINAL_CATEGORIES = ('battle', 'battle_voice', 'active_voice')
+TABLE_COLUMNS = ['RemakeVoiceCharacterId', 'RemakeVoiceCategory', 'RemakeVoiceOrderPerCharacter', 'OldVoiceFilename', 'Source']
+
+
+def load_character_mapping(path):
+    """
+    读取 generate_id_mapping.py 生成的角色ID映射。
+
+    Returns:
+        dict: 重制版角色ID -> 旧版角色ID集合。文件不存在时返回空字典。
+    """
+    mapping = defaultdict(set)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                if row.get('RemakeVoiceCharacterId') and row.get('OldVoiceCharacterId'):
+                    mapping[row['RemakeVoiceCharacterId']].add(row['OldVoiceCharacterId'])
+    except FileNotFoundError:
+        pass
+    return mapping
+
+
+def old_voice_id(filename):
+    """'ch0010090001' -> '0010090001V'。"""
+    return filename[2:] + 'V'
+
+
+def read_ordinal_table(path):
+    """
+    读取序号表。
+
+    Returns:
+        dict: (重制版角色ID, 分类, 序号) -> (旧语音ID, Source)。
+
+    Raises:
+        FileNotFoundError: 文件不存在。
+    """
+    table = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            if row.get('OldVoiceFilename'):
+                key = (row['RemakeVoiceCharacterId'], row['RemakeVoiceCategory'], row['RemakeVoiceOrderPerCharacter'])
+                table[key] = (old_voice_id(row['OldVoiceFilename']), row.get('Source') or 'table')
+    return table
+
+
+def write_ordinal_table(path, table):
+    with open(path, 'w', encoding='utf-8', newline='\n') as f:
+        writer = csv.writer(f)
+        writer.writerow(TABLE_COLUMNS)
+        for (character_id, category, number), (voice_id, source) in sorted(table.items()):
+            writer.writerow([character_id, category, number, "ch" + voice_id[:-1], source])
+
+
+def ordinal_rule(pairs, min_support, min_share):
+    """
+    从 (新序号, 旧语音ID) 对中找出占多数的 (旧角色ID, 场景ID, 序号偏移) 规则，没有足够一致的规则时返回 None。
+    """
+    rules = Counter()
+    for number, voice_id in pairs:
+        scene_id, scene_seq_id, _ = parse_scene(voice_id)
+        if number.isdigit() and scene_seq_id >= 0:
+            rules[(voice_id[:3], scene_id, scene_seq_id - int(number))] += 1
+    if not rules:
+        return None
+    rule, support = rules.most_common(1)[0]
+    if support < min_support or support < min_share * sum(rules.values()):
+        return None
+    return rule
+
+
+def learn_ordinal_table(results, character_mapping, old_voice_ids, table=None, min_support=3, min_share=0.8):
+    """
+    从匹配结果中学习序号表。
+
+    Args:
+        results (list): match_result.csv 的行（字典），包括未匹配和被跳过的条目。
+        character_mapping (dict): 重制版角色ID -> 旧版角色ID集合。
+        old_voice_ids (set): 已知存在的旧语音ID，推算出的旧语音必须在其中。
+        table (dict, optional): 已有的序号表，其中的行保持不变。
+        min_support (int): 规则至少需要的已匹配条目数。
+        min_share (float): 规则在该组已匹配条目中至少占的比例。
+
+    Returns:
+        tuple: (序号表, 每个 (角色, 分类) 的规则 dict)。
+    """
+    table = dict(table or {})
+    targets = defaultdict(list)
+    pairs = defaultdict(list)
+    for row in results:
+        category = row['RemakeVoiceCategory']
+        if category not in ORDINAL_CATEGORIES:
+            continue
+        key = (row['RemakeVoiceCharacterId'], category, row['RemakeVoiceOrderPerCharacter'])
+        if row['OldVoiceFilename']:
+            voice_id = old_voice_id(row['OldVoiceFilename'])
+            table.setdefault(key, (voice_id, 'matched'))
+            pairs[key[:2]].append((key[2], voice_id))
+        targets[key[:2]].append(key[2])
+
+    rules = {group: rule for group, group_pairs in pairs.items() if (rule := ordinal_rule(group_pairs, min_support, min_share))}
+    # 同一分类的规则在场景和偏移上一致时，没有已匹配条目的角色通过角色ID映射使用同一规则
+    category_rules = defaultdict(Counter)
+    for (_, category), (_, scene_id, offset) in rules.items():
+        category_rules[category][(scene_id, offset)] += 1
+    for group in targets:
+        character_id, category = group
+        if group in rules or len(category_rules[category]) != 1 or len(character_mapping.get(character_id, ())) != 1:
+            continue
+        (scene_id, offset), _ = category_rules[category].most_common(1)[0]
+        rules[group] = (next(iter(character_mapping[character_id])), scene_id, offset)
+
+    used = {voice_id for voice_id, _ in table.values()}
+    for group, numbers in targets.items():
+        rule = rules.get(group)
+        if rule is None:
+            continue
+        old_character_id, scene_id, offset = rule
+        for number in numbers:
+            key = (*group, number)
+            if key in table or not number.isdigit() or not 0 <= int(number) + offset <= 9999:
+                continue
+            voice_id = f"{old_character_id}{scene_id}{int(number) + offset:04d}V"
+            if voice_id in old_voice_ids and voice_id not in used:
+                table[key] = (voice_id, 'rule')
+                used.add(voice_id)
+    return table, rules
+
+
+def known_old_voice_ids(data_files, wav_dir=None):
+    """旧数据文件中的全部旧语音ID，以及 wav_dir 中 ch<ID>.wav 文件对应的旧语音ID。"""
+    voice_ids = set()
+    for path in data_files:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                voice_ids.update(entry.get('voice_id') for entry in json.load(f))
+        except FileNotFoundError:
+            print(f"警告：找不到旧数据文件 {path}")
+    if wav_dir:
+        for _, _, names in os.walk(wav_dir):
+            voice_ids.update(old_voice_id(name[:-4]) for name in names if name.startswith('ch') and name.endswith('.wav'))
+    voice_ids.discard(None)
+    return voice_ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description='学习或查看战斗语音、主动语音的序号表。')
+    parser.add_argument('--table', default=ORDINAL_TABLE_FILE, help=f'序号表文件 (默认: {ORDINAL_TABLE_FILE})')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    learn_parser = subparsers.add_parser('learn', help='从匹配结果中学习序号表，补充到序号表文件中')
+    learn_parser.add_argument('--results', default='match_result.csv', help='匹配结果 (默认: match_result.csv)')
+    learn_parser.add_argument('--character-mapping', default=CHARACTER_MAPPING_FILE, help=f'角色ID映射 (默认: {CHARACTER_MAPPING_FILE})')
+    learn_parser.add_argument('--old-data', nargs='+', default=['voice_data.json', 'script_data.json'], help='旧数据文件，推算出的旧语音必须存在于其中 (默认: voice_data.json script_data.json)')
+    learn_parser.add_argument('--old-voice-wav', help='旧语音WAV目录，其中存在的 ch<ID>.wav 也视为存在的旧语音')
+    learn_parser.add_argument('--min-support', type=int, default=3, help='推广规则至少需要的已匹配条目数 (默认: 3)')
+    learn_parser.add_argument('--min-share', type=float, default=0.8, help='推广规则在同一角色、分类的已匹配条目中至少占的比例 (默认: 0.8)')
+
+    subparsers.add_parser('show', help='按角色和分类统计序号表')
+    args = parser.parse_args()
+
+    try:
+        table = read_ordinal_table(args.table)
+    except FileNotFoundError:
+        if args.command == 'show':
+            print(f"错误：找不到序号表 {args.table}")
+            sys.exit(1)
+        table = {}
+
+    if args.command == 'learn':
+        try:
+            with open(args.results, 'r', encoding='utf-8') as f:
+                results = list(csv.DictReader(f))
+        except FileNotFoundError:
+            print(f"错误：找不到匹配结果 {args.results}")
+            sys.exit(1)
+        old_voice_ids = known_old_voice_ids(args.old_data, args.old_voice_wav)
+        previous = len(table)
+        table, rules = learn_ordinal_table(results, load_character_mapping(args.character_mapping), old_voice_ids, table, args.min_support, args.min_share)
+        for (character_id, category), (old_character_id, scene_id, offset) in sorted(rules.items()):
+            print(f"规则: {character_id} {category} -> 旧角色 {old_character_id}，场景 {scene_id}，序号偏移 {offset:+d}")
+        write_ordinal_table(args.table, table)
+        print(f"序号表新增 {len(table) - previous} 行，共 {len(table)} 行，已保存到: {args.table}")
+    else:
+        counts = Counter((character_id, category, source) for (character_id, category, _), (_, source) in table.items())
+        for (character_id, category, source), count in sorted(counts.items()):
+            print(f"{character_id}\t{category}\t{source}\t{count}")
+        print(f"共 {len(table)} 行")
+
+
+if __name__ == '__main__':
+    main()
@@ -12,11 +12,17 @@
 
 .EXAMPLE
     .\package_assets.ps1
+
+.EXAMPLE
+    .\package_assets.ps1 -IncludeVoice -VoiceDir voice\conditioned
 #>
 
 param(
     [Parameter(Mandatory=$false, HelpMessage="Additionally process the voice assets.")]
-    [switch]$IncludeVoice
+    [switch]$IncludeVoice,
+
+    [Parameter(Mandatory=$false, HelpMessage="Directory holding the new voices in a 'wav' subdirectory (e.g. voice\conditioned after condition_voice.py).")]
+    [string]$VoiceDir = "voice"
 )
 
 # --- Configuration ---
@@ -29,7 +35,7 @@ $createPacScript = Join-Path -Path $scriptRoot -ChildPath "kuro_mdl_tool\misc\cr
 
 # Source paths
 $sourceJson = Join-Path -Path $scriptRoot -ChildPath "output\t_voice.json"
-$newVoicesDir = Join-Path -Path $scriptRoot -ChildPath "voice" # Converted Evo voices
+$newVoicesDir = Join-Path -Path $scriptRoot -ChildPath $VoiceDir # Converted Evo voices
 
 # Output and temporary paths
 $outputDir = Join-Path -Path $scriptRoot -ChildPath "output"
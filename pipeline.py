@@ -0,0 +1,359 @@
+"""
+完整流程（提取 → 匹配 → 生成ID映射 → 重命名 → 语音整理 → 打包）的阶段运行器。
+
+每个阶段声明自己的命令、输入和输出。运行前对输入（包括阶段使用的脚本本身）计算指纹，与
+.pipeline_state.json 中上一次成功运行时的记录对比：输入未变且输出仍是上一次生成的内容时跳过该阶段。
+上游阶段重新运行后若输出内容没有变化，下游阶段同样会被跳过。互不依赖的阶段（如匹配和语音文件检查）
+并发运行，每个阶段的输出写入 pipeline_logs/<阶段名>.log，结束后打印并保存各阶段的耗时报告。
+
+用法示例：
+    uv run pipeline.py                          # 提取、匹配、语音文件检查、生成ID映射
+    uv run pipeline.py match --match-args="--match-battle --incremental"
+    uv run pipeline.py --old-voice-wav voice/wav --package
+    uv run pipeline.py --condition-voice --package --include-voice
+    uv run pipeline.py --force match --dry-run
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import shlex
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+
+from corpus_index import CORPUS_INDEX_DIR
+from extract_voice_data import OUTPUT_FILE, OUTPUT_SCRIPT_FILE, SOURCE_DIR
+
+# 状态文件：各阶段上一次成功运行时的输入指纹和输出摘要
+PIPELINE_STATE_FILE = '.pipeline_state.json'
+# 输出文件：各阶段耗时报告
+PIPELINE_REPORT_CSV = 'pipeline_report.csv'
+# 各阶段的标准输出和标准错误
+PIPELINE_LOG_DIR = 'pipeline_logs'
+
+# 以下路径与 match_voices.py 中的常量一致（不导入 match_voices，避免为调度器加载 torch 等依赖）
+NEW_VOICE_FILE = r'KuroTools v1.3\scripts&tables\t_voice.json'
+MATCH_RESULT_CSV = 'match_result.csv'
+CHARACTER_MAPPING_FILE = 'voice_id_mapping.csv'
+# 转换后的 Evo 语音及 condition_voice.py 的输出目录（与 condition_voice.py 中的常量一致）
+VOICE_WAV_DIR = os.path.join('voice', 'wav')
+CONDITIONED_VOICE_DIR = os.path.join('voice', 'conditioned')
+# match_voices.py 在语音目录中生成的空语音，condition 阶段需要在匹配之后运行
+EMPTY_WAV_FILE = os.path.join(VOICE_WAV_DIR, 'EMPTY.wav')
+MATCH_OUTPUTS = [
+    'merged_voice_data.json', 'unmatched_voice_data.json', 'skipped_voice_data.json',
+    MATCH_RESULT_CSV, os.path.join('output', 't_voice.json'), EMPTY_WAV_FILE,
+]
+# match_voices.py 及其导入的本地模块，代码变化时匹配阶段需要重新运行
+MATCH_SOURCES = [
+    'match_voices.py', 'match_cascade.py', 'voice_records.py', 'vector_shards.py', 'verifiers.py', 'embedding_cache.py',
+    'incremental_match.py', 'result_store.py', 'threshold_sweep.py', 'checkpoints.py', 'match_logging.py',
+    'condition_voice.py', 'voice_durations.py', 'normalization.py', 'model_artifact.py', 'corpus_index.py',
+    'ordinal_mapping.py',
+]
+# model_artifact.py 打包的模型清单（与 model_artifact.py 中的常量一致），模型更换时匹配阶段需要重新运行
+MODEL_MANIFEST = os.path.join('models', 'paraphrase-multilingual-MiniLM-L12-v2', 'model_artifact.json')
+# analyze_voice_files.py 检查的解包后语音目录
+UNPACKED_VOICE_DIR = os.path.join('kuro_mdl_tool', 'misc', 'voice', 'wav')
+
+
+@dataclass
+class Stage:
+    """流程中的一个阶段。inputs / outputs 可以是文件或目录。"""
+    name: str
+    command: list
+    inputs: list
+    outputs: list = field(default_factory=list)
+
+
+def build_stages(args):
+    python = sys.executable
+    stages = [
+        Stage('extract', [python, 'extract_voice_data.py'],
+              [SOURCE_DIR, 'extract_voice_data.py', 'voice_records.py', 'corpus_index.py', 'normalization.py', 'checkpoints.py'],
+              [OUTPUT_FILE, OUTPUT_SCRIPT_FILE, CORPUS_INDEX_DIR]),
+        # voice_id_mapping.csv 由下游的 mapping 阶段生成，只在 --character-ids 子集模式下使用，不计入输入以免形成环；
+        # ordinal_voice_table.csv 是可选的手工/学习产物，只在 --match-battle / --match-active 时使用，同样不计入输入
+        Stage('match', [python, 'match_voices.py', *shlex.split(args.match_args)],
+              [NEW_VOICE_FILE, OUTPUT_FILE, OUTPUT_SCRIPT_FILE, MODEL_MANIFEST, *MATCH_SOURCES],
+              MATCH_OUTPUTS),
+        # 检查 t_voice.json 与解包后的语音文件是否一致，与匹配互不依赖，并发运行
+        Stage('catalog', [python, 'analyze_voice_files.py'],
+              [NEW_VOICE_FILE, UNPACKED_VOICE_DIR, 'analyze_voice_files.py']),
+        Stage('mapping', [python, 'generate_id_mapping.py'],
+              [MATCH_RESULT_CSV, 'generate_id_mapping.py'],
+              [CHARACTER_MAPPING_FILE]),
+    ]
+    if args.old_voice_wav:
+        stages.append(Stage('rename', [python, 'voice_renamer.py', '--old-voice-wav', args.old_voice_wav, '--output', args.rename_output],
+                            [MATCH_RESULT_CSV, args.old_voice_wav, 'voice_renamer.py'],
+                            [args.rename_output]))
+    if args.condition_voice:
+        stages.append(Stage('condition', [python, 'condition_voice.py', *shlex.split(args.condition_args)],
+                            [VOICE_WAV_DIR, EMPTY_WAV_FILE, 'condition_voice.py', 'checkpoints.py'],
+                            [os.path.join(CONDITIONED_VOICE_DIR, 'wav')]))
+    if args.package:
+        powershell = shutil.which('pwsh') or shutil.which('powershell') or 'pwsh'
+        package_inputs = [os.path.join('output', 't_voice.json'), 'package_assets.ps1']
+        package_outputs = [os.path.join('output', 'table_sc.pac')]
+        command = [powershell, '-NoProfile', '-File', 'package_assets.ps1']
+        if args.include_voice:
+            command.append('-IncludeVoice')
+            if args.condition_voice:
+                command.extend(['-VoiceDir', CONDITIONED_VOICE_DIR])
+                package_inputs.append(os.path.join(CONDITIONED_VOICE_DIR, 'wav'))
+            else:
+                package_inputs.append(VOICE_WAV_DIR)
+            package_outputs.append(os.path.join('output', 'voice.pac'))
+        stages.append(Stage('package', command, package_inputs, package_outputs))
+    return stages
+
+
+def stage_dependencies(stages):
+    """阶段的上游：产生其任一输入的阶段。"""
+    producers = {}
+    for stage in stages:
+        for path in stage.outputs:
+            producers[os.path.normpath(path)] = stage.name
+    return {
+        stage.name: sorted({producers[os.path.normpath(path)] for path in stage.inputs
+                            if os.path.normpath(path) in producers} - {stage.name})
+        for stage in stages
+    }
+
+
+def select_stages(stages, dependencies, targets):
+    """目标阶段及其全部上游阶段。"""
+    if not targets:
+        return stages
+    selected = set()
+    pending = list(targets)
+    while pending:
+        name = pending.pop()
+        if name not in selected:
+            selected.add(name)
+            pending.extend(dependencies[name])
+    return [stage for stage in stages if stage.name in selected]
+
+
+class Fingerprinter:
+    """
+    文件和目录的内容摘要。
+
+    文件按内容计算摘要，并按 (大小, 修改时间) 缓存在状态文件中，未变的大文件不会重复读取；
+    目录（脚本目录、语音目录）按其中每个文件的相对路径、大小和修改时间计算摘要。
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    def file_digest(self, path):
+        stat = os.stat(path)
+        cached = self.cache.get(path)
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+        h = hashlib.blake2b(digest_size=16)
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        digest = h.hexdigest()
+        self.cache[path] = [stat.st_size, stat.st_mtime_ns, digest]
+        return digest
+
+    def digest(self, path):
+        """路径的摘要，不存在时为 None。"""
+        if os.path.isfile(path):
+            return self.file_digest(path)
+        if not os.path.isdir(path):
+            return None
+        h = hashlib.blake2b(digest_size=16)
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                file_path = os.path.join(root, name)
+                stat = os.stat(file_path)
+                h.update(f'{os.path.relpath(file_path, path)}\0{stat.st_size}\0{stat.st_mtime_ns}\n'.encode('utf-8'))
+        return 'dir:' + h.hexdigest()
+
+    def input_fingerprint(self, stage):
+        h = hashlib.blake2b(digest_size=16)
+        h.update(json.dumps(stage.command, ensure_ascii=False).encode('utf-8'))
+        for path in stage.inputs:
+            h.update(f'\0{path}\0{self.digest(path)}'.encode('utf-8'))
+        return h.hexdigest()
+
+
+def load_state(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {'stages': {}, 'files': {}}
+
+
+def save_state(path, state):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def is_up_to_date(stage, fingerprint, record, fingerprinter):
+    if record is None or record.get('inputs') != fingerprint:
+        return False
+    return all(fingerprinter.digest(path) == record['outputs'].get(path) for path in stage.outputs)
+
+
+def run_command(stage, log_dir):
+    """在子进程中运行阶段命令，返回 (退出码, 开始时间, 结束时间)。"""
+    started = time.time()
+    with open(os.path.join(log_dir, f'{stage.name}.log'), 'w', encoding='utf-8') as log:
+        try:
+            returncode = subprocess.run(stage.command, stdout=log, stderr=subprocess.STDOUT).returncode
+        except OSError as e:
+            log.write(f"无法启动命令 {stage.command}: {e}\n")
+            returncode = 127
+    return returncode, started, time.time()
+
+
+def run_pipeline(stages, dependencies, args):
+    """
+    按依赖关系调度阶段，互不依赖的阶段并发运行。
+
+    Returns:
+        list: 每个阶段的报告字典 (Stage, Status, Seconds, Started, Finished)，Status 为 ran / skipped / failed / blocked，
+              试运行时需要运行的阶段为 would run。
+    """
+    state = load_state(args.state)
+    fingerprinter = Fingerprinter(state.setdefault('files', {}))
+    stage_records = state.setdefault('stages', {})
+    os.makedirs(args.log_dir, exist_ok=True)
+
+    by_name = {stage.name: stage for stage in stages}
+    status = {}
+    report = {}
+    running = {}
+    fingerprints = {}
+    with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        while len(status) < len(stages):
+            for stage in stages:
+                if stage.name in status or stage.name in running.values():
+                    continue
+                upstream = [name for name in dependencies[stage.name] if name in by_name]
+                if any(status.get(name) in ('failed', 'blocked') for name in upstream):
+                    status[stage.name] = 'blocked'
+                    report[stage.name] = {'Stage': stage.name, 'Status': 'blocked', 'Seconds': 0.0, 'Started': '', 'Finished': ''}
+                    print(f"[{stage.name}] 上游阶段失败，跳过。")
+                    continue
+                if not all(status.get(name) in ('ran', 'skipped', 'would run') for name in upstream):
+                    continue
+                # 试运行时上游需要运行的阶段，其输出还未更新，下游同样视为需要运行
+                upstream_pending = any(status.get(name) == 'would run' for name in upstream)
+
+                missing = [path for path in stage.inputs if not os.path.exists(path)]
+                fingerprint = fingerprinter.input_fingerprint(stage)
+                if stage.name not in args.force and not missing and not upstream_pending and is_up_to_date(stage, fingerprint, stage_records.get(stage.name), fingerprinter):
+                    status[stage.name] = 'skipped'
+                    report[stage.name] = {'Stage': stage.name, 'Status': 'skipped', 'Seconds': 0.0, 'Started': '', 'Finished': ''}
+                    print(f"[{stage.name}] 输入未变化，跳过。")
+                    continue
+                if missing:
+                    print(f"[{stage.name}] 警告：缺少输入 {', '.join(missing)}")
+                if args.dry_run:
+                    status[stage.name] = 'would run'
+                    report[stage.name] = {'Stage': stage.name, 'Status': status[stage.name], 'Seconds': 0.0, 'Started': '', 'Finished': ''}
+                    print(f"[{stage.name}] 需要运行: {shlex.join(stage.command)}")
+                    continue
+                print(f"[{stage.name}] 开始: {shlex.join(stage.command)}")
+                fingerprints[stage.name] = fingerprint
+                running[executor.submit(run_command, stage, args.log_dir)] = stage.name
+
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                stage = by_name[name]
+                returncode, started, finished = future.result()
+                missing_outputs = [path for path in stage.outputs if not os.path.exists(path)]
+                if returncode != 0 or missing_outputs:
+                    status[name] = 'failed'
+                    stage_records.pop(name, None)
+                    reason = f"退出码 {returncode}" if returncode != 0 else f"未生成 {', '.join(missing_outputs)}"
+                    print(f"[{name}] 失败 ({reason})，详见 {os.path.join(args.log_dir, name + '.log')}")
+                else:
+                    status[name] = 'ran'
+                    stage_records[name] = {
+                        'inputs': fingerprints[name],
+                        'outputs': {path: fingerprinter.digest(path) for path in stage.outputs},
+                    }
+                    print(f"[{name}] 完成，用时 {finished - started:.1f} 秒。")
+                report[name] = {
+                    'Stage': name, 'Status': status[name], 'Seconds': round(finished - started, 2),
+                    'Started': time.strftime('%H:%M:%S', time.localtime(started)),
+                    'Finished': time.strftime('%H:%M:%S', time.localtime(finished)),
+                }
+                if not args.dry_run:
+                    save_state(args.state, state)
+    if not args.dry_run:
+        save_state(args.state, state)
+    return [report[stage.name] for stage in stages]
+
+
+def write_report(path, rows):
+    with open(path, 'w', encoding='utf-8', newline='\n') as f:
+        writer = csv.DictWriter(f, fieldnames=['Stage', 'Status', 'Seconds', 'Started', 'Finished'])
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='按阶段运行完整流程，只重新运行输入发生变化的阶段。')
+    parser.add_argument('targets', nargs='*', help='要运行的阶段（及其上游阶段），默认运行全部已启用的阶段：extract、match、catalog、mapping，以及 rename、condition、package')
+    parser.add_argument('--match-args', default='', help='传给 match_voices.py 的参数，如 "--match-battle --incremental"')
+    parser.add_argument('--old-voice-wav', help='启用 rename 阶段：旧语音WAV目录，传给 voice_renamer.py')
+    parser.add_argument('--rename-output', default=os.path.join('output', 'renamed_voices'), help='rename 阶段的输出目录 (默认: output/renamed_voices)')
+    parser.add_argument('--condition-voice', action='store_true', help='启用 condition 阶段：用 condition_voice.py 整理 voice/wav 中的语音，package 阶段打包整理后的文件')
+    parser.add_argument('--condition-args', default='', help='传给 condition_voice.py 的参数，如 "--sample-rate 24000 --workers 8"')
+    parser.add_argument('--package', action='store_true', help='启用 package 阶段：运行 package_assets.ps1')
+    parser.add_argument('--include-voice', action='store_true', help='package 阶段同时打包语音文件 (-IncludeVoice)')
+    parser.add_argument('--force', nargs='+', default=[], metavar='STAGE', help='无论输入是否变化都重新运行这些阶段')
+    parser.add_argument('--jobs', type=int, default=2, help='同时运行的阶段数 (默认: 2)')
+    parser.add_argument('--dry-run', action='store_true', help='只列出需要运行的阶段，不实际运行')
+    parser.add_argument('--state', default=PIPELINE_STATE_FILE, help=f'阶段状态文件 (默认: {PIPELINE_STATE_FILE})')
+    parser.add_argument('--log-dir', default=PIPELINE_LOG_DIR, help=f'阶段日志目录 (默认: {PIPELINE_LOG_DIR})')
+    parser.add_argument('--report', default=PIPELINE_REPORT_CSV, help=f'耗时报告文件 (默认: {PIPELINE_REPORT_CSV})')
+    args = parser.parse_args()
+
+    stages = build_stages(args)
+    names = [stage.name for stage in stages]
+    for name in [*args.targets, *args.force]:
+        if name not in names:
+            print(f"错误：未知或未启用的阶段 '{name}'，可选: {', '.join(names)}")
+            sys.exit(1)
+    dependencies = stage_dependencies(stages)
+    stages = select_stages(stages, dependencies, args.targets)
+
+    wall_started = time.time()
+    rows = run_pipeline(stages, dependencies, args)
+    wall_seconds = time.time() - wall_started
+
+    print("\n--- 阶段耗时 ---")
+    print(f"{'Stage':<10}{'Status':<12}{'Seconds':>8}")
+    for row in rows:
+        print(f"{row['Stage']:<10}{row['Status']:<12}{row['Seconds']:>8.1f}")
+    print(f"总耗时 {wall_seconds:.1f} 秒（各阶段合计 {sum(row['Seconds'] for row in rows):.1f} 秒）")
+    if not args.dry_run:
+        write_report(args.report, rows)
+        print(f"耗时报告已保存到: {args.report}")
+    if any(row['Status'] in ('failed', 'blocked') for row in rows):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
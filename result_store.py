@@ -0,0 +1,260 @@
+"""
+带索引的 SQLite 匹配结果库，以及供人工复核使用的查询命令行。
+
+match_voices.py 每次运行都会把结果写入 match_results.db（与 match_result.csv 等文件内容一致），
+按游戏区分，同一游戏重新运行时替换该游戏的全部记录，因此多个游戏的结果可以放在同一个库中。
+
+表结构：
+    entries     重制版语音条目（ID、文件名、分类、文本）
+    decisions   每个条目的最终决策（matched / unmatched / skipped）、匹配方式、分数和旧语音
+    candidates  向量检索阶段为条目打过分的最佳候选项，包括未被采用的候选项
+
+用法示例：
+    uv run result_store.py stats
+    uv run result_store.py entry 40339
+    uv run result_store.py old ch0070070476
+    uv run result_store.py list --character 015 --match-type vector_search --max-score 0.9
+"""
+import argparse
+import os
+import re
+import sqlite3
+import sys
+
+# 输出文件：匹配结果数据库
+RESULT_DB_FILE = 'match_results.db'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS entries (
+    game TEXT NOT NULL,
+    remake_id INTEGER NOT NULL,
+    filename TEXT,
+    type TEXT,
+    character_id TEXT,
+    category TEXT,
+    number TEXT,
+    text TEXT,
+    PRIMARY KEY (game, remake_id)
+);
+CREATE TABLE IF NOT EXISTS decisions (
+    game TEXT NOT NULL,
+    remake_id INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    match_type TEXT,
+    match_label TEXT,
+    score REAL,
+    old_voice_id TEXT,
+    old_filename TEXT,
+    old_script_id INTEGER,
+    old_character_id TEXT,
+    old_text TEXT,
+    reason TEXT,
+    PRIMARY KEY (game, remake_id)
+);
+CREATE TABLE IF NOT EXISTS candidates (
+    game TEXT NOT NULL,
+    remake_id INTEGER NOT NULL,
+    stage TEXT NOT NULL,
+    old_voice_id TEXT,
+    old_filename TEXT,
+    old_text TEXT,
+    score REAL,
+    text_similarity REAL,
+    verifier TEXT,
+    accepted INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_entries_character ON entries (character_id, category);
+CREATE INDEX IF NOT EXISTS idx_entries_category ON entries (category);
+CREATE INDEX IF NOT EXISTS idx_decisions_old_voice ON decisions (old_voice_id);
+CREATE INDEX IF NOT EXISTS idx_decisions_old_filename ON decisions (old_filename);
+CREATE INDEX IF NOT EXISTS idx_decisions_match_type ON decisions (match_type, score);
+CREATE INDEX IF NOT EXISTS idx_candidates_remake ON candidates (game, remake_id);
+CREATE INDEX IF NOT EXISTS idx_candidates_old_voice ON candidates (old_voice_id);
+'''
+
+# 'vector_search (0.93)'、'split (1/2, 0.93)' 等 match_type 末尾的分数
+MATCH_SCORE_PATTERN = re.compile(r'([0-9.]+)\)$')
+
+
+def split_match_type(match_type):
+    """把 'vector_search (0.93)' 拆分为 ('vector_search', 0.93)，没有分数时为 None。"""
+    base = match_type.split(' (', 1)[0]
+    score = MATCH_SCORE_PATTERN.search(match_type)
+    return base, float(score.group(1)) if score else None
+
+
+def old_filename(voice_id):
+    return "ch" + voice_id[:-1]
+
+
+def normalize_old_voice(value):
+    """查询时同时接受旧语音ID（0070070476V）和旧文件名（ch0070070476）。"""
+    return value[2:] + 'V' if value.startswith('ch') else value
+
+
+def connect(path):
+    conn = sqlite3.connect(path)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def write_results(path, game, matched_data, unmatched_data, skipped_data, candidate_log=()):
+    """
+    把一次运行的结果写入数据库，替换同一游戏之前的记录。
+
+    Args:
+        game (str): 游戏标识，用于在同一个库中区分多个游戏的结果。
+        matched_data, unmatched_data, skipped_data (list): MatchRecord / UnmatchedRecord 列表。
+        candidate_log (list): CandidateRecord 列表。
+    """
+    entry_rows = []
+    decision_rows = []
+    for record in [*skipped_data, *unmatched_data, *matched_data]:
+        new_entry = record.new_entry
+        classification = new_entry.classification or {}
+        entry_rows.append((
+            game, new_entry.id, new_entry.filename, classification.get('type'), classification.get('character_id'),
+            classification.get('category'), classification.get('number'), new_entry.text
+        ))
+        if hasattr(record, 'old_entry'):
+            old_entry = record.old_entry
+            base, score = split_match_type(record.match_type)
+            decision_rows.append((
+                game, new_entry.id, 'matched', base, record.match_type, score, old_entry.voice_id,
+                old_filename(old_entry.voice_id), old_entry.script_id, old_entry.voice_id[:3], old_entry.text, None
+            ))
+        else:
+            status = 'skipped' if record.reason is not None else 'unmatched'
+            decision_rows.append((game, new_entry.id, status, status, status, None, None, None, None, None, None, record.reason))
+
+    candidate_rows = [
+        (
+            game, candidate.new_voice_id, candidate.stage, candidate.old_entry.voice_id, old_filename(candidate.old_entry.voice_id),
+            candidate.old_entry.text, candidate.score, candidate.text_similarity, candidate.verifier, int(candidate.accepted)
+        )
+        for candidate in candidate_log
+    ]
+
+    conn = connect(path)
+    try:
+        with conn:
+            for table in ('entries', 'decisions', 'candidates'):
+                conn.execute(f'DELETE FROM {table} WHERE game = ?', (game,))
+            conn.executemany('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)', entry_rows)
+            conn.executemany('INSERT OR REPLACE INTO decisions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', decision_rows)
+            conn.executemany('INSERT INTO candidates VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', candidate_rows)
+    finally:
+        conn.close()
+
+
+DECISION_COLUMNS = (
+    'd.game, d.remake_id, e.filename, e.character_id, e.category, d.status, d.match_label, d.score, '
+    'd.old_filename, d.old_script_id, e.text, d.old_text'
+)
+
+
+def print_rows(rows):
+    if not rows:
+        print("没有结果。")
+        return
+    print('\t'.join(rows[0].keys()))
+    for row in rows:
+        print('\t'.join('' if value is None else str(value) for value in row))
+
+
+def query_list(conn, args):
+    conditions = []
+    params = []
+    if args.game:
+        conditions.append('d.game = ?')
+        params.append(args.game)
+    if args.character:
+        conditions.append('e.character_id = ?')
+        params.append(args.character)
+    if args.category:
+        conditions.append('e.category = ?')
+        params.append(args.category)
+    if args.status:
+        conditions.append('d.status = ?')
+        params.append(args.status)
+    if args.match_type:
+        conditions.append('d.match_type = ?')
+        params.append(args.match_type)
+    if args.min_score is not None:
+        conditions.append('d.score >= ?')
+        params.append(args.min_score)
+    if args.max_score is not None:
+        conditions.append('d.score < ?')
+        params.append(args.max_score)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    sql = (
+        f'SELECT {DECISION_COLUMNS} FROM decisions d JOIN entries e ON e.game = d.game AND e.remake_id = d.remake_id '
+        f'{where} ORDER BY d.game, d.remake_id LIMIT ?'
+    )
+    return conn.execute(sql, [*params, args.limit]).fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='查询匹配结果数据库。')
+    parser.add_argument('--db', default=RESULT_DB_FILE, help=f'数据库文件 (默认: {RESULT_DB_FILE})')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    subparsers.add_parser('stats', help='按游戏、状态和匹配方式统计条目数')
+
+    entry_parser = subparsers.add_parser('entry', help='查看一个重制版语音条目的决策和候选项')
+    entry_parser.add_argument('remake_id', type=int)
+    entry_parser.add_argument('--game')
+
+    old_parser = subparsers.add_parser('old', help='查看哪些重制版语音指向某个旧语音（旧语音ID或 ch 开头的旧文件名）')
+    old_parser.add_argument('old_voice')
+    old_parser.add_argument('--game')
+
+    list_parser = subparsers.add_parser('list', help='按条件列出决策')
+    list_parser.add_argument('--game')
+    list_parser.add_argument('--character', help='重制版角色ID，如 015')
+    list_parser.add_argument('--category', help='分类，如 main、battle_voice')
+    list_parser.add_argument('--status', choices=['matched', 'unmatched', 'skipped'])
+    list_parser.add_argument('--match-type', help='不含分数的匹配方式，如 exact、vector_search、locality_vector、split')
+    list_parser.add_argument('--min-score', type=float)
+    list_parser.add_argument('--max-score', type=float, help='只列出分数低于此值的决策')
+    list_parser.add_argument('--limit', type=int, default=200)
+
+    args = parser.parse_args()
+    if not os.path.exists(args.db):
+        print(f"错误：找不到数据库文件 {args.db}")
+        sys.exit(1)
+    conn = connect(args.db)
+
+    if args.command == 'stats':
+        print_rows(conn.execute(
+            'SELECT game, status, match_type, COUNT(*) AS count FROM decisions GROUP BY game, status, match_type ORDER BY game, status, count DESC'
+        ).fetchall())
+    elif args.command == 'entry':
+        game_condition = ' AND d.game = ?' if args.game else ''
+        params = [args.remake_id, *([args.game] if args.game else [])]
+        print_rows(conn.execute(
+            f'SELECT {DECISION_COLUMNS}, d.reason FROM decisions d JOIN entries e ON e.game = d.game AND e.remake_id = d.remake_id '
+            f'WHERE d.remake_id = ?{game_condition}', params
+        ).fetchall())
+        candidates = conn.execute(
+            f'SELECT game, stage, old_filename, score, text_similarity, verifier, accepted, old_text FROM candidates d '
+            f'WHERE remake_id = ?{game_condition} ORDER BY score DESC', params
+        ).fetchall()
+        if candidates:
+            print("\n候选项:")
+            print_rows(candidates)
+    elif args.command == 'old':
+        game_condition = ' AND d.game = ?' if args.game else ''
+        params = [normalize_old_voice(args.old_voice), *([args.game] if args.game else [])]
+        print_rows(conn.execute(
+            f'SELECT {DECISION_COLUMNS} FROM decisions d JOIN entries e ON e.game = d.game AND e.remake_id = d.remake_id '
+            f'WHERE d.old_voice_id = ?{game_condition} ORDER BY d.game, d.remake_id', params
+        ).fetchall())
+    elif args.command == 'list':
+        print_rows(query_list(conn, args))
+    conn.close()
+
+
+if __name__ == '__main__':
+    main()
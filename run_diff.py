@@ -0,0 +1,187 @@
+"""
+两次匹配运行的结果对比。
+
+调整阈值或修改代码后，把新的 match_result.csv 与基准结果对比：两个结果读取为以 RemakeVoiceID 为索引（哈希索引）的列式表，
+按 ID 对齐后一次向量化计算每个条目的变化：
+
+    added     新增匹配（基准中未匹配、被跳过或不存在）
+    lost      丢失匹配
+    changed   仍然匹配，但指向其他旧语音
+    retyped   旧语音不变（或都未匹配），MatchType 变化，如 exact -> locality、unmatched -> skipped
+
+MatchType 比较时忽略分数（'vector_search (0.93)' 记为 vector_search），报告各类变化的条数、MatchType 的变化方向、
+按角色和分类的分布以及每类变化的样例；所有变化的条目写入 run_diff.csv。可以同时给出多个结果，逐个与基准对比。
+
+用法：
+    uv run run_diff.py baseline/match_result.csv match_result.csv
+    uv run run_diff.py baseline.csv run_a.csv run_b.csv --samples 10 --character 001 002
+"""
+import argparse
+import sys
+
+import numpy as np
+import pandas as pd
+
+# 输出文件：所有发生变化的条目
+RUN_DIFF_CSV = 'run_diff.csv'
+
+KEY_COLUMN = 'RemakeVoiceID'
+# 对比时读取的列，其余列不解析
+COLUMNS = [
+    KEY_COLUMN, 'OldScriptId', 'OldVoiceFilename', 'MatchType',
+    'RemakeVoiceCharacterId', 'RemakeVoiceCategory', 'RemakeVoiceText', 'OldVoiceText',
+]
+CHANGES = {
+    'added': '新增匹配',
+    'lost': '丢失匹配',
+    'changed': '改为其他旧语音',
+    'retyped': 'MatchType 变化',
+}
+
+
+def match_kind(match_types):
+    """去掉 MatchType 中的分数：'locality (0.81)' -> 'locality'，'split (1/2, 0.93)' -> 'split (1/2)'。"""
+    # 不同的 MatchType 远少于行数，只对去重后的值执行正则替换
+    codes, uniques = pd.factorize(match_types)
+    kinds = pd.Index(uniques).str.replace(r' \([0-9.]+\)$', '', regex=True).str.replace(r', [0-9.]+\)$', ')', regex=True)
+    return pd.Series(kinds.to_numpy()[codes], index=match_types.index)
+
+
+def load_result(path):
+    """
+    读取 match_result.csv，返回以 RemakeVoiceID 为索引的 DataFrame，并添加 Kind（不含分数的 MatchType）和 Matched 列。
+
+    Raises:
+        FileNotFoundError, ValueError: 文件不存在或缺少所需的列。
+    """
+    table = pd.read_csv(path, usecols=COLUMNS, dtype=str, keep_default_na=False)
+    table[KEY_COLUMN] = pd.to_numeric(table[KEY_COLUMN])
+    # 同一 ID 出现多次时以最后一行为准
+    table = table.drop_duplicates(KEY_COLUMN, keep='last').set_index(KEY_COLUMN)
+    table['Kind'] = match_kind(table['MatchType'])
+    table['Matched'] = table['OldVoiceFilename'] != ''
+    return table
+
+
+def diff_results(base, new):
+    """
+    按 RemakeVoiceID 对齐两个 load_result() 的结果，计算每个条目的变化。
+
+    Returns:
+        pandas.DataFrame: 两个结果中所有 ID 的并集，列名带 _base / _new 后缀，另有 Change 列（CHANGES 的键，不变时为空字符串）
+            以及合并后的 RemakeVoiceCharacterId、RemakeVoiceCategory、RemakeVoiceText。只在一侧出现的条目，另一侧的 Kind 为 'missing'。
+    """
+    joined = base.join(new, how='outer', lsuffix='_base', rsuffix='_new')
+    for side in ('_base', '_new'):
+        missing = joined['Matched' + side].isna().to_numpy()
+        joined['Matched' + side] = joined['Matched' + side].fillna(False).astype(bool)
+        if missing.any():
+            joined.loc[missing, [column + side for column in COLUMNS[1:]]] = ''
+            joined.loc[missing, 'Kind' + side] = 'missing'
+
+    matched_base = joined['Matched_base'].to_numpy()
+    matched_new = joined['Matched_new'].to_numpy()
+    same_old = (
+        (joined['OldVoiceFilename_base'].to_numpy() == joined['OldVoiceFilename_new'].to_numpy())
+        & (joined['OldScriptId_base'].to_numpy() == joined['OldScriptId_new'].to_numpy())
+    )
+    same_kind = joined['Kind_base'].to_numpy() == joined['Kind_new'].to_numpy()
+    joined['Change'] = np.select(
+        [~matched_base & matched_new, matched_base & ~matched_new, matched_base & matched_new & ~same_old, ~same_kind],
+        list(CHANGES), default='',
+    )
+    # 分类和文本以新结果为准，条目只在基准中出现时使用基准的值
+    for column in ('RemakeVoiceCharacterId', 'RemakeVoiceCategory', 'RemakeVoiceText'):
+        joined[column] = joined[column + '_new'].where(joined[column + '_new'] != '', joined[column + '_base'])
+    return joined
+
+
+def print_report(name, base_name, base, new, joined, samples):
+    changed = joined[joined['Change'] != '']
+    counts = changed['Change'].value_counts()
+    print(f"\n=== {base_name} -> {name} ===")
+    print(f"条目: 基准 {len(base)}，对比 {len(new)}，共同 {len(base.index.intersection(new.index))}；"
+          f"匹配: 基准 {int(base['Matched'].sum())}，对比 {int(new['Matched'].sum())}")
+    print("，".join(f"{label} {counts.get(change, 0)}" for change, label in CHANGES.items()) + f"，不变 {len(joined) - len(changed)}")
+    if changed.empty:
+        return
+
+    moved = changed[changed['Kind_base'] != changed['Kind_new']]
+    if not moved.empty:
+        print("\nMatchType 变化 (基准 -> 对比: 条数):")
+        for (kind_base, kind_new), count in moved.groupby(['Kind_base', 'Kind_new']).size().sort_values(ascending=False).items():
+            print(f"  {kind_base} -> {kind_new}: {count}")
+
+    print("\n按角色和分类:")
+    by_group = pd.crosstab([changed['RemakeVoiceCharacterId'], changed['RemakeVoiceCategory']], changed['Change'])
+    by_group = by_group.reindex(columns=[change for change in CHANGES if change in by_group.columns])
+    by_group['total'] = by_group.sum(axis=1)
+    print(by_group.sort_values('total', ascending=False).to_string())
+
+    if samples > 0:
+        print("\n样例:")
+        for change, label in CHANGES.items():
+            rows = changed[changed['Change'] == change].head(samples)
+            if rows.empty:
+                continue
+            print(f"  [{label}]")
+            for remake_id, row in rows.iterrows():
+                print(f"    {remake_id} ({row['RemakeVoiceCharacterId'] or '-'} {row['RemakeVoiceCategory'] or '-'}) {row['RemakeVoiceText']}")
+                print(f"      基准: {row['MatchType_base'] or row['Kind_base']} {row['OldVoiceFilename_base']} {row['OldVoiceText_base']}".rstrip())
+                print(f"      对比: {row['MatchType_new'] or row['Kind_new']} {row['OldVoiceFilename_new']} {row['OldVoiceText_new']}".rstrip())
+
+
+def main():
+    parser = argparse.ArgumentParser(description='对比两次或多次匹配运行的 match_result.csv。')
+    parser.add_argument('base', help='基准结果 (match_result.csv)')
+    parser.add_argument('runs', nargs='+', help='与基准对比的一个或多个结果')
+    parser.add_argument('--samples', type=int, default=5, help='每类变化输出的样例数 (默认: 5)')
+    parser.add_argument('--character', nargs='+', help='只对比指定的重制版角色ID')
+    parser.add_argument('--category', nargs='+', help='只对比指定的分类，如 main、battle_voice')
+    parser.add_argument('--output', default=RUN_DIFF_CSV, help=f'写出所有变化条目的文件，多个结果时以 Run 列区分 (默认: {RUN_DIFF_CSV})')
+    args = parser.parse_args()
+
+    try:
+        base = load_result(args.base)
+        runs = [(path, load_result(path)) for path in args.runs]
+    except FileNotFoundError as e:
+        print(f"错误：找不到文件 {e.filename}")
+        sys.exit(1)
+    except ValueError as e:
+        print(f"错误：无法读取匹配结果: {e}")
+        sys.exit(1)
+
+    def select(table):
+        if args.character:
+            table = table[table['RemakeVoiceCharacterId'].isin(args.character)]
+        if args.category:
+            table = table[table['RemakeVoiceCategory'].isin(args.category)]
+        return table
+
+    base = select(base)
+    summary = []
+    diffs = []
+    for path, new in runs:
+        new = select(new)
+        joined = diff_results(base, new)
+        print_report(path, args.base, base, new, joined, args.samples)
+        changed = joined[joined['Change'] != '']
+        counts = changed['Change'].value_counts()
+        summary.append({'run': path, 'matched': int(new['Matched'].sum()), **{change: int(counts.get(change, 0)) for change in CHANGES}})
+        diffs.append(changed.assign(Run=path))
+
+    if len(runs) > 1:
+        print(f"\n=== 汇总 (基准: {args.base}，匹配 {int(base['Matched'].sum())}) ===")
+        print(pd.DataFrame(summary).set_index('run').to_string())
+
+    output_columns = [
+        'Run', 'Change', 'RemakeVoiceCharacterId', 'RemakeVoiceCategory',
+        'MatchType_base', 'MatchType_new', 'OldVoiceFilename_base', 'OldVoiceFilename_new',
+        'RemakeVoiceText', 'OldVoiceText_base', 'OldVoiceText_new',
+    ]
+    pd.concat(diffs)[output_columns].to_csv(args.output, index_label=KEY_COLUMN)
+    print(f"\n{sum(len(diff) for diff in diffs)} 条变化已保存到: {args.output}")
+
+
+if __name__ == '__main__':
+    main()
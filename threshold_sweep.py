@@ -0,0 +1,221 @@
+"""
+向量相似度阈值扫描。
+
+对所有取决于 --similarity-threshold 的向量匹配候选只打分一次：保存每个条目前 k 个候选项的上下文相似度
+和不含上下文的文本相似度，然后在缓存的分数上一次性评估一组阈值，输出匹配数、相对当前阈值发生变化的
+决策数，以及相对人工标注样本的准确率和召回率。
+
+每个阈值的决策与正常匹配的级联顺序一致：局部窗口内的向量匹配、拆分/合并对齐、全局向量匹配，
+命中用同一条复核器链复核。缓存文件记录输入文件、匹配选项和模型的指纹，指纹一致时直接在缓存上评估，
+不再编码；不一致时重新打分。
+"""
+import csv
+import json
+
+import torch
+from sentence_transformers import util
+
+from verifiers import embedding_threshold, lexical_verdict
+
+# 输出文件：打分缓存
+SWEEP_SCORES_FILE = 'threshold_sweep_scores.json'
+# 打分缓存的格式版本，打分方式变化时递增，旧缓存随之失效
+SWEEP_VERSION = 2
+# 输出文件：扫描报告
+SWEEP_REPORT_CSV = 'threshold_sweep_report.csv'
+
+
+def collect_sweep_scores(model, old_embeddings, old_script_list, sweep_entries, contextual_texts, top_k, verifier_chain=()):
+    """
+    为每个条目计算前 k 个候选项的上下文相似度和文本相似度。
+
+    Args:
+        model: SentenceTransformer 模型。
+        old_embeddings (torch.Tensor): 旧脚本上下文向量矩阵。
+        old_script_list (list): 旧脚本条目，与向量矩阵的行一一对应。
+        sweep_entries (list): (新条目, scope, rows) 元组。scope 为 'window' 时只在 rows 指定的向量行中检索
+            （rows 为空时没有候选项），为 'global' 时 rows 为 None，在整个旧脚本列表中检索。
+        contextual_texts (list): 与 sweep_entries 对应的带上下文查询文本。
+        top_k (int): 每个条目保存的候选项数量。
+        verifier_chain (list): 复核器链。字面复核器的结论与相似度阈值无关，随分数一起保存。
+
+    Returns:
+        list: 可直接写入缓存文件的字典列表，每个条目的 hits 按上下文相似度降序排列。
+    """
+    if not sweep_entries:
+        return []
+    query_embeddings = model.encode(contextual_texts, convert_to_tensor=True)
+    bare_query_embeddings = model.encode([entry.text for entry, _, _ in sweep_entries], convert_to_tensor=True)
+    old_embeddings = old_embeddings.to(query_embeddings.device)
+
+    ranked = [None] * len(sweep_entries)
+    global_indices = [i for i, (_, scope, _) in enumerate(sweep_entries) if scope == 'global']
+    if global_indices:
+        # 全局检索批量执行
+        hits = util.semantic_search(query_embeddings[global_indices], old_embeddings, top_k=top_k)
+        for i, query_hits in zip(global_indices, hits):
+            ranked[i] = [(old_script_list[hit['corpus_id']], hit['score']) for hit in query_hits]
+    for i, (_, scope, rows) in enumerate(sweep_entries):
+        if scope == 'global':
+            continue
+        if not rows:
+            ranked[i] = []
+            continue
+        scores = util.cos_sim(query_embeddings[i], old_embeddings[rows])[0]
+        top_scores, top_idx = torch.topk(scores, min(top_k, len(rows)))
+        ranked[i] = [(old_script_list[rows[j]], score) for j, score in zip(top_idx.tolist(), top_scores.tolist())]
+
+    # 所有候选文本只编码一次
+    candidate_texts = sorted({old_entry.text for hits in ranked for old_entry, _ in hits})
+    candidate_index = {text: i for i, text in enumerate(candidate_texts)}
+    candidate_embeddings = model.encode(candidate_texts, convert_to_tensor=True)
+
+    results = []
+    for (new_entry, scope, _), bare_query_embedding, hits in zip(sweep_entries, bare_query_embeddings, ranked):
+        rows = [candidate_index[old_entry.text] for old_entry, _ in hits]
+        text_similarities = util.cos_sim(bare_query_embedding, candidate_embeddings[rows])[0].tolist() if rows else []
+        results.append({
+            'new_voice_id': new_entry.id,
+            'scope': scope,
+            'hits': [
+                {
+                    'old_voice_id': old_entry.voice_id,
+                    'old_script_id': old_entry.script_id,
+                    'score': score,
+                    'text_similarity': text_similarity,
+                    'lexical': lexical_verdict(
+                        verifier_chain, new_entry.normalized or new_entry.text, old_entry.normalized or old_entry.text
+                    )[0],
+                }
+                for (old_entry, score), text_similarity in zip(hits, text_similarities)
+            ]
+        })
+    return results
+
+
+def save_sweep_scores(path, scores, top_k, baseline_threshold, fingerprint):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({
+            'version': SWEEP_VERSION, 'fingerprint': fingerprint,
+            'top_k': top_k, 'baseline_threshold': baseline_threshold, 'entries': scores,
+        }, f, ensure_ascii=False, indent=4)
+
+
+def load_sweep_scores(path, fingerprint):
+    """读取打分缓存。文件不存在、无法读取或指纹（输入文件、匹配选项、模型）不一致时返回 None。"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if not isinstance(data, dict) or data.get('version') != SWEEP_VERSION or data.get('fingerprint') != fingerprint:
+        return None
+    return data['entries']
+
+
+def load_labels(path):
+    """
+    读取人工标注样本，格式与 match_result.csv 相同，只使用 RemakeVoiceID 和 OldVoiceFilename 两列。
+
+    OldVoiceFilename 为空表示该条目不应被匹配。
+
+    Returns:
+        dict: RemakeVoiceID -> 期望的旧语音ID（如 '0070070476V'），不应匹配时为 None。
+    """
+    labels = {}
+    with open(path, 'r', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            old_filename = (row.get('OldVoiceFilename') or '').strip()
+            labels[int(row['RemakeVoiceID'])] = old_filename[2:] + 'V' if old_filename else None
+    return labels
+
+
+def decide_all(scores, threshold, verifier_chain=(), split_merge=None):
+    """
+    按级联的顺序（局部窗口搜索、拆分/合并对齐、第三遍），判断每个条目在给定阈值下匹配到哪个旧语音ID。
+
+    局部窗口内已被前面条目占用的旧语音不能再次使用，因此 'window' 条目按缓存中的顺序依次决策，
+    取第一个未被占用的候选项；前 k 个候选项都被占用时视为未匹配。之后仍未匹配的条目交给 split_merge 对齐，
+    剩余的 'global' 条目与第三遍一样不排除已使用的旧语音。
+    字面复核器已下结论的候选项直接采用其结论，否则与复核器链一样用文本相似度与 embedding 复核器的阈值
+    （未设置时为相似度阈值）比较。
+
+    Args:
+        verifier_chain (list): 复核器链（VerifierSpec 列表）。
+        split_merge (callable, optional): 局部窗口的匹配结果 {new_voice_id: 旧语音ID} -> 拆分/合并对齐成功的
+            {new_voice_id: 旧语音ID}。未设置时不模拟拆分/合并对齐（--no-split-merge）。
+
+    Returns:
+        dict: new_voice_id -> 旧语音ID，未匹配时为 None。
+    """
+    accept = embedding_threshold(verifier_chain, threshold)
+
+    def decide(hits):
+        if not hits:
+            return None
+        best = hits[0]
+        lexical = best.get('lexical')
+        verified = lexical if lexical is not None else best['text_similarity'] >= accept
+        return best['old_voice_id'] if best['score'] > threshold and verified else None
+
+    decisions = {}
+    used_old_voice_ids = set()
+    for entry in scores:
+        if entry['scope'] != 'window':
+            continue
+        old_voice_id = decide([hit for hit in entry['hits'] if hit['old_voice_id'] not in used_old_voice_ids])
+        decisions[entry['new_voice_id']] = old_voice_id
+        if old_voice_id is not None:
+            used_old_voice_ids.add(old_voice_id)
+
+    if split_merge is not None:
+        window_matches = {new_voice_id: old_voice_id for new_voice_id, old_voice_id in decisions.items() if old_voice_id is not None}
+        decisions.update(split_merge(window_matches))
+
+    for entry in scores:
+        if entry['scope'] == 'global' and decisions.get(entry['new_voice_id']) is None:
+            decisions[entry['new_voice_id']] = decide(entry['hits'])
+    return decisions
+
+
+def evaluate_thresholds(scores, thresholds, baseline_threshold, labels=None, verifier_chain=(), split_merge=None):
+    """
+    在缓存的分数上评估一组阈值。verifier_chain 和 split_merge 见 decide_all。
+
+    Returns:
+        list: 每个阈值一行的字典，包含匹配数、相对基准阈值变化的决策数、标注样本上的准确率和召回率，
+              以及前 k 个候选项中包含正确答案的标注条目数（与阈值无关，用于判断提高 top_k 是否有意义）。
+    """
+    labels = labels or {}
+    baseline = decide_all(scores, baseline_threshold, verifier_chain, split_merge)
+    labelled = [entry for entry in scores if entry['new_voice_id'] in labels]
+    expected_matches = sum(1 for entry in labelled if labels[entry['new_voice_id']] is not None)
+    in_top_k = sum(
+        1 for entry in labelled
+        if labels[entry['new_voice_id']] is not None
+        and any(hit['old_voice_id'] == labels[entry['new_voice_id']] for hit in entry['hits'])
+    )
+
+    report = []
+    for threshold in sorted(thresholds):
+        decisions = decide_all(scores, threshold, verifier_chain, split_merge)
+        labelled_matched = [new_id for new_id, old_id in decisions.items() if new_id in labels and old_id is not None]
+        correct = sum(1 for new_id in labelled_matched if decisions[new_id] == labels[new_id])
+        report.append({
+            'Threshold': threshold,
+            'Matched': sum(1 for old_id in decisions.values() if old_id is not None),
+            'ChangedVsBaseline': sum(1 for new_id, old_id in decisions.items() if old_id != baseline.get(new_id)),
+            'LabelledMatched': len(labelled_matched),
+            'Correct': correct,
+            'Precision': correct / len(labelled_matched) if labelled_matched else None,
+            'Recall': correct / expected_matches if expected_matches else None,
+            'LabelledInTopK': in_top_k,
+        })
+    return report
+
+
+def write_sweep_report(path, report):
+    with open(path, 'w', encoding='utf-8', newline='\n') as f:
+        writer = csv.DictWriter(f, fieldnames=['Threshold', 'Matched', 'ChangedVsBaseline', 'LabelledMatched', 'Correct', 'Precision', 'Recall', 'LabelledInTopK'])
+        writer.writeheader()
+        writer.writerows(report)
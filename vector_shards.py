@@ -0,0 +1,188 @@
+"""
+向量相似度匹配的批量与多进程分片执行。
+
+旧脚本的上下文向量矩阵只在主进程中创建一次，并复制到一块共享内存中；
+各工作进程通过名称挂载这块内存并直接在其上构造张量（零拷贝），只对分配到的查询条目进行编码和检索。
+各分片的结果按查询下标合并，因此输出与工作进程的完成顺序无关。
+ShardedScorer 在多次检索之间保留共享内存和进程池，按检查点分块检索时工作进程只启动（加载模型）一次。
+
+本模块不导入 match_voices，避免工作进程（Windows 上为 spawn 方式启动）重复执行其日志初始化。
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import torch
+from sentence_transformers import util
+
+from model_artifact import load_model
+
+# 工作进程内的全局状态，由 _init_worker 填充
+_worker_state = {}
+
+
+class SharedEmbeddingMatrix:
+    """把向量矩阵复制到一块具名共享内存中，供工作进程零拷贝挂载。"""
+
+    def __init__(self, embeddings):
+        if isinstance(embeddings, torch.Tensor):
+            embeddings = embeddings.detach().cpu().numpy()
+        array = np.ascontiguousarray(embeddings, dtype=np.float32)
+        self.shape = array.shape
+        self.dtype = array.dtype.str
+        self._shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(self.shape, dtype=array.dtype, buffer=self._shm.buf)[...] = array
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    def close(self):
+        """关闭并释放共享内存。"""
+        self._shm.close()
+        self._shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def score_queries(model, old_embeddings, old_texts, contextual_texts, bare_texts, threshold, verify=True, top_k=1):
+    """
+    批量检索每个查询的最佳旧脚本条目，并对超过阈值的命中计算不含上下文的文本相似度。
+
+    Args:
+        model: SentenceTransformer 模型。
+        old_embeddings (torch.Tensor): 旧脚本上下文向量矩阵。
+        old_texts (list): 旧脚本文本，与向量矩阵的行一一对应。
+        contextual_texts (list): 带上下文的查询文本。
+        bare_texts (list): 不含上下文的查询文本。
+        threshold (float): 上下文相似度阈值，低于此值的命中不再复核。
+        verify (bool): 为 False 时只检索不复核，由调用方自行复核。
+        top_k (int): 大于 1 时每个结果另外附带前 top_k 个命中，供调用方重新排序。
+
+    Returns:
+        list: 每个查询对应一个 (corpus_id, score, text_similarity) 元组；没有命中时为 None，
+              未复核时 text_similarity 为 None。top_k 大于 1 时元组的第四项为 [(corpus_id, score), ...]。
+    """
+    if not contextual_texts:
+        return []
+    query_embeddings = model.encode(contextual_texts, convert_to_tensor=True)
+    hits = util.semantic_search(query_embeddings, old_embeddings.to(query_embeddings.device), top_k=top_k)
+
+    results = [None] * len(contextual_texts)
+    to_verify = []
+    for i, query_hits in enumerate(hits):
+        if not query_hits:
+            continue
+        corpus_id, score = query_hits[0]['corpus_id'], query_hits[0]['score']
+        results[i] = (corpus_id, score, None)
+        if top_k > 1:
+            results[i] += ([(hit['corpus_id'], hit['score']) for hit in query_hits],)
+        if score > threshold:
+            to_verify.append(i)
+
+    if verify and to_verify:
+        bare_embeddings = model.encode([bare_texts[i] for i in to_verify], convert_to_tensor=True)
+        candidate_embeddings = model.encode([old_texts[results[i][0]] for i in to_verify], convert_to_tensor=True)
+        similarities = torch.nn.functional.cosine_similarity(bare_embeddings, candidate_embeddings).tolist()
+        for i, text_similarity in zip(to_verify, similarities):
+            results[i] = (*results[i][:2], text_similarity, *results[i][3:])
+    return results
+
+
+def _init_worker(shm_name, shape, dtype, model_dir, old_texts, threads):
+    """工作进程初始化：挂载共享内存中的向量矩阵并加载模型。"""
+    torch.set_num_threads(threads)
+    shm = shared_memory.SharedMemory(name=shm_name)
+    matrix = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+    # 必须持有 shm 的引用，否则其缓冲区会在函数返回后被释放
+    _worker_state['shm'] = shm
+    _worker_state['embeddings'] = torch.from_numpy(matrix)
+    _worker_state['model'] = load_model(model_dir)
+    # 只在工作进程内复核时才需要旧脚本文本，否则为 None
+    _worker_state['old_texts'] = old_texts
+
+
+def _score_shard(shard):
+    start, contextual_texts, bare_texts, threshold, verify, top_k = shard
+    results = score_queries(
+        _worker_state['model'], _worker_state['embeddings'], _worker_state['old_texts'],
+        contextual_texts, bare_texts, threshold, verify, top_k
+    )
+    return start, results
+
+
+class ShardedScorer:
+    """
+    多进程分片检索：旧脚本向量矩阵放在共享内存中，进程池在第一次检索时启动，之后的检索复用同一批工作进程。
+
+    用完后调用 close（或作为上下文管理器使用）关闭进程池并释放共享内存。
+    old_texts 只在工作进程内复核（verify=True）时使用；只做检索时传入 None，避免复制到每个工作进程。
+    """
+
+    def __init__(self, old_embeddings, old_texts, model_dir, workers):
+        self.old_embeddings = old_embeddings
+        self.old_texts = old_texts
+        self.model_dir = model_dir
+        self.workers = max(1, workers)
+        self._matrix = None
+        self._executor = None
+
+    def _start(self):
+        self._matrix = SharedEmbeddingMatrix(self.old_embeddings)
+        threads = max(1, (os.cpu_count() or 1) // self.workers)
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            initializer=_init_worker,
+            initargs=(self._matrix.name, self._matrix.shape, self._matrix.dtype, self.model_dir, self.old_texts, threads),
+        )
+
+    def score(self, contextual_texts, bare_texts, threshold, verify=True, top_k=1):
+        """
+        将查询拆分为连续分片，交给工作进程并行执行 score_queries。
+
+        各分片结果按起始下标合并，返回值与单进程执行 score_queries 的结果顺序一致。
+        """
+        if not contextual_texts:
+            return []
+        if verify and self.old_texts is None:
+            raise ValueError("复核需要旧脚本文本，创建 ShardedScorer 时未提供 old_texts。")
+        if self._executor is None:
+            self._start()
+        shard_size = -(-len(contextual_texts) // min(self.workers, len(contextual_texts)))
+        shards = [
+            (start, contextual_texts[start:start + shard_size], bare_texts[start:start + shard_size], threshold, verify, top_k)
+            for start in range(0, len(contextual_texts), shard_size)
+        ]
+        results = [None] * len(contextual_texts)
+        for start, shard_results in self._executor.map(_score_shard, shards):
+            results[start:start + len(shard_results)] = shard_results
+        return results
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        if self._matrix is not None:
+            self._matrix.close()
+            self._matrix = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def score_queries_sharded(old_embeddings, old_texts, contextual_texts, bare_texts, threshold, model_dir, workers, verify=True, top_k=1):
+    """
+    将查询拆分为连续分片，交给多个工作进程并行执行 score_queries。只检索一次时使用；多次检索时使用 ShardedScorer 复用进程池。
+    """
+    if not contextual_texts:
+        return []
+    with ShardedScorer(old_embeddings, old_texts if verify else None, model_dir, min(workers, len(contextual_texts))) as scorer:
+        return scorer.score(contextual_texts, bare_texts, threshold, verify, top_k)
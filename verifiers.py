@@ -0,0 +1,161 @@
+"""
+向量检索命中后的复核器链。
+
+向量检索用带上下文的文本找到最相似的旧台词后，需要再确认台词本身是否相近。复核器按顺序执行：
+前面的字面复核器（编辑距离、n-gram）直接在预计算的标准化文本上计算，耗时为微秒级；
+只有所有字面复核器都无法下结论时，才用不含上下文的文本向量计算余弦相似度。
+
+每个复核器写作 'name[:accept[:reject]]'：相似度不低于 accept 时直接通过，低于 reject 时直接拒绝，
+介于两者之间（或未设置 reject）时交给下一个复核器。'embedding' 的 accept 省略时使用 --similarity-threshold。
+"""
+import argparse
+from collections import Counter
+from dataclasses import dataclass
+
+from sentence_transformers import util
+
+# 默认复核器链
+DEFAULT_VERIFIER_CHAIN = ('edit:0.9', 'ngram:0.85', 'embedding')
+
+
+def edit_distance(a, b):
+    """用位并行算法（Myers / Hyyrö）计算两个字符串的编辑距离，每个字符只需常数次整数位运算。"""
+    if len(a) < len(b):
+        a, b = b, a
+    if not b:
+        return len(a)
+    m = len(a)
+    full = (1 << m) - 1
+    last = 1 << (m - 1)
+    peq = {}
+    for i, char in enumerate(a):
+        peq[char] = peq.get(char, 0) | (1 << i)
+
+    pv, mv, score = full, 0, m
+    for char in b:
+        eq = peq.get(char, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = (mv | ~(xh | pv)) & full
+        mh = pv & xh
+        if ph & last:
+            score += 1
+        elif mh & last:
+            score -= 1
+        ph = ((ph << 1) | 1) & full
+        mh = (mh << 1) & full
+        pv = (mh | ~(xv | ph)) & full
+        mv = ph & xv
+    return score
+
+
+def edit_similarity(a, b):
+    """1 - 编辑距离 / 较长字符串的长度。"""
+    if not a and not b:
+        return 1.0
+    return 1.0 - edit_distance(a, b) / max(len(a), len(b))
+
+
+def ngram_similarity(a, b, n=2):
+    """字符 n-gram 多重集合的 Dice 系数。字符串短于 n 时按整个字符串比较。"""
+    def grams(text):
+        if len(text) < n:
+            return Counter([text]) if text else Counter()
+        return Counter(text[i:i + n] for i in range(len(text) - n + 1))
+
+    a_grams, b_grams = grams(a), grams(b)
+    total = sum(a_grams.values()) + sum(b_grams.values())
+    if total == 0:
+        return 1.0
+    return 2.0 * sum((a_grams & b_grams).values()) / total
+
+
+LEXICAL_VERIFIERS = {
+    'edit': edit_similarity,
+    'ngram': ngram_similarity,
+}
+
+
+@dataclass(frozen=True, slots=True)
+class VerifierSpec:
+    name: str
+    accept: float = None
+    reject: float = None
+
+
+def parse_verifier(spec):
+    """解析 'name[:accept[:reject]]'，供 argparse 使用。"""
+    name, *thresholds = spec.split(':')
+    if name != 'embedding' and name not in LEXICAL_VERIFIERS:
+        raise argparse.ArgumentTypeError(f"未知的复核器 '{name}'，可选: {', '.join([*LEXICAL_VERIFIERS, 'embedding'])}")
+    if len(thresholds) > 2:
+        raise argparse.ArgumentTypeError(f"复核器格式应为 name[:accept[:reject]]: '{spec}'")
+    try:
+        values = [float(value) if value else None for value in thresholds]
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"复核器阈值必须是数字: '{spec}'")
+    values += [None] * (2 - len(values))
+    if name != 'embedding' and values[0] is None:
+        raise argparse.ArgumentTypeError(f"字面复核器必须设置 accept 阈值: '{spec}'")
+    return VerifierSpec(name, *values)
+
+
+def lexical_verdict(chain, new_normalized, old_normalized):
+    """
+    按顺序执行链中的字面复核器。
+
+    Returns:
+        tuple: (verdict, similarity, verifier)。verdict 为 True/False 表示已下结论，
+               为 None 表示需要交给 embedding 复核器；链中没有 embedding 时无法下结论即视为拒绝。
+    """
+    for spec in chain:
+        if spec.name == 'embedding':
+            return None, None, spec.name
+        similarity = LEXICAL_VERIFIERS[spec.name](new_normalized, old_normalized)
+        if similarity >= spec.accept:
+            return True, similarity, spec.name
+        if spec.reject is not None and similarity < spec.reject:
+            return False, similarity, spec.name
+    return False, None, None
+
+
+def embedding_threshold(chain, default):
+    for spec in chain:
+        if spec.name == 'embedding':
+            return spec.accept if spec.accept is not None else default
+    return default
+
+
+def verify_pairs(chain, pairs, embed, default_threshold):
+    """
+    批量复核 (新条目, 旧条目) 对。
+
+    Args:
+        chain (list): VerifierSpec 列表。
+        pairs (list): (新条目, 旧条目) 列表，条目需有 text 和 normalized 属性。
+        embed (callable): 文本列表 -> 向量张量，只对字面复核无法下结论的文本调用。
+        default_threshold (float): embedding 复核器未设置阈值时使用的阈值。
+
+    Returns:
+        list: 与 pairs 一一对应的 (是否通过, 相似度, 复核器名称)。
+    """
+    results = []
+    pending = []
+    for i, (new_entry, old_entry) in enumerate(pairs):
+        verdict, similarity, verifier = lexical_verdict(
+            chain, new_entry.normalized or new_entry.text, old_entry.normalized or old_entry.text
+        )
+        results.append((bool(verdict), similarity, verifier))
+        if verdict is None:
+            pending.append(i)
+
+    if pending:
+        threshold = embedding_threshold(chain, default_threshold)
+        texts = list(dict.fromkeys(text for i in pending for text in (pairs[i][0].text, pairs[i][1].text)))
+        embeddings = embed(texts)
+        rows = {text: row for row, text in enumerate(texts)}
+        for i in pending:
+            new_entry, old_entry = pairs[i]
+            similarity = util.cos_sim(embeddings[rows[new_entry.text]], embeddings[rows[old_entry.text]])[0][0].item()
+            results[i] = (similarity >= threshold, similarity, 'embedding')
+    return results
@@ -0,0 +1,201 @@
+"""
+语音时长：从 WAV 文件头批量读取重制版语音和 Evo 语音的时长，用作候选项的排序依据。
+
+同一句台词的新旧录音时长大致成比例。匹配时以已匹配条目的时长比例中位数作为基准比例，
+候选项的时长惩罚为 |log(新时长 / (旧时长 × 基准比例))|。分数相近（在 --duration-margin 之内）的候选项中
+选择惩罚最小的一个，用于区分重复的台词（如多句“……”），不需要额外的模型推理。
+匹配完成后，时长比例偏离基准超过 --duration-flag-ratio 倍的匹配结果写入 duration_flags.csv 供人工检查。
+
+时长只读取文件头，由线程池并行读取，并按 (文件大小, 修改时间) 缓存在 wav_durations.json 中。
+"""
+import csv
+import json
+import math
+import os
+import statistics
+import wave
+from concurrent.futures import ThreadPoolExecutor
+
+from checkpoints import write_json_atomic
+
+# 重制版解包后的语音目录（与 analyze_voice_files.py 相同）
+REMAKE_VOICE_WAV_DIR = os.path.join('kuro_mdl_tool', 'misc', 'voice', 'wav')
+# 转换后的 Evo 语音目录（convert_voice.ps1 的输出）
+OLD_VOICE_WAV_DIR = os.path.join('voice', 'wav')
+# 缓存文件：WAV 时长
+DURATION_CACHE_FILE = 'wav_durations.json'
+# 输出文件：时长明显不一致的匹配结果
+DURATION_FLAGS_CSV = 'duration_flags.csv'
+# 估计基准比例所需的最少样本数，不足时基准比例为 1
+MIN_SCALE_SAMPLES = 20
+
+
+def wav_duration(path):
+    """只读取文件头计算时长（秒），无法读取时为 None。"""
+    try:
+        with wave.open(path, 'rb') as wav_file:
+            rate = wav_file.getframerate()
+            return wav_file.getnframes() / rate if rate else None
+    except (OSError, EOFError, wave.Error):
+        return None
+
+
+def scan_wav_dir(directory):
+    """目录（含子目录）中的 WAV 文件：文件名（不含扩展名）-> 路径。"""
+    found = {}
+    for root, _, files in os.walk(directory):
+        for name in files:
+            stem, ext = os.path.splitext(name)
+            if ext.lower() == '.wav':
+                found.setdefault(stem, os.path.join(root, name))
+    return found
+
+
+class DurationCache:
+    """
+    WAV 时长缓存：路径 -> [文件大小, 修改时间, 时长]。文件大小或修改时间变化时重新读取。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._entries = {}
+        self._dirty = False
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self._entries = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+
+    def durations(self, paths, workers=16):
+        """返回 路径 -> 时长 的字典，缓存中没有或已过期的文件并行读取文件头。"""
+        paths = list(paths)
+
+        def stat(path):
+            try:
+                st = os.stat(path)
+                return [st.st_size, st.st_mtime_ns]
+            except OSError:
+                return None
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            keys = list(executor.map(stat, paths))
+            stale = [
+                (path, key) for path, key in zip(paths, keys)
+                if key is not None and self._entries.get(path, [None, None])[:2] != key
+            ]
+            for (path, key), duration in zip(stale, executor.map(wav_duration, [path for path, _ in stale])):
+                self._entries[path] = [*key, duration]
+        if stale:
+            self._dirty = True
+        return {path: self._entries[path][2] for path, key in zip(paths, keys) if key is not None}
+
+    def save(self):
+        if self._dirty:
+            write_json_atomic(self.path, self._entries)
+            self._dirty = False
+
+
+class DurationIndex:
+    """
+    新旧条目的语音时长。
+
+    Args:
+        new_durations (dict): 新语音ID -> 时长。
+        old_durations (dict): 旧语音 voice_id -> 时长。
+    """
+
+    def __init__(self, new_durations, old_durations):
+        self.new_durations = new_durations
+        self.old_durations = old_durations
+
+    def ratio(self, new_entry, old_entry):
+        new_duration = self.new_durations.get(new_entry.id)
+        old_duration = self.old_durations.get(old_entry.voice_id)
+        if not new_duration or not old_duration:
+            return None
+        return new_duration / old_duration
+
+    def estimate_scale(self, pairs):
+        """已匹配的 (新条目, 旧条目) 的时长比例中位数。样本不足时为 1。返回 (基准比例, 样本数)。"""
+        ratios = [r for new_entry, old_entry in pairs if (r := self.ratio(new_entry, old_entry)) is not None]
+        if len(ratios) < MIN_SCALE_SAMPLES:
+            return 1.0, len(ratios)
+        return statistics.median(ratios), len(ratios)
+
+    def penalty(self, scale):
+        """返回时长惩罚函数 (新条目, 旧条目) -> |log(比例 / 基准比例)|，时长未知时为 None。"""
+        def penalty(new_entry, old_entry):
+            ratio = self.ratio(new_entry, old_entry)
+            return None if ratio is None else abs(math.log(ratio / scale))
+        return penalty
+
+
+def pick_by_duration(new_entry, scored, margin, penalty):
+    """
+    在分数与最高分相差不超过 margin 的候选项中选择时长惩罚最小的一个。
+
+    Args:
+        scored (list): (旧条目, 分数, ...) 元组列表。
+        penalty (callable): DurationIndex.penalty() 返回的函数。
+
+    Returns:
+        tuple: 选中的元组。时长都未知时为分数最高（同分时靠前）的一个。
+    """
+    best = max(scored, key=lambda item: item[1])
+    tied = [item for item in scored if item[1] >= best[1] - margin]
+    if len(tied) < 2:
+        return best
+    penalties = [penalty(new_entry, item[0]) for item in tied]
+    if all(p is None for p in penalties):
+        return best
+    # 时长未知的候选项排在已知的之后，惩罚相同时保持原有顺序
+    return min(zip(tied, penalties), key=lambda pair: (pair[1] is None, pair[1] or 0.0, -pair[0][1]))[0]
+
+
+def flag_duration_outliers(matched_data, index, scale, flag_ratio):
+    """返回时长比例偏离基准超过 flag_ratio 倍的匹配结果：(记录, 新时长, 旧时长, 相对比例) 列表。"""
+    limit = math.log(flag_ratio)
+    flags = []
+    for record in matched_data:
+        ratio = index.ratio(record.new_entry, record.old_entry)
+        if ratio is not None and abs(math.log(ratio / scale)) > limit:
+            flags.append((
+                record, index.new_durations[record.new_entry.id],
+                index.old_durations[record.old_entry.voice_id], ratio / scale,
+            ))
+    return flags
+
+
+def write_duration_flags(path, flags):
+    with open(path, 'w', encoding='utf-8', newline='\n') as f:
+        writer = csv.writer(f)
+        writer.writerow(['RemakeVoiceID', 'RemakeVoiceFilename', 'OldVoiceFilename', 'MatchType', 'RemakeDuration', 'OldDuration', 'RelativeRatio', 'RemakeVoiceText', 'OldVoiceText'])
+        for record, new_duration, old_duration, relative in flags:
+            writer.writerow([
+                record.new_entry.id, record.new_entry.filename, "ch" + record.old_entry.voice_id[:-1], record.match_type,
+                f"{new_duration:.3f}", f"{old_duration:.3f}", f"{relative:.2f}", record.new_entry.text, record.old_entry.text,
+            ])
+
+
+def build_duration_index(new_entries, old_entries, remake_dir, old_dir, cache_path, workers=16):
+    """
+    读取新旧条目对应的 WAV 时长。
+
+    重制版语音为 <remake_dir>/<filename>.wav，Evo 语音为 <old_dir>/ch<voice_id 去掉末位>.wav，均可位于子目录中。
+    """
+    remake_files = scan_wav_dir(remake_dir)
+    old_files = scan_wav_dir(old_dir)
+    new_paths = {entry.id: remake_files[entry.filename] for entry in new_entries if entry.filename in remake_files}
+    old_paths = {}
+    for entry in old_entries:
+        stem = "ch" + entry.voice_id[:-1]
+        if stem in old_files:
+            old_paths.setdefault(entry.voice_id, old_files[stem])
+
+    cache = DurationCache(cache_path)
+    durations = cache.durations(sorted(set(new_paths.values()) | set(old_paths.values())), workers)
+    cache.save()
+    return DurationIndex(
+        {entry_id: durations[path] for entry_id, path in new_paths.items() if durations.get(path)},
+        {voice_id: durations[path] for voice_id, path in old_paths.items() if durations.get(path)},
+    )
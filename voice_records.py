@@ -0,0 +1,266 @@
+"""
+语音条目的紧凑记录模型，供提取、匹配等各阶段共用。
+
+所有文本（台词本身以及作为上下文出现的前后句）都收录在同一个 TextTable 中，
+记录只保存文本在表中的下标，因此同一句台词无论出现多少次都只在内存中保存一份。
+记录类使用 __slots__，不再为每个条目分配一个字典。
+"""
+from dataclasses import dataclass, field, replace
+
+
+class TextTable:
+    """文本驻留表：相同的文本只保存一次，通过整数下标引用。下标 0 固定为空字符串。"""
+    __slots__ = ('_texts', '_index')
+
+    def __init__(self):
+        self._texts = ['']
+        self._index = {'': 0}
+
+    @classmethod
+    def from_texts(cls, texts):
+        """由已驻留的文本列表（下标 0 为空字符串、没有重复）创建文本表，如 corpus_index 保存的文本。"""
+        table = cls()
+        table._texts = list(texts)
+        table._index = {text: i for i, text in enumerate(table._texts)}
+        return table
+
+    def intern(self, text):
+        """返回文本在表中的下标，文本不存在时先加入表中。"""
+        if not text:
+            return 0
+        index = self._index.get(text)
+        if index is None:
+            index = len(self._texts)
+            self._texts.append(text)
+            self._index[text] = index
+        return index
+
+    def __getitem__(self, index):
+        return self._texts[index]
+
+    def __len__(self):
+        return len(self._texts)
+
+
+def parse_scene(voice_id):
+    """
+    从旧语音ID（如 '0070070476V'）中解析场景ID、场景内序号和全局场景顺序。
+
+    格式不符时返回 ('', -1, -1)。全局场景顺序即 voice_id[3:10] 对应的整数，用于在场景之间排序和推算位置。
+    """
+    if isinstance(voice_id, str) and len(voice_id) >= 10:
+        return voice_id[3:6], int(voice_id[6:10]), int(voice_id[3:10])
+    return '', -1, -1
+
+
+@dataclass(slots=True)
+class OldVoiceEntry:
+    """旧版脚本中的一条语音台词。"""
+    table: TextTable = field(repr=False, compare=False)
+    character_id: str
+    voice_id: str
+    script_id: int
+    text_id: int
+    source_file: str
+    prev_id: int = 0
+    next_id: int = 0
+    scene_id: str = ''
+    scene_seq_id: int = -1
+    scene_order: int = -1
+    normalized_id: int = 0
+
+    def __post_init__(self):
+        self.scene_id, self.scene_seq_id, self.scene_order = parse_scene(self.voice_id)
+
+    @property
+    def text(self):
+        return self.table[self.text_id]
+
+    @property
+    def normalized(self):
+        return self.table[self.normalized_id]
+
+    @property
+    def context_prev(self):
+        return self.table[self.prev_id]
+
+    @property
+    def context_next(self):
+        return self.table[self.next_id]
+
+    def with_context(self, prev_id, next_id):
+        """返回一个共享同一文本表、但上下文不同的副本。"""
+        return replace(self, prev_id=prev_id, next_id=next_id)
+
+    @classmethod
+    def from_dict(cls, data, table):
+        return cls(
+            table,
+            data.get('character_id'),
+            data.get('voice_id', ''),
+            data.get('script_id', -1),
+            table.intern(data.get('text', '')),
+            data.get('source_file'),
+            table.intern(data.get('context_prev', '')),
+            table.intern(data.get('context_next', '')),
+        )
+
+    def to_dict(self):
+        """转换为 voice_data.json / script_data.json 中的条目格式。"""
+        return {
+            'character_id': self.character_id,
+            'voice_id': self.voice_id,
+            'script_id': self.script_id,
+            'text': self.text,
+            'source_file': self.source_file,
+            'context_prev': self.context_prev,
+            'context_next': self.context_next,
+        }
+
+
+@dataclass(slots=True)
+class RemakeVoiceEntry:
+    """重制版 t_voice 表中的一条语音。"""
+    table: TextTable = field(repr=False, compare=False)
+    id: int
+    filename: str
+    text_id: int
+    prev_id: int = 0
+    next_id: int = 0
+    normalized_id: int = 0
+    classification: dict = None
+
+    @property
+    def text(self):
+        return self.table[self.text_id]
+
+    @property
+    def normalized(self):
+        return self.table[self.normalized_id]
+
+    @property
+    def context_prev(self):
+        return self.table[self.prev_id]
+
+    @property
+    def context_next(self):
+        return self.table[self.next_id]
+
+    @property
+    def character_id(self):
+        return self.classification.get('character_id') if self.classification else None
+
+    @classmethod
+    def from_dict(cls, data, table):
+        return cls(table, data.get('id'), data.get('filename'), table.intern(data.get('text', '')))
+
+
+def link_context(entries, same_group=None):
+    """
+    按列表顺序为每个条目设置前后句上下文下标。
+
+    Args:
+        entries (list): 已排好序的记录列表。
+        same_group (callable, optional): 判断两个相邻条目是否属于同一组（如同一场景），
+            不属于同一组时对应的上下文为空。
+    """
+    for i, entry in enumerate(entries):
+        prev_entry = entries[i - 1] if i > 0 else None
+        next_entry = entries[i + 1] if i < len(entries) - 1 else None
+        if same_group is not None:
+            if prev_entry is not None and not same_group(prev_entry, entry):
+                prev_entry = None
+            if next_entry is not None and not same_group(entry, next_entry):
+                next_entry = None
+        entry.prev_id = prev_entry.text_id if prev_entry is not None else 0
+        entry.next_id = next_entry.text_id if next_entry is not None else 0
+
+
+@dataclass(slots=True)
+class MatchRecord:
+    """一条成功匹配的结果，直接引用新旧条目而不复制其字段。"""
+    new_entry: RemakeVoiceEntry
+    old_entry: OldVoiceEntry
+    match_type: str
+
+    def to_dict(self):
+        """转换为 merged_voice_data.json 中的条目格式。"""
+        return {
+            'new_voice_id': self.new_entry.id,
+            'new_filename': self.new_entry.filename,
+            'new_text': self.new_entry.text,
+            'old_voice_id': self.old_entry.voice_id,
+            'old_script_id': self.old_entry.script_id,
+            'old_scene_id': self.old_entry.scene_id,
+            'old_scene_seq_id': self.old_entry.scene_seq_id,
+            'old_text': self.old_entry.text,
+            'character_id': self.old_entry.character_id,
+            'source_file': self.old_entry.source_file,
+            'match_type': self.match_type,
+            'classification': self.new_entry.classification
+        }
+
+    def csv_row(self):
+        """转换为 match_result.csv 中的一行。"""
+        classification = self.new_entry.classification
+        return [
+            self.new_entry.id,
+            self.new_entry.filename,
+            self.old_entry.script_id,
+            "ch" + self.old_entry.voice_id[:-1],
+            self.match_type,
+            classification['type'],
+            classification.get('character_id', ''),
+            classification.get('category', ''),
+            classification.get('number', ''),
+            self.new_entry.text,
+            self.old_entry.text
+        ]
+
+
+@dataclass(slots=True)
+class CandidateRecord:
+    """向量检索阶段为一个条目打过分的最佳候选项，无论最终是否被采用。"""
+    new_voice_id: int
+    stage: str
+    old_entry: OldVoiceEntry
+    score: float
+    text_similarity: float = None
+    verifier: str = None
+    accepted: bool = False
+
+
+@dataclass(slots=True)
+class UnmatchedRecord:
+    """一条未匹配的结果；reason 不为空时表示该条目被跳过。"""
+    new_entry: RemakeVoiceEntry
+    reason: str = None
+
+    def to_dict(self):
+        """转换为 unmatched_voice_data.json / skipped_voice_data.json 中的条目格式。"""
+        data = {
+            'new_voice_id': self.new_entry.id,
+            'new_filename': self.new_entry.filename,
+            'classification': self.new_entry.classification,
+            'text': self.new_entry.text,
+        }
+        if self.reason is not None:
+            data['reason'] = self.reason
+        return data
+
+    def csv_row(self):
+        """转换为 match_result.csv 中的一行。"""
+        classification = self.new_entry.classification
+        return [
+            self.new_entry.id,
+            self.new_entry.filename,
+            '',
+            '',
+            'skipped' if self.reason is not None else 'unmatched',
+            classification['type'],
+            classification.get('character_id', ''),
+            classification.get('category', ''),
+            classification.get('number', ''),
+            self.new_entry.text,
+            ''
+        ]